@@ -0,0 +1,201 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class ActiveGame:
+    """What a game in progress needs to check taps; the full game_data is not kept"""
+
+    __slots__ = (
+        'user_id', 'chat_id', 'game_id', 'difficulty', 'total_differences', 'width', 'height',
+        'join_fee', 'hit_index', 'view', 'started', 'deadline', 'attempts', 'found', 'awaiting_mark', 'nbytes'
+    )
+
+    def __init__(self, user_id, chat_id, game_data, join_fee, hit_index, view, started, deadline):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.game_id = game_data['game_id']
+        self.difficulty = game_data['difficulty']
+        self.total_differences = game_data['total_differences']
+        self.width = game_data['width']
+        self.height = game_data['height']
+        self.join_fee = join_fee
+        self.hit_index = hit_index
+        # (scale, dx, dy): how the pictures were delivered, see to_scene
+        self.view = view
+        self.started = started
+        self.deadline = deadline
+        self.attempts = 0
+        # Bit (id - 1) is set once difference id has been found
+        self.found = 0
+        self.awaiting_mark = False
+        self.nbytes = sys.getsizeof(self) + hit_index.nbytes()
+
+    def to_scene(self, x, y):
+        """Map a point on the delivered picture(s) to scene coordinates"""
+        scale, dx, dy = self.view
+        # The same spot on either half of a composite means the same scene point
+        if dx and x >= dx:
+            x -= dx
+        if dy and y >= dy:
+            y -= dy
+        return int(x / scale), int(y / scale)
+
+    def is_found(self, diff_id):
+        return bool(self.found >> (diff_id - 1) & 1)
+
+    def mark_found(self, diff_id):
+        self.found |= 1 << (diff_id - 1)
+
+    @property
+    def found_count(self):
+        return bin(self.found).count('1')
+
+
+class ActiveGameRegistry:
+    """Games in progress, one per user, with idle expiry and a hard cap
+
+    Deadlines live on a hashed timer wheel of `wheel_size` one-`tick` slots, so
+    each tick only looks at the games due around then instead of scanning them
+    all. A game that sees no activity for `ttl` seconds is expired and handed
+    to `on_expire`. At `max_games` the least recently active game is evicted
+    and handed to `on_evict`. A game replaced by the same user's next one is
+    handed to `on_replace`, so every game that leaves the registry is settled.
+    """
+
+    def __init__(self, ttl=1800, max_games=10000, tick=1.0, wheel_size=512, on_expire=None, on_evict=None,
+                 on_replace=None):
+        self.ttl = ttl
+        self.max_games = max_games
+        self.tick = tick
+        self.on_expire = on_expire
+        self.on_evict = on_evict
+        self.on_replace = on_replace
+        self.nbytes = 0
+        self.expired = 0
+        self.evicted = 0
+        self.replaced = 0
+
+        # Least recently active first
+        self._games = OrderedDict()
+        self._wheel = [set() for _ in range(wheel_size)]
+        self._slot_of = {}
+        self._current_tick = int(time.monotonic() // tick)
+        self._task = None
+
+    @classmethod
+    def from_env(cls, on_expire=None, on_evict=None, on_replace=None):
+        """Build a registry from ACTIVE_GAME_* environment variables"""
+        return cls(
+            ttl=float(os.getenv('ACTIVE_GAME_TTL', '1800')),
+            max_games=int(os.getenv('ACTIVE_GAME_MAX', '10000')),
+            on_expire=on_expire,
+            on_evict=on_evict,
+            on_replace=on_replace
+        )
+
+    def __len__(self):
+        return len(self._games)
+
+    def get(self, user_id):
+        return self._games.get(user_id)
+
+    def add(self, user_id, chat_id, game_data, join_fee, hit_index, view=(1.0, 0, 0)):
+        """Start tracking a game, replacing the user's previous one"""
+        replaced = self.remove(user_id)
+        if replaced is not None:
+            self.replaced += 1
+            if self.on_replace is not None:
+                self.on_replace(replaced)
+        while len(self._games) >= self.max_games:
+            oldest = self.remove(next(iter(self._games)))
+            self.evicted += 1
+            logger.warning(f"Active game cap reached, evicted game {oldest.game_id}")
+            if self.on_evict is not None:
+                self.on_evict(oldest)
+
+        now = time.monotonic()
+        game = ActiveGame(user_id, chat_id, game_data, join_fee, hit_index, view, time.time(), now + self.ttl)
+        self._games[user_id] = game
+        self.nbytes += game.nbytes
+        self._schedule(game)
+        return game
+
+    def touch(self, game):
+        """Push back a game's expiry after activity"""
+        self._unschedule(game)
+        game.deadline = time.monotonic() + self.ttl
+        self._schedule(game)
+        self._games.move_to_end(game.user_id)
+
+    def remove(self, user_id):
+        """Stop tracking a user's game and return it, or None"""
+        game = self._games.pop(user_id, None)
+        if game is not None:
+            self._unschedule(game)
+            self.nbytes -= game.nbytes
+        return game
+
+    def _schedule(self, game):
+        # Never due before the next tick, or advancing past it would miss the game
+        due_tick = max(int(game.deadline // self.tick), self._current_tick + 1)
+        slot = due_tick % len(self._wheel)
+        self._wheel[slot].add(game.user_id)
+        self._slot_of[game.user_id] = slot
+
+    def _unschedule(self, game):
+        slot = self._slot_of.pop(game.user_id)
+        self._wheel[slot].discard(game.user_id)
+
+    def expire(self, now=None):
+        """Remove and return every game past its deadline"""
+        now = time.monotonic() if now is None else now
+        target_tick = int(now // self.tick)
+        # After a long stall, one lap of the wheel already visits every slot
+        ticks = min(target_tick - self._current_tick, len(self._wheel))
+        expired = []
+        for step in range(1, ticks + 1):
+            slot = self._wheel[(self._current_tick + step) % len(self._wheel)]
+            # Games more than one lap out share the slot and stay for a later lap
+            for user_id in [u for u in slot if self._games[u].deadline <= now]:
+                expired.append(self.remove(user_id))
+        self._current_tick = max(self._current_tick, target_tick)
+        self.expired += len(expired)
+        return expired
+
+    def stats(self):
+        return {
+            'active_games': len(self._games),
+            'approx_bytes': self.nbytes,
+            'expired': self.expired,
+            'evicted': self.evicted,
+            'replaced': self.replaced
+        }
+
+    def start(self):
+        """Start the expiry loop; call from the running event loop"""
+        if self._task is None:
+            self._current_tick = int(time.monotonic() // self.tick)
+            self._task = asyncio.create_task(self._expiry_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _expiry_loop(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            for game in self.expire():
+                logger.info(f"Expired idle game {game.game_id}")
+                if self.on_expire is not None:
+                    self.on_expire(game)
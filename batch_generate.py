@@ -0,0 +1,83 @@
+import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from difference_game_generator import DifferenceGameGenerator
+from game_archive import write_shard, append_index, archive_progress
+
+_generator = None
+
+
+def _build_shard(output_dir, difficulty, shard_no, shard_size, image_format):
+    """Generate one shard's worth of games and write it; runs in a worker process"""
+    global _generator
+    if _generator is None:
+        _generator = DifferenceGameGenerator()
+
+    games = [
+        _generator.generate_encoded_game(difficulty_level=difficulty, image_format=image_format)
+        for _ in range(shard_size)
+    ]
+
+    return write_shard(output_dir, difficulty, shard_no, games)
+
+
+def plan_shards(count, difficulties, shard_size, progress):
+    """(difficulty, shard_no, size) for the shards still needed to reach count
+
+    Shards recorded in the index are kept; numbering carries on after them, so
+    a shard that was written but never indexed is simply rebuilt in place.
+    """
+    shards = []
+    for difficulty in difficulties:
+        games_done, next_shard = progress.get(difficulty, (0, 0))
+        remaining = max(0, count - games_done)
+        while remaining > 0:
+            size = min(shard_size, remaining)
+            shards.append((difficulty, next_shard, size))
+            next_shard += 1
+            remaining -= size
+    return shards
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-build puzzles into sharded tar archives")
+    parser.add_argument('--count', type=int, default=1000, help="games per difficulty level")
+    parser.add_argument('--difficulties', type=int, nargs='+', default=[50, 60, 70, 80, 90])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--shard-size', type=int, default=500, help="games per archive file")
+    parser.add_argument('--format', default='PNG', help="image format, e.g. PNG or WEBP")
+    parser.add_argument('--output-dir', default='archive')
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    progress = archive_progress(args.output_dir)
+    shards = plan_shards(args.count, args.difficulties, args.shard_size, progress)
+    total_games = sum(size for _, _, size in shards)
+
+    if progress:
+        print(f"Resuming: {sum(games for games, _ in progress.values())} games already built")
+    print(f"Building {len(shards)} shards ({total_games} games) with {args.workers} workers...")
+
+    started = time.perf_counter()
+    built = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        jobs = [
+            pool.submit(
+                _build_shard, args.output_dir, difficulty, shard_no, size, args.format
+            )
+            for difficulty, shard_no, size in shards
+        ]
+        for job in as_completed(jobs):
+            entries = job.result()
+            # Only the parent writes the index, so completed shards are recorded in order of completion
+            append_index(args.output_dir, entries)
+            built += len(entries)
+            elapsed = time.perf_counter() - started
+            print(f"{entries[0]['shard']}: {built}/{total_games} games, {built / elapsed:.1f} games/s")
+
+    print(f"Done in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+import os
+import sys
+import json
+import time
+import random
+import resource
+import platform
+import argparse
+import statistics
+import tracemalloc
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import PIL
+from difference_game_generator import DifferenceGameGenerator, GENERATOR_VERSION
+
+SCENE_SIZES = [(400, 300), (800, 600), (1600, 1200)]
+DIFF_TYPES = ['color_change', 'object_removal', 'object_addition', 'size_change', 'position_shift']
+DIFFICULTIES = [50, 60, 70, 80, 90]
+FORMATS = ['PNG', 'JPEG', 'WEBP']
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+# The gate compares each case's median over several rounds, each in a fresh process;
+# best-of-N and single-round medians moved by 25-40% between runs of an unchanged tree.
+# Growth below these floors is noise
+MIN_REGRESSION = {'median_ms': 0.25, 'alloc_peak_kib': 16}
+
+_scene = None
+
+
+def _base_scene(generator):
+    """One fixed 800x600 scene shared by the difference and encoding cases"""
+    global _scene
+    if _scene is None:
+        _scene = generator.create_base_scene(rng=random.Random(0))
+    return _scene
+
+
+def _scene_case(width, height):
+    def setup(generator, i):
+        return (width, height, random.Random(i))
+
+    def run(generator, args):
+        width, height, rng = args
+        generator.create_base_scene(width, height, rng=rng)
+
+    return setup, run
+
+
+def _difference_case(diff_type):
+    def setup(generator, i):
+        rng = random.Random(i)
+        position = (rng.randint(100, 700), rng.randint(100, 500))
+        return _base_scene(generator).copy(), position, rng
+
+    def run(generator, args):
+        img, position, rng = args
+        generator.apply_difference(img, diff_type, generator.difficulty_configs[70], position, rng=rng)
+
+    return setup, run
+
+
+def _generate_case(difficulty, num_differences=5):
+    def setup(generator, i):
+        return i
+
+    def run(generator, seed):
+        generator.generate_game(difficulty_level=difficulty, num_differences=num_differences, seed=seed)
+
+    return setup, run
+
+
+def _encode_case(image_format):
+    def setup(generator, i):
+        return _base_scene(generator)
+
+    def run(generator, img):
+        generator.encode_image(img, image_format)
+
+    return setup, run
+
+
+def cases():
+    """name -> (setup, run); setup builds per-iteration inputs outside the timed region"""
+    table = {}
+    for width, height in SCENE_SIZES:
+        table[f"scene_{width}x{height}"] = _scene_case(width, height)
+    for diff_type in DIFF_TYPES:
+        table[f"diff_{diff_type}"] = _difference_case(diff_type)
+    for difficulty in DIFFICULTIES:
+        table[f"generate_{difficulty}"] = _generate_case(difficulty)
+    # Dense puzzles stress difference placement
+    table["generate_70_dense"] = _generate_case(70, num_differences=25)
+    for image_format in FORMATS:
+        table[f"encode_{image_format.lower()}"] = _encode_case(image_format)
+    return table
+
+
+def run_case(name, repeat):
+    """Measure one case; runs in a fresh process so peak RSS belongs to this case alone"""
+    setup, run = cases()[name]
+    generator = DifferenceGameGenerator()
+
+    # Warm caches (sprite atlas, codecs) so they don't count against the first sample
+    run(generator, setup(generator, 0))
+
+    samples = []
+    for i in range(repeat):
+        args = setup(generator, i + 1)
+        started = time.perf_counter()
+        run(generator, args)
+        samples.append((time.perf_counter() - started) * 1000)
+
+    # Allocations are measured separately; tracemalloc would distort the timings.
+    # It sees Python and NumPy allocations, not Pillow's image buffers, which show up in RSS
+    args = setup(generator, repeat + 1)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    run(generator, args)
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename') if stat.count_diff > 0)
+
+    samples.sort()
+    return {
+        'median_ms': round(statistics.median(samples), 3),
+        'min_ms': round(samples[0], 3),
+        'p90_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.9))], 3),
+        'alloc_peak_kib': round(peak / 1024, 1),
+        'alloc_blocks': blocks,
+        # ru_maxrss is KiB on Linux
+        'peak_rss_mib': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+
+def run_rounds(names, count, repeat, rounds, context):
+    """Append `count` more rounds of each case, each in a fresh process, to rounds[name]"""
+    # Rounds go over every case in turn, so a burst of load on the machine
+    # lands on one round of many cases rather than every round of one
+    for round_no in range(count):
+        print(f"Round {round_no + 1}/{count}", end='\r', flush=True)
+        for name in names:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                rounds[name].append(pool.submit(run_case, name, repeat).result())
+
+
+def combine(rounds):
+    """One result from several rounds of a case: medians of the per-round figures"""
+    medians = sorted(result['median_ms'] for result in rounds)
+    if len(medians) >= 4:
+        # One round stalled by the machine, or lucky, shouldn't decide the case's noise
+        medians = medians[1:-1]
+    combined = {
+        metric: round(statistics.median(result[metric] for result in rounds), 3)
+        for metric in ('median_ms', 'p90_ms', 'alloc_peak_kib', 'alloc_blocks', 'peak_rss_mib')
+    }
+    combined['min_ms'] = min(result['min_ms'] for result in rounds)
+    # How far apart the rounds' medians were, as a share of their median: the case's noise
+    combined['spread'] = round((medians[-1] - medians[0]) / combined['median_ms'], 3) if combined['median_ms'] else 0.0
+    return combined
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pillow': PIL.__version__,
+        'generator_version': GENERATOR_VERSION,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+
+
+def compare(results, baseline, threshold):
+    """Descriptions of cases whose time or allocation peak grew past threshold"""
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get('cases', {}).get(name)
+        if reference is None:
+            continue
+        # A case that was already noisy when the baseline was taken gets a wider timing
+        # allowance, at most double the threshold; the current run's noise never widens it
+        noise = min(reference.get('spread', 0.0), threshold)
+        for metric, floor in MIN_REGRESSION.items():
+            allowed = threshold + noise if metric == 'median_ms' else threshold
+            if result[metric] > reference[metric] * (1 + allowed) and result[metric] - reference[metric] > floor:
+                regressions.append(f"{name}: {metric} {reference[metric]} -> {result[metric]}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the difference game generator")
+    parser.add_argument('--repeat', type=int, default=30, help="timed runs per case and round")
+    parser.add_argument('--rounds', type=int, default=5, help="fresh processes per case; the gate uses their median")
+    parser.add_argument('--only', nargs='+', help="run cases whose names contain any of these")
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help="write results as the new baseline")
+    parser.add_argument('--threshold', type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    args = parser.parse_args()
+
+    names = [n for n in cases() if not args.only or any(part in n for part in args.only)]
+    rounds = {name: [] for name in names}
+    context = multiprocessing.get_context('spawn')
+    run_rounds(names, args.rounds, args.repeat, rounds, context)
+    # Cases whose rounds still disagree by more than the threshold get as many again
+    noisy = [name for name in names if combine(rounds[name])['spread'] > args.threshold]
+    if noisy:
+        print(f"Re-running {len(noisy)} noisy cases")
+        run_rounds(noisy, args.rounds, args.repeat, rounds, context)
+
+    results = {}
+    print(f"{'case':<24}{'median ms':>11}{'min ms':>9}{'p90 ms':>9}{'spread':>8}{'alloc KiB':>11}{'blocks':>9}"
+          f"{'RSS MiB':>9}")
+    for name in names:
+        result = results[name] = combine(rounds[name])
+        print(
+            f"{name:<24}{result['median_ms']:>11.2f}{result['min_ms']:>9.2f}{result['p90_ms']:>9.2f}"
+            f"{result['spread']:>8.0%}{result['alloc_peak_kib']:>11.1f}{result['alloc_blocks']:>9.0f}"
+            f"{result['peak_rss_mib']:>9.1f}"
+        )
+
+    noisy = {name: result['spread'] for name, result in results.items() if result['spread'] > args.threshold}
+    if noisy:
+        print(f"Warning: rounds still disagree by more than {args.threshold:.0%}, "
+              f"so a slowdown that size can't be told from noise:")
+        for name, spread in noisy.items():
+            print(f"  {name}: spread {spread:.0%}")
+
+    report = {'environment': environment(), 'repeat': args.repeat, 'rounds': args.rounds, 'cases': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"Regressions past {args.threshold:.0%}:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print(f"No regressions past {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,195 +1,454 @@
 import os
+import io
+import time
 import random
 import json
 from PIL import Image, ImageDraw, ImageFilter, ImageEnhance
 import numpy as np
 from datetime import datetime
 import uuid
+from hit_index import pack_mask
+from scene_compositor import SceneCompositor, THEMES
+from game_storage import GameStorage
+from image_pyramid import ImagePyramid
+from placement import PlacementGrid, PlacementError
+from visibility import region_pixels, pixels_image, blend_pixels, visibility_score
+
+# Bump whenever a change to the renderer alters the images produced for a seed, and
+# keep the old path reachable from render_game so past games can still be recreated.
+# Version 5 only changed the batch renderer, since removed; its games render as version 4's.
+GENERATOR_VERSION = 5
+
+DIFF_TYPES = ['color_change', 'object_removal', 'object_addition', 'size_change', 'position_shift']
+
+# How a game's two images are delivered: as two photos, as one album, or composited into one photo
+LAYOUTS = ('separate', 'album', 'side_by_side', 'stacked')
+COMPOSITE_GAP = 12
+
+# Per-difficulty delivery encoding. Quality None means lossless. For these
+# flat-colour scenes lossless WebP came out smallest at every level (about a
+# fifth of PNG, a twentieth of JPEG at quality 85) and keeps the faintest 90%
+# differences exact. Downscaling only added anti-aliased edges that made
+# files larger, so the defaults keep full size. Lossy or downscaled profiles
+# can be set with parse_encoding_profiles.
+DEFAULT_ENCODING_PROFILES = {
+    level: {'image_format': 'WEBP', 'quality': None, 'scale': 1.0} for level in (50, 60, 70, 80, 90)
+}
+
+
+def parse_encoding_profiles(spec, defaults=DEFAULT_ENCODING_PROFILES):
+    """Parse "50=JPEG:80:0.75,90=WEBP" into per-level encoding settings
+
+    Each entry is level=FORMAT[:quality[:scale]]; quality may be 'lossless'.
+    Levels not mentioned keep their defaults.
+    """
+    profiles = {level: dict(profile) for level, profile in defaults.items()}
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        level, _, settings = entry.partition('=')
+        fields = settings.split(':')
+        quality = fields[1] if len(fields) > 1 else 'lossless'
+        profiles[int(level)] = {
+            'image_format': fields[0].upper(),
+            'quality': None if quality == 'lossless' else int(quality),
+            'scale': float(fields[2]) if len(fields) > 2 else 1.0
+        }
+    return profiles
+
+
+def panel_offset(width, height, layout):
+    """Where the second picture starts inside a composite, in delivered pixels"""
+    if layout == 'side_by_side':
+        return width + COMPOSITE_GAP, 0
+    if layout == 'stacked':
+        return 0, height + COMPOSITE_GAP
+    return 0, 0
+
+class StageTimer:
+    """Appends (stage, seconds since the previous lap) to a list"""
+    
+    def __init__(self, timings):
+        self.timings = timings
+        self.mark = time.perf_counter()
+    
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.timings.append((stage, now - self.mark))
+        self.mark = now
 
 class DifferenceGameGenerator:
-    def __init__(self):
+    def __init__(self, scene_density=1.0):
+        # Sprites are rasterized once per generator and pasted into every scene
+        self.compositor = SceneCompositor()
+        self.scene_density = scene_density
+        self.themes = sorted(THEMES)
+        # Redraws allowed for a difference too faint for its level, and fading
+        # steps for one too obvious; see calibrated_difference
+        self.visibility_attempts = 4
+        self.visibility_fades = 3
         self.difficulty_configs = {
             50: {
                 'color_shift_range': (30, 80),
                 'size_change_range': (0.3, 0.7),
                 'blur_intensity': (0, 1),
                 'position_shift': (10, 30),
-                'opacity_change': (0.3, 0.8)
+                'opacity_change': (0.3, 0.8),
+                # visibility_score band, see visibility.py
+                'visibility': (16, float('inf'))
             },
             60: {
                 'color_shift_range': (20, 50),
                 'size_change_range': (0.5, 0.8),
                 'blur_intensity': (0, 0.5),
                 'position_shift': (5, 20),
-                'opacity_change': (0.5, 0.9)
+                'opacity_change': (0.5, 0.9),
+                'visibility': (10, 16)
             },
             70: {
                 'color_shift_range': (10, 30),
                 'size_change_range': (0.7, 0.9),
                 'blur_intensity': (0, 0.3),
                 'position_shift': (3, 15),
-                'opacity_change': (0.7, 0.95)
+                'opacity_change': (0.7, 0.95),
+                'visibility': (6, 10)
             },
             80: {
                 'color_shift_range': (5, 20),
                 'size_change_range': (0.8, 0.95),
                 'blur_intensity': (0, 0.2),
                 'position_shift': (2, 10),
-                'opacity_change': (0.8, 0.98)
+                'opacity_change': (0.8, 0.98),
+                'visibility': (3, 6)
             },
             90: {
                 'color_shift_range': (2, 10),
                 'size_change_range': (0.9, 0.98),
                 'blur_intensity': (0, 0.1),
                 'position_shift': (1, 5),
-                'opacity_change': (0.9, 0.99)
+                'opacity_change': (0.9, 0.99),
+                'visibility': (1, 3)
             }
         }
     
-    def create_base_scene(self, width=800, height=600):
+    def compose_scene(self, width=800, height=600, rng=None, theme='countryside', density=None, scale=1.0):
+        """Generate a base scene and the bounding boxes of the objects in it"""
+        if density is None:
+            density = self.scene_density
+        return self.compositor.compose(width, height, rng=rng, theme=theme, density=density, scale=scale)
+    
+    def create_base_scene(self, width=800, height=600, rng=None, theme='countryside', density=None):
         """Generate a base scene with random objects"""
+        img, _ = self.compose_scene(width, height, rng=rng, theme=theme, density=density)
+        return img
+    
+    def legacy_base_scene(self, rng):
+        """The hand-drawn 800x600 scene of generator version 1, kept so its games can be recreated"""
+        width, height = 800, 600
         img = Image.new('RGB', (width, height), color=(135, 206, 235))  # Sky blue
         draw = ImageDraw.Draw(img)
         
-        # Add background elements
         # Ground
         draw.rectangle([0, height-100, width, height], fill=(34, 139, 34))
         
         # Sun
-        sun_x, sun_y = random.randint(50, width-50), random.randint(50, 150)
+        sun_x, sun_y = rng.randint(50, width-50), rng.randint(50, 150)
         draw.ellipse([sun_x-30, sun_y-30, sun_x+30, sun_y+30], fill=(255, 255, 0))
         
         # Clouds
-        for _ in range(random.randint(2, 4)):
-            cloud_x = random.randint(50, width-100)
-            cloud_y = random.randint(50, 200)
+        for _ in range(rng.randint(2, 4)):
+            cloud_x = rng.randint(50, width-100)
+            cloud_y = rng.randint(50, 200)
             draw.ellipse([cloud_x, cloud_y, cloud_x+60, cloud_y+30], fill=(255, 255, 255))
             draw.ellipse([cloud_x+20, cloud_y-10, cloud_x+80, cloud_y+20], fill=(255, 255, 255))
         
         # Trees
-        for _ in range(random.randint(3, 6)):
-            tree_x = random.randint(50, width-50)
+        for _ in range(rng.randint(3, 6)):
+            tree_x = rng.randint(50, width-50)
             tree_y = height - 100
-            # Trunk
             draw.rectangle([tree_x-10, tree_y-60, tree_x+10, tree_y], fill=(139, 69, 19))
-            # Leaves
             draw.ellipse([tree_x-25, tree_y-90, tree_x+25, tree_y-40], fill=(0, 128, 0))
         
         # Houses
-        for _ in range(random.randint(1, 3)):
-            house_x = random.randint(100, width-150)
+        for _ in range(rng.randint(1, 3)):
+            house_x = rng.randint(100, width-150)
             house_y = height - 100
-            # House body
             draw.rectangle([house_x, house_y-80, house_x+80, house_y], fill=(205, 133, 63))
-            # Roof
             draw.polygon([house_x-10, house_y-80, house_x+90, house_y-80, house_x+40, house_y-120], fill=(139, 0, 0))
-            # Door
             draw.rectangle([house_x+30, house_y-40, house_x+50, house_y], fill=(101, 67, 33))
-            # Windows
             draw.rectangle([house_x+10, house_y-60, house_x+25, house_y-45], fill=(173, 216, 230))
             draw.rectangle([house_x+55, house_y-60, house_x+70, house_y-45], fill=(173, 216, 230))
         
         return img
     
-    def apply_difference(self, img, diff_type, intensity, position):
-        """Apply a specific type of difference to the image"""
-        img_copy = img.copy()
-        draw = ImageDraw.Draw(img_copy)
+    def clip_box(self, img, box):
+        """Clip a (left, top, right, bottom) box to the image bounds"""
+        left, top, right, bottom = box
+        return (max(0, left), max(0, top), min(img.width, right), min(img.height, bottom))
+    
+    def union_box(self, box_a, box_b):
+        """Smallest box containing both boxes"""
+        return (
+            min(box_a[0], box_b[0]), min(box_a[1], box_b[1]),
+            max(box_a[2], box_b[2]), max(box_a[3], box_b[3])
+        )
+    
+    def apply_difference(self, img, diff_type, intensity, position, rng=None, scale=1.0):
+        """Apply a specific type of difference to the image in place
+        
+        Only the affected rectangle is read or written. Returns the bounding
+        box (left, top, right, bottom) of the pixels that may have changed.
+        Sizes are multiplied by `scale`, for scenes rendered above 800x600.
+        """
+        rng = rng or random
+        draw = ImageDraw.Draw(img)
+        gap = round(5 * scale)
         
         x, y = position
         
         if diff_type == 'color_change':
             # Change color of a region
-            color_shift = random.randint(*intensity['color_shift_range'])
-            region_size = random.randint(20, 60)
+            color_shift = rng.randint(*intensity['color_shift_range'])
+            region_size = round(rng.randint(20, 60) * scale)
             
             # Extract region and modify color
             region = img.crop((x, y, x+region_size, y+region_size))
             enhancer = ImageEnhance.Color(region)
-            region = enhancer.enhance(random.uniform(0.2, 2.0))
-            img_copy.paste(region, (x, y))
+            region = enhancer.enhance(rng.uniform(0.2, 2.0))
+            img.paste(region, (x, y))
+            bbox = (x, y, x+region_size, y+region_size)
             
         elif diff_type == 'object_removal':
             # Remove an object by painting over it
-            region_size = random.randint(30, 80)
-            # Sample surrounding color and paint over
-            surrounding_color = img.getpixel((x+region_size+5, y+region_size+5))
+            region_size = round(rng.randint(30, 80) * scale)
+            # Sample surrounding color (outside the ellipse) and paint over
+            surrounding_color = img.getpixel((x+region_size+gap, y+region_size+gap))
             draw.ellipse([x, y, x+region_size, y+region_size], fill=surrounding_color)
+            bbox = (x, y, x+region_size+1, y+region_size+1)
             
         elif diff_type == 'object_addition':
             # Add a new small object
             colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0), (255, 0, 255)]
-            color = random.choice(colors)
-            size = random.randint(10, 30)
+            color = rng.choice(colors)
+            size = round(rng.randint(10, 30) * scale)
             draw.ellipse([x, y, x+size, y+size], fill=color)
+            bbox = (x, y, x+size+1, y+size+1)
             
         elif diff_type == 'size_change':
             # Change size of existing element
-            region_size = random.randint(40, 100)
+            region_size = round(rng.randint(40, 100) * scale)
             region = img.crop((x, y, x+region_size, y+region_size))
             
-            scale_factor = random.uniform(*intensity['size_change_range'])
+            scale_factor = rng.uniform(*intensity['size_change_range'])
             new_size = (int(region_size * scale_factor), int(region_size * scale_factor))
             region = region.resize(new_size, Image.Resampling.LANCZOS)
             
             # Paste back
-            img_copy.paste(region, (x, y))
+            img.paste(region, (x, y))
+            bbox = (x, y, x+new_size[0], y+new_size[1])
             
         elif diff_type == 'position_shift':
             # Shift an object slightly
-            region_size = random.randint(30, 70)
+            region_size = round(rng.randint(30, 70) * scale)
+            # Crop before covering, so the patch still holds the object
             region = img.crop((x, y, x+region_size, y+region_size))
             
             # Cover original position
-            surrounding_color = img.getpixel((x+region_size+5, y+region_size+5))
+            surrounding_color = img.getpixel((x+region_size+gap, y+region_size+gap))
             draw.rectangle([x, y, x+region_size, y+region_size], fill=surrounding_color)
             
             # Paste in new position
-            shift_x = random.randint(*intensity['position_shift'])
-            shift_y = random.randint(*intensity['position_shift'])
+            shift_x = round(rng.randint(*intensity['position_shift']) * scale)
+            shift_y = round(rng.randint(*intensity['position_shift']) * scale)
             new_x = max(0, min(img.width - region_size, x + shift_x))
             new_y = max(0, min(img.height - region_size, y + shift_y))
-            img_copy.paste(region, (new_x, new_y))
+            img.paste(region, (new_x, new_y))
+            bbox = self.union_box(
+                (x, y, x+region_size+1, y+region_size+1),
+                (new_x, new_y, new_x+region_size, new_y+region_size)
+            )
         
-        return img_copy
+        else:
+            raise ValueError(f"Unknown difference type {diff_type}")
+        
+        return self.clip_box(img, bbox)
     
-    def generate_game(self, difficulty_level=50, num_differences=5):
-        """Generate a complete find the difference game"""
+    def difference_extent(self, diff_type, intensity):
+        """Largest square, in base pixels, that apply_difference may read or write from its position"""
+        if diff_type == 'color_change':
+            return 60
+        if diff_type == 'object_removal':
+            # The ellipse plus the pixel sampled past its corner
+            return 80 + 6
+        if diff_type == 'object_addition':
+            return 31
+        if diff_type == 'size_change':
+            return 100
+        if diff_type == 'position_shift':
+            return 70 + max(6, intensity['position_shift'][1] + 1)
+        raise ValueError(f"Unknown difference type {diff_type}")
+    
+    def calibrated_difference(self, original_img, modified_img, diff_type, intensity, position, extent, rng=None,
+                              scale=1.0):
+        """Apply a difference and bring its visibility score into the level's band
+        
+        A difference that is too obvious is faded toward the original pixels;
+        one that is too faint is redrawn at the same position, as any type that
+        fits the `extent` reserved for it. If no attempt lands in the band the
+        closest one is kept. Returns (diff_type, bbox, changed mask, score).
+        """
+        rng = rng or random
+        low, high = intensity['visibility']
+        fits = [t for t in DIFF_TYPES if self.difference_extent(t, intensity) <= extent]
+        best = None
+        for attempt in range(self.visibility_attempts):
+            if attempt:
+                diff_type = rng.choice(fits)
+            bbox = self.apply_difference(modified_img, diff_type, intensity, position, rng=rng, scale=scale)
+            before, after = region_pixels(original_img, bbox), region_pixels(modified_img, bbox)
+            changed = before != after
+            score = visibility_score(before, after, changed, scale)
+            
+            if score > high:
+                # Fading scales delta E about linearly, so aim by ratio, but keep the fade
+                # inside the bracket already known to be too faint or too obvious
+                target, full = (low + high) / 2, after
+                faint, obvious, alpha = 0.0, 1.0, 1.0
+                for _ in range(self.visibility_fades):
+                    if score > high:
+                        obvious = alpha
+                    else:
+                        faint = alpha
+                    alpha = alpha * target / score if score else 0
+                    if not faint < alpha < obvious:
+                        alpha = (faint + obvious) / 2
+                    after = blend_pixels(before, full, alpha)
+                    changed = before != after
+                    score = visibility_score(before, after, changed, scale)
+                    if low <= score <= high:
+                        break
+                modified_img.paste(pixels_image(after), bbox[:2])
+            
+            miss = max(low - score, score - high, 0)
+            if not miss:
+                return diff_type, bbox, changed, score
+            if best is None or miss < best[0]:
+                best = (miss, diff_type, bbox, changed, score, after)
+            # Undo the attempt; differences never overlap, so the original pixels are the right ones
+            modified_img.paste(pixels_image(before), bbox[:2])
+        
+        _, diff_type, bbox, changed, score, after = best
+        modified_img.paste(pixels_image(after), bbox[:2])
+        return diff_type, bbox, changed, score
+    
+    def difference_mask(self, original_img, modified_img, bbox, changed=None):
+        """Bit-packed mask of the pixels inside bbox that differ between the images
+        
+        Pass `changed` when the per-pixel comparison is already at hand.
+        """
+        mask = changed
+        if mask is None:
+            before = np.asarray(original_img.crop(bbox))
+            after = np.asarray(modified_img.crop(bbox))
+            mask = (before != after).any(axis=2)
+        if not mask.any():
+            # The change blended into the scene; fall back to the whole box so
+            # the difference can still be found
+            mask = np.ones_like(mask)
+        return pack_mask(mask)
+    
+    def place_difference(self, grid, rng, intensity, by_extent, index, num_differences):
+        """Draw a difference type and reserve its spot on the grid; returns (diff_type, x, y) in base pixels"""
+        # Choose difference type; on a crowded canvas fall back to the smaller ones
+        diff_type = rng.choice(DIFF_TYPES)
+        for diff_type in [diff_type] + [t for t in by_extent if t != diff_type]:
+            try:
+                x, y = grid.place(
+                    rng, self.difference_extent(diff_type, intensity), anchored=diff_type != 'object_addition'
+                )
+                return diff_type, x, y
+            except PlacementError:
+                continue
+        raise PlacementError(f"Only room for {index} of {num_differences} differences")
+    
+    def generate_game(self, difficulty_level=50, num_differences=5, seed=None, game_id=None, theme=None, density=None,
+                      timings=None, render_scale=1.0):
+        """Generate a complete find the difference game
+        
+        Everything random is drawn from one RNG seeded with `seed`, so the
+        same (seed, difficulty, GENERATOR_VERSION) always renders the same game.
+        Pass a list as `timings` to have (stage, seconds) pairs appended to it.
+        A `render_scale` above 1 draws the same game at that multiple of
+        800x600, for zoom tiles; positions in game_data are then in those pixels.
+        """
+        timer = StageTimer(timings) if timings is not None else None
         if difficulty_level not in self.difficulty_configs:
             raise ValueError(f"Difficulty level {difficulty_level} not supported")
         
-        # Create base image
-        original_img = self.create_base_scene()
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(63)
+        rng = random.Random(seed)
+        # Always draw the theme so an explicit theme leaves the RNG stream unchanged
+        drawn_theme = rng.choice(self.themes)
+        if theme is None:
+            theme = drawn_theme
+        if density is None:
+            density = self.scene_density
+        
+        # Create base image, plus the single working buffer every difference is patched into
+        width, height = 800, 600
+        original_img, objects = self.compose_scene(width, height, rng=rng, theme=theme, density=density,
+                                                   scale=render_scale)
         modified_img = original_img.copy()
+        if timer:
+            timer.lap('scene')
         
         # Track differences for validation
         differences = []
+        changed_masks = []
         intensity = self.difficulty_configs[difficulty_level]
         
-        # Apply differences
-        diff_types = ['color_change', 'object_removal', 'object_addition', 'size_change', 'position_shift']
+        # Apply differences; they go on scene objects and never overlap each other
+        grid = PlacementGrid(width, height, objects, scale=render_scale)
+        by_extent = sorted(DIFF_TYPES, key=lambda t: self.difference_extent(t, intensity))
         
         for i in range(num_differences):
-            # Choose random position (avoid edges)
-            x = random.randint(50, original_img.width - 150)
-            y = random.randint(50, original_img.height - 150)
-            
-            # Choose difference type
-            diff_type = random.choice(diff_types)
+            diff_type, x, y = self.place_difference(grid, rng, intensity, by_extent, i, num_differences)
+            x, y = round(x * render_scale), round(y * render_scale)
             
-            # Apply difference
-            modified_img = self.apply_difference(modified_img, diff_type, intensity, (x, y))
+            # Apply difference, scored and redrawn until it is as visible as the level asks
+            diff_type, bbox, changed, score = self.calibrated_difference(
+                original_img, modified_img, diff_type, intensity, (x, y),
+                self.difference_extent(diff_type, intensity), rng=rng, scale=render_scale
+            )
+            if timer:
+                timer.lap(f'difference.{diff_type}')
             
             differences.append({
                 'type': diff_type,
                 'position': (x, y),
+                'bbox': bbox,
+                'visibility': round(score, 2),
                 'id': i + 1
             })
+            changed_masks.append(changed)
+        
+        # Record the exact footprint of every difference for tap validation
+        for diff, changed in zip(differences, changed_masks):
+            diff['mask'] = self.difference_mask(original_img, modified_img, diff['bbox'], changed)
+        if timer:
+            timer.lap('masks')
         
         # Create game data
         game_data = {
-            'game_id': str(uuid.uuid4()),
+            'game_id': game_id or str(uuid.uuid4()),
             'difficulty': difficulty_level,
+            'seed': seed,
+            'theme': theme,
+            'density': density,
+            'renderer': 'single',
+            'render_scale': render_scale,
+            'generator_version': GENERATOR_VERSION,
+            'width': original_img.width,
+            'height': original_img.height,
             'differences': differences,
             'created_at': datetime.now().isoformat(),
             'total_differences': num_differences
@@ -201,32 +460,237 @@ class DifferenceGameGenerator:
             'game_data': game_data
         }
     
-    def save_game(self, game_result, output_dir='games'):
-        """Save game images and data to files"""
-        os.makedirs(output_dir, exist_ok=True)
+    def game_record(self, game_data):
+        """The few fields needed to re-render a game exactly"""
+        return {
+            'game_id': game_data['game_id'],
+            'seed': game_data['seed'],
+            'theme': game_data['theme'],
+            'density': game_data['density'],
+            'renderer': game_data['renderer'],
+            'render_scale': game_data.get('render_scale', 1.0),
+            'difficulty': game_data['difficulty'],
+            'total_differences': game_data['total_differences'],
+            'generator_version': game_data['generator_version'],
+            'created_at': game_data['created_at']
+        }
+    
+    def render_game(self, record):
+        """Re-render a game from its record, whichever generator version made it"""
+        version = record['generator_version']
+        if not 1 <= version <= GENERATOR_VERSION:
+            raise ValueError(
+                f"Game {record['game_id']} was made by generator version {version}, "
+                f"this is version {GENERATOR_VERSION}"
+            )
+        if version < 4:
+            game = self.render_legacy_game(record)
+        else:
+            game = self.generate_game(
+                difficulty_level=record['difficulty'],
+                num_differences=record['total_differences'],
+                seed=record['seed'],
+                game_id=record['game_id'],
+                theme=record['theme'],
+                density=record['density'],
+                render_scale=record.get('render_scale', 1.0)
+            )
+        # Keep the record's version so the render cache finds what it stored
+        game['game_data']['generator_version'] = version
+        game['game_data']['created_at'] = record['created_at']
+        return game
+    
+    def render_legacy_game(self, record):
+        """Re-render a game made before visibility calibration, generator versions 1-3
         
-        game_id = game_result['game_data']['game_id']
-        difficulty = game_result['game_data']['difficulty']
+        Version 1 drew the hand-drawn scene and version 2 the sprite compositor,
+        both with differences at independent random positions. Version 3 placed
+        them on the occupancy grid. None of them scored or redrew differences.
+        """
+        version = record['generator_version']
+        intensity = self.difficulty_configs[record['difficulty']]
+        render_scale = record.get('render_scale', 1.0)
+        num_differences = record['total_differences']
+        rng = random.Random(record['seed'])
         
-        # Save images
-        original_path = f"{output_dir}/{game_id}_original.png"
-        modified_path = f"{output_dir}/{game_id}_modified.png"
-        data_path = f"{output_dir}/{game_id}_data.json"
+        width, height = 800, 600
+        if version == 1:
+            original_img = self.legacy_base_scene(rng)
+        else:
+            # The theme was always drawn, even when the record's was passed in
+            rng.choice(self.themes)
+            original_img, objects = self.compose_scene(
+                width, height, rng=rng, theme=record['theme'], density=record['density'], scale=render_scale
+            )
+        modified_img = original_img.copy()
+        if version == 3:
+            grid = PlacementGrid(width, height, objects, scale=render_scale)
+            by_extent = sorted(DIFF_TYPES, key=lambda t: self.difference_extent(t, intensity))
         
-        game_result['original_image'].save(original_path)
-        game_result['modified_image'].save(modified_path)
+        differences = []
+        for i in range(num_differences):
+            if version == 3:
+                diff_type, x, y = self.place_difference(grid, rng, intensity, by_extent, i, num_differences)
+                x, y = round(x * render_scale), round(y * render_scale)
+            else:
+                x = round(rng.randint(50, width - 150) * render_scale)
+                y = round(rng.randint(50, height - 150) * render_scale)
+                diff_type = rng.choice(DIFF_TYPES)
+            bbox = self.apply_difference(modified_img, diff_type, intensity, (x, y), rng=rng, scale=render_scale)
+            differences.append({'type': diff_type, 'position': (x, y), 'bbox': bbox, 'id': i + 1})
         
-        # Save game data
-        with open(data_path, 'w') as f:
-            json.dump(game_result['game_data'], f, indent=2)
+        for diff in differences:
+            diff['mask'] = self.difference_mask(original_img, modified_img, diff['bbox'])
         
+        game_data = {
+            'game_id': record['game_id'],
+            'difficulty': record['difficulty'],
+            'seed': record['seed'],
+            'theme': record.get('theme'),
+            'density': record.get('density'),
+            'renderer': record.get('renderer'),
+            'render_scale': render_scale,
+            'generator_version': version,
+            'width': original_img.width,
+            'height': original_img.height,
+            'differences': differences,
+            'created_at': record['created_at'],
+            'total_differences': num_differences
+        }
         return {
-            'original_path': original_path,
-            'modified_path': modified_path,
-            'data_path': data_path,
-            'game_id': game_id,
-            'difficulty': difficulty
+            'original_image': original_img,
+            'modified_image': modified_img,
+            'game_data': game_data
         }
+    
+    def encode_image(self, img, image_format='PNG', quality=None):
+        """Encode an image into an in-memory buffer; quality None is lossless where the format allows"""
+        options = {}
+        if quality is not None:
+            options['quality'] = quality
+        elif image_format == 'WEBP':
+            # Methods 0-2 came out several times larger on these scenes; 3+ are all the same size
+            options = {'lossless': True, 'method': 3}
+        buffer = io.BytesIO()
+        img.save(buffer, format=image_format, **options)
+        return buffer.getvalue()
+    
+    def composite_images(self, original_img, modified_img, layout):
+        """Both pictures in one image, separated by a white gap"""
+        dx, dy = panel_offset(original_img.width, original_img.height, layout)
+        composite = Image.new('RGB', (original_img.width + dx, original_img.height + dy), 'white')
+        composite.paste(original_img, (0, 0))
+        composite.paste(modified_img, (dx, dy))
+        return composite
+    
+    def encode_game(self, game_result, image_format='PNG', quality=None, scale=1.0, layout='separate'):
+        """Encode the game images in memory, without touching disk
+        
+        Composite layouts produce a single 'composite_bytes' image instead of
+        'original_bytes' and 'modified_bytes'.
+        """
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown layout: {layout}")
+        original_img, modified_img = game_result['original_image'], game_result['modified_image']
+        if scale != 1.0:
+            size = (round(original_img.width * scale), round(original_img.height * scale))
+            original_img = original_img.resize(size, Image.LANCZOS)
+            modified_img = modified_img.resize(size, Image.LANCZOS)
+        
+        encoded = {
+            'image_format': image_format,
+            'layout': layout,
+            'scale': scale,
+            'game_data': game_result['game_data']
+        }
+        if layout in ('side_by_side', 'stacked'):
+            composite = self.composite_images(original_img, modified_img, layout)
+            encoded['composite_bytes'] = self.encode_image(composite, image_format, quality)
+        else:
+            encoded['original_bytes'] = self.encode_image(original_img, image_format, quality)
+            encoded['modified_bytes'] = self.encode_image(modified_img, image_format, quality)
+        return encoded
+    
+    def generate_encoded_game(self, difficulty_level=50, num_differences=5, image_format='PNG', seed=None, timings=None,
+                              render_scale=1.0, **encoding):
+        """Generate a game and return encoded image buffers with its metadata
+        
+        Extra keyword arguments (quality, scale, layout) go to encode_game.
+        """
+        game = self.generate_game(
+            difficulty_level=difficulty_level, num_differences=num_differences, seed=seed, timings=timings,
+            render_scale=render_scale
+        )
+        if timings is None:
+            return self.encode_game(game, image_format, **encoding)
+        timer = StageTimer(timings)
+        encoded = self.encode_game(game, image_format, **encoding)
+        timer.lap('encode')
+        return encoded
+    
+    def render_encoded_game(self, record, image_format='PNG', **encoding):
+        """Re-render a game from its record and encode it"""
+        return self.encode_game(self.render_game(record), image_format, **encoding)
+    
+    def build_pyramid(self, game_result, scale=1.0):
+        """Zoom pyramid of a game whose pictures are delivered at `scale`"""
+        original_img = game_result['original_image']
+        view_size = (round(original_img.width * scale), round(original_img.height * scale))
+        return ImagePyramid(original_img, game_result['modified_image'], view_size)
+    
+    def encode_tile(self, pyramid, game_data, zoom, row, col, image_format='PNG', quality=None, layout='stacked'):
+        """Encode one zoom tile of both pictures, in the shape of encode_game plus its 'tile'"""
+        if layout not in ('side_by_side', 'stacked'):
+            # A tile is always one upload
+            layout = 'stacked'
+        original_img, modified_img = pyramid.tile(zoom, row, col)
+        encoded = self.encode_game(
+            {'original_image': original_img, 'modified_image': modified_img, 'game_data': game_data},
+            image_format, quality, layout=layout
+        )
+        encoded['tile'] = (zoom, row, col)
+        return encoded
+    
+    def save_game(self, game_result, storage=None, output_dir='games'):
+        """Save game images and data through the game storage, as PNG"""
+        return self.save_encoded_game(self.encode_game(game_result, 'PNG'), storage, output_dir)
+
+    def save_encoded_game(self, encoded_game, storage=None, output_dir='games'):
+        """Archive an already encoded game without re-encoding the images
+        
+        Images land in the content-addressed store under output_dir, whose
+        collector keeps the directory within its budget; pass a running
+        GameStorage to share it instead of opening one per call.
+        """
+        owned = storage is None
+        if owned:
+            storage = GameStorage(output_dir)
+        try:
+            paths = storage.save(encoded_game)
+        finally:
+            if owned:
+                storage.close()
+        
+        return {
+            'original_path': paths.get('original'),
+            'modified_path': paths.get('modified'),
+            'composite_path': paths.get('composite'),
+            'game_id': encoded_game['game_data']['game_id'],
+            'difficulty': encoded_game['game_data']['difficulty']
+        }
+
+    def load_game_records(self, output_dir='games'):
+        """Read the old append-only records log into a dict keyed by game id, see GameBot.import_records_log"""
+        records = {}
+        records_path = f"{output_dir}/records.jsonl"
+        if not os.path.exists(records_path):
+            return records
+        with open(records_path) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    records[record['game_id']] = record
+        return records
 
 # Example usage and testing
 def generate_test_games():
@@ -0,0 +1,257 @@
+import re
+import json
+import time
+import argparse
+import threading
+import itertools
+import urllib.error
+import urllib.request
+from collections import Counter
+from urllib.parse import parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}
+# Methods that answer with the message they created
+MESSAGE_METHODS = {'sendMessage', 'sendPhoto', 'editMessageText', 'editMessageCaption', 'editMessageReplyMarkup'}
+
+
+def _fields(content_type, body):
+    """Request parameters from a JSON, form or multipart Bot API call"""
+    if content_type.startswith('application/json'):
+        return json.loads(body or b'{}')
+    if content_type.startswith('multipart/form-data'):
+        # Enough for the plain fields; uploaded file parts are not needed
+        text = body.decode('utf-8', 'replace')
+        return dict(re.findall(r'name="(\w+)"\r\n(?:[^\r\n]+\r\n)*\r\n([^\r]*)\r\n', text))
+    return {key: values[0] for key, values in parse_qs(body.decode('utf-8')).items()}
+
+
+class FakeBotApi:
+    """Plausible answers to the Bot API methods the bot uses, with every call recorded
+
+    With `keep_calls` off only per-method counts are kept, so a long load test
+    doesn't grow memory by recording it.
+    """
+
+    def __init__(self, keep_calls=True):
+        self.keep_calls = keep_calls
+        self.calls = []
+        self.counts = Counter()
+        self.webhook_url = None
+        self.webhook_secret = None
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._webhook_set = threading.Event()
+
+    def call_counts(self):
+        with self._lock:
+            return dict(self.counts)
+
+    def _message(self, fields):
+        chat_id = int(fields.get('chat_id') or 0)
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER
+        }
+        if 'text' in fields:
+            message['text'] = fields['text']
+        return message
+
+    def _photo_message(self, fields):
+        message = self._message(fields)
+        file_id = f"fake-file-{next(self._file_ids)}"
+        message['photo'] = [{'file_id': file_id, 'file_unique_id': file_id, 'width': 800, 'height': 1212}]
+        return message
+
+    def answer(self, method, fields):
+        """Result for one Bot API call"""
+        with self._lock:
+            self.counts[method] += 1
+            if self.keep_calls:
+                self.calls.append((method, fields))
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'setWebhook':
+            self.webhook_url = fields.get('url')
+            self.webhook_secret = fields.get('secret_token')
+            self._webhook_set.set()
+            return True
+        if method == 'deleteWebhook':
+            self.webhook_url = None
+            return True
+        if method == 'getWebhookInfo':
+            return {'url': self.webhook_url or '', 'has_custom_certificate': False, 'pending_update_count': 0}
+        if method == 'getUpdates':
+            return self._take_updates(int(fields.get('offset') or 0), float(fields.get('timeout') or 0))
+        if method == 'sendPhoto':
+            return self._photo_message(fields)
+        if method == 'sendMediaGroup':
+            media = fields.get('media')
+            count = len(json.loads(media)) if isinstance(media, str) else len(media or [])
+            return [self._photo_message(fields) for _ in range(count)]
+        if method in MESSAGE_METHODS:
+            return self._message(fields)
+        return True
+
+    def _take_updates(self, offset, timeout):
+        deadline = time.monotonic() + min(timeout, 1.0)
+        while True:
+            with self._lock:
+                self._updates = [u for u in self._updates if u['update_id'] >= offset]
+                if self._updates or time.monotonic() >= deadline:
+                    return list(self._updates)
+            time.sleep(0.01)
+
+
+class FakeTelegramServer(FakeBotApi):
+    """A local stand-in for the Bot API, for running the bot without Telegram
+
+    Answers over HTTP like FakeBotApi. Updates are pushed to the registered
+    webhook, or queued for getUpdates when the bot is polling.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8081, keep_calls=True):
+        super().__init__(keep_calls)
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-telegram', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def wait_for_webhook(self, timeout=30):
+        return self._webhook_set.wait(timeout)
+
+    def send_update(self, update):
+        """Deliver an update to the bot, by webhook if one is registered"""
+        update = dict(update, update_id=next(self._update_ids))
+        if self.webhook_url is None:
+            with self._lock:
+                self._updates.append(update)
+            return
+        request = urllib.request.Request(
+            self.webhook_url,
+            data=json.dumps(update).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}
+        )
+        if self.webhook_secret:
+            request.add_header('X-Telegram-Bot-Api-Secret-Token', self.webhook_secret)
+        # The bot registers its webhook just before its server starts listening
+        for attempt in range(20):
+            try:
+                with urllib.request.urlopen(request, timeout=30) as response:
+                    response.read()
+                return
+            except urllib.error.URLError as e:
+                if not isinstance(e.reason, ConnectionRefusedError) or attempt == 19:
+                    raise
+                time.sleep(0.1)
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                # /bot<token>/<method>
+                method = self.path.rstrip('/').rsplit('/', 1)[-1]
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                fields = _fields(self.headers.get('Content-Type', ''), body)
+                payload = json.dumps({'ok': True, 'result': server.answer(method, fields)}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f"Player{user_id}"}
+
+
+def message_update(user_id, text):
+    message = {
+        'message_id': int(time.time() * 1000) % 2 ** 31,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': user(user_id),
+        'text': text
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'message': message}
+
+
+def callback_update(user_id, data):
+    return {
+        'callback_query': {
+            'id': f"{user_id}-{time.monotonic_ns()}",
+            'from': user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': 1,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': 'menu'
+            }
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake Bot API server for local testing")
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--burst', type=int, default=0, help="after the bot registers its webhook, send this many updates")
+    parser.add_argument('--users', type=int, default=10, help="users the burst is spread over")
+    args = parser.parse_args()
+
+    server = FakeTelegramServer(port=args.port).start()
+    print(f"Fake Bot API on {server.url}; run the bot with TELEGRAM_API_URL={server.url}")
+    try:
+        if args.burst:
+            server.wait_for_webhook(timeout=None)
+            print(f"Webhook registered at {server.webhook_url}, sending {args.burst} updates")
+            started = time.perf_counter()
+            threads = [
+                threading.Thread(target=server.send_update, args=(message_update(1000 + i % args.users, '/start'),))
+                for i in range(args.burst)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            print(f"Delivered in {time.perf_counter() - started:.2f}s; calls: {server.call_counts()}")
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
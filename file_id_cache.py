@@ -0,0 +1,100 @@
+import os
+import json
+import hashlib
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class FileIdCache:
+    """Telegram file_ids of uploaded game images, so a repeat send skips the upload
+
+    Entries are keyed by (game_id, variant) and remember a digest of the bytes
+    that were uploaded; an image re-rendered to different bytes no longer
+    matches and is uploaded afresh. Entries are appended to a JSON-lines file
+    and replayed on load. Losing the tail to a crash only costs a re-upload,
+    so appends are not fsynced.
+    """
+
+    def __init__(self, path='file_ids.jsonl', max_entries=100000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._file = None
+        self._lines = 0
+
+    @staticmethod
+    def digest(payload):
+        return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+    def load(self):
+        """Replay the file, compacting it when it has grown well past the live entries"""
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._lines += 1
+                    key = (entry['game_id'], entry['variant'])
+                    if entry.get('file_id') is None:
+                        self._entries.pop(key, None)
+                    else:
+                        self._entries[key] = (entry['digest'], entry['file_id'])
+                        self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        if self._lines > 2 * len(self._entries) + 1000:
+            self._compact()
+        self._file = open(self.path, 'a')
+        logger.info(f"Loaded {len(self._entries)} cached file ids from {self.path}")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, game_id, variant, digest):
+        """Cached file_id for these exact bytes, or None"""
+        entry = self._entries.get((game_id, variant))
+        if entry is None or entry[0] != digest:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end((game_id, variant))
+        return entry[1]
+
+    def put(self, game_id, variant, digest, file_id):
+        self._entries[(game_id, variant)] = (digest, file_id)
+        self._entries.move_to_end((game_id, variant))
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._append({'game_id': game_id, 'variant': variant, 'digest': digest, 'file_id': file_id})
+
+    def invalidate(self, game_id, variant):
+        """Forget a file_id, e.g. one Telegram no longer accepts"""
+        if self._entries.pop((game_id, variant), None) is not None:
+            self._append({'game_id': game_id, 'variant': variant, 'file_id': None})
+
+    def _append(self, entry):
+        if self._file is None:
+            return
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        self._lines += 1
+
+    def _compact(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            for (game_id, variant), (digest, file_id) in self._entries.items():
+                f.write(json.dumps({'game_id': game_id, 'variant': variant, 'digest': digest, 'file_id': file_id}) + "\n")
+        os.replace(temp_path, self.path)
+        self._lines = len(self._entries)
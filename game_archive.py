@@ -0,0 +1,132 @@
+import os
+import io
+import json
+import tarfile
+from collections import OrderedDict
+
+INDEX_FILE = 'index.jsonl'
+
+
+def shard_name(difficulty, shard_no):
+    return f"d{difficulty}-{shard_no:06d}.tar"
+
+
+def write_shard(output_dir, difficulty, shard_no, encoded_games):
+    """Pack encoded games into one tar shard and return their index entries
+
+    The shard is written under a temporary name and renamed when complete,
+    so a shard file that exists is always whole.
+    """
+    name = shard_name(difficulty, shard_no)
+    final_path = os.path.join(output_dir, name)
+    temp_path = final_path + '.tmp'
+
+    entries = []
+    with tarfile.open(temp_path, 'w') as tar:
+        for game in encoded_games:
+            game_id = game['game_data']['game_id']
+            extension = game['image_format'].lower()
+            members = {
+                'original': (f"{game_id}_original.{extension}", game['original_bytes']),
+                'modified': (f"{game_id}_modified.{extension}", game['modified_bytes']),
+                'data': (f"{game_id}_data.json", json.dumps(game['game_data']).encode('utf-8'))
+            }
+            entry = {'game_id': game_id, 'difficulty': difficulty, 'shard': name, 'image_format': game['image_format']}
+            for key, (member_name, payload) in members.items():
+                info = tarfile.TarInfo(member_name)
+                info.size = len(payload)
+                # The payload starts right after this member's header blocks
+                data_offset = tar.offset + len(info.tobuf(tar.format, tar.encoding, tar.errors))
+                tar.addfile(info, io.BytesIO(payload))
+                entry[key] = (data_offset, info.size)
+            entries.append(entry)
+
+    os.replace(temp_path, final_path)
+    return entries
+
+
+def append_index(output_dir, entries):
+    """Append shard entries to the archive index; this is also the progress log"""
+    with open(os.path.join(output_dir, INDEX_FILE), 'a') as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def archive_progress(output_dir):
+    """Games recorded per difficulty and the next free shard number for each"""
+    progress = {}
+    path = os.path.join(output_dir, INDEX_FILE)
+    if not os.path.exists(path):
+        return progress
+    shards = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                shards.setdefault(entry['difficulty'], {}).setdefault(entry['shard'], set()).add(entry['game_id'])
+    for difficulty, by_shard in shards.items():
+        games = sum(len(ids) for ids in by_shard.values())
+        next_shard = max(int(name[:-len('.tar')].split('-')[1]) for name in by_shard) + 1
+        progress[difficulty] = (games, next_shard)
+    return progress
+
+
+class GameArchive:
+    """Read games out of sharded archives through the index, without listing files"""
+
+    def __init__(self, archive_dir, max_open_files=16):
+        self.archive_dir = archive_dir
+        self.max_open_files = max_open_files
+        self.index = {}
+        self._files = OrderedDict()
+
+        with open(os.path.join(archive_dir, INDEX_FILE)) as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    # A shard rebuilt after a crash appends fresh entries; the last one wins
+                    self.index[entry['game_id']] = entry
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, game_id):
+        return game_id in self.index
+
+    def game_ids(self, difficulty=None):
+        return [g for g, e in self.index.items() if difficulty is None or e['difficulty'] == difficulty]
+
+    def _shard_file(self, shard):
+        f = self._files.get(shard)
+        if f is None:
+            f = open(os.path.join(self.archive_dir, shard), 'rb')
+            self._files[shard] = f
+            if len(self._files) > self.max_open_files:
+                _, oldest = self._files.popitem(last=False)
+                oldest.close()
+        else:
+            self._files.move_to_end(shard)
+        return f
+
+    def _read(self, shard, span):
+        offset, size = span
+        f = self._shard_file(shard)
+        f.seek(offset)
+        return f.read(size)
+
+    def load(self, game_id):
+        """Return an encoded game, in the same shape as DifferenceGameGenerator.encode_game"""
+        entry = self.index[game_id]
+        return {
+            'original_bytes': self._read(entry['shard'], entry['original']),
+            'modified_bytes': self._read(entry['shard'], entry['modified']),
+            'image_format': entry['image_format'],
+            'game_data': json.loads(self._read(entry['shard'], entry['data']))
+        }
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
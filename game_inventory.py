@@ -0,0 +1,184 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class GameInventory:
+    """Warm stock of pre-generated games per difficulty level"""
+
+    def __init__(self, executor, difficulties, low_watermark=2, high_watermark=6,
+                 refill_interval=1.0, demand_decay=0.98, num_differences=5):
+        self.executor = executor
+        self.difficulties = list(difficulties)
+        self.low_watermark = low_watermark
+        self.high_watermark = high_watermark
+        self.refill_interval = refill_interval
+        self.demand_decay = demand_decay
+        self.num_differences = num_differences
+
+        self.stock = {d: deque() for d in self.difficulties}
+        self.in_flight = {d: 0 for d in self.difficulties}
+        # Decaying count of requests per level, used to share out the stock budget
+        self.demand = {d: 1.0 for d in self.difficulties}
+        # Levels that dropped below their low watermark and are filling back up
+        self._refilling = set()
+        self._refill_tasks = set()
+        self.hits = 0
+        self.misses = 0
+
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._stopping = False
+
+    @classmethod
+    def from_env(cls, executor, difficulties):
+        """Build an inventory from INVENTORY_* environment variables"""
+        return cls(
+            executor,
+            difficulties,
+            low_watermark=int(os.getenv('INVENTORY_LOW_WATERMARK', '2')),
+            high_watermark=int(os.getenv('INVENTORY_HIGH_WATERMARK', '6')),
+            refill_interval=float(os.getenv('INVENTORY_REFILL_INTERVAL', '1.0'))
+        )
+
+    def available(self, difficulty):
+        """Whether a ready game is in stock for this level"""
+        return bool(self.stock.get(difficulty))
+
+    def pop(self, difficulty):
+        """Take a ready game for this level, or None if the level is empty"""
+        if difficulty in self.demand:
+            self.demand[difficulty] += 1.0
+
+        stock = self.stock.get(difficulty)
+        if not stock:
+            self.misses += 1
+            self._wakeup.set()
+            return None
+
+        self.hits += 1
+        game = stock.popleft()
+        if len(stock) < self.watermarks(difficulty)[0]:
+            self._wakeup.set()
+        return game
+
+    def watermarks(self, difficulty):
+        """Low and high watermark for a level, scaled by its share of demand"""
+        total_demand = sum(self.demand.values())
+        share = self.demand[difficulty] / total_demand
+        # The overall budget stays fixed, popular levels get a bigger slice of it
+        # while quiet levels still keep a small stock
+        budget = self.high_watermark * len(self.difficulties)
+        high = max(self.low_watermark, round(budget * share))
+        low = max(1, round(high * self.low_watermark / self.high_watermark))
+        return min(low, high), high
+
+    def stats(self):
+        """Stock, targets and hit rate for monitoring"""
+        served = self.hits + self.misses
+        return {
+            'stock': {d: len(s) for d, s in self.stock.items()},
+            'targets': {d: self.watermarks(d) for d in self.difficulties},
+            'hit_rate': self.hits / served if served else 0.0
+        }
+
+    def start(self):
+        """Start the background refill task"""
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._refill_loop())
+
+    async def stop(self):
+        """Stop the refill task"""
+        if self._task is None:
+            return
+        # wait_for can swallow the cancel when the wakeup is already set, so the
+        # loop also checks the flag
+        self._stopping = True
+        self._wakeup.set()
+        self._task.cancel()
+        for task in list(self._refill_tasks):
+            task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def _refill_budget(self):
+        """How many refill jobs we may submit without starving live players"""
+        # Keep a quarter of the queue free for players who miss the inventory
+        reserve = max(1, self.executor.max_pending // 4)
+        free = self.executor.max_pending - self.executor.pending - reserve
+        return max(0, min(self.executor.max_workers, free))
+
+    def _refill_plan(self):
+        """Levels to top up, neediest first"""
+        plan = []
+        for difficulty in self.difficulties:
+            low, high = self.watermarks(difficulty)
+            have = len(self.stock[difficulty]) + self.in_flight[difficulty]
+            if len(self.stock[difficulty]) < low:
+                self._refilling.add(difficulty)
+            if difficulty not in self._refilling:
+                continue
+            if have >= high:
+                self._refilling.discard(difficulty)
+                continue
+            plan.append((have - high, difficulty, high - have))
+        plan.sort()
+        return [(difficulty, missing) for _, difficulty, missing in plan]
+
+    async def _refill_loop(self):
+        decayed_at = time.monotonic()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.refill_interval)
+            except asyncio.TimeoutError:
+                pass
+            if self._stopping:
+                return
+            self._wakeup.clear()
+
+            # Misses and finished refills wake the loop many times a second in a burst;
+            # decay by elapsed time so demand fades at demand_decay per refill_interval
+            now = time.monotonic()
+            decay = self.demand_decay ** ((now - decayed_at) / self.refill_interval)
+            decayed_at = now
+            for difficulty in self.demand:
+                self.demand[difficulty] = max(0.1, self.demand[difficulty] * decay)
+
+            budget = self._refill_budget()
+            for difficulty, missing in self._refill_plan():
+                count = min(budget, missing)
+                for _ in range(count):
+                    self.in_flight[difficulty] += 1
+                    task = asyncio.create_task(self._refill_one(difficulty))
+                    self._refill_tasks.add(task)
+                    task.add_done_callback(self._refill_tasks.discard)
+                budget -= count
+                if budget <= 0:
+                    break
+
+    async def _refill_one(self, difficulty):
+        started = time.perf_counter()
+        try:
+            game = await self.executor.generate_game(
+                difficulty_level=difficulty,
+                num_differences=self.num_differences
+            )
+            # Stock can sit unserved for a long time; copy its images out of the
+            # shared-memory ring so the slots go to games about to be uploaded
+            self.executor.release_frames(game)
+            self.stock[difficulty].append(game)
+            logger.debug(f"Inventory refill {difficulty}% took {time.perf_counter() - started:.3f}s")
+        except Exception as e:
+            logger.warning(f"Inventory refill for {difficulty}% failed: {e}")
+        finally:
+            self.in_flight[difficulty] -= 1
+            # Keep going until the level reaches its high watermark
+            self._wakeup.set()
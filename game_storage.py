@@ -0,0 +1,308 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Encoded image keys of a game, see DifferenceGameGenerator.encode_game
+VARIANTS = ('original', 'modified', 'composite')
+
+
+class GameStorage:
+    """Game records and images on disk, content-addressed and garbage collected to a budget
+
+    Image bytes are stored once per distinct content under objects/ab/cd/, named
+    by their digest, so games sharing a picture share the file. An SQLite index
+    maps each game id to its digests and game_data and counts references per
+    object; lookups never list a directory.
+
+    A background thread deletes finished games after `finished_ttl` seconds,
+    any game older than `max_age`, and then the oldest games until the objects
+    fit in `max_bytes`. An object is unlinked once no game refers to it. A crash
+    between the index commit and the unlink leaves an orphan file, never a
+    game pointing at a missing one.
+
+    Records, the few fields needed to re-render a game, are kept in the same
+    index indefinitely by default, so replays and zoom tiles work long after a
+    game's images are gone. Setting `record_ttl` seconds or `max_records` above
+    zero opts in to expiring the oldest of them.
+    """
+
+    def __init__(self, root='games', max_bytes=512 * 1024 * 1024, max_age=7 * 24 * 3600, finished_ttl=3600,
+                 gc_interval=60, record_ttl=0, max_records=0):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.finished_ttl = finished_ttl
+        self.gc_interval = gc_interval
+        self.record_ttl = record_ttl
+        self.max_records = max_records
+        self.deduped = 0
+        self.collected = 0
+        self.records_collected = 0
+
+        # Held across index transactions and object unlinks, which must not interleave
+        self._lock = threading.RLock()
+        self._finished_lock = threading.Lock()
+        self._finished = {}
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+        os.makedirs(root, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(root, 'index.db'), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS objects ("
+                "digest TEXT PRIMARY KEY, extension TEXT NOT NULL, size INTEGER NOT NULL, refs INTEGER NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS games ("
+                "game_id TEXT PRIMARY KEY, difficulty INTEGER, image_format TEXT NOT NULL, objects TEXT NOT NULL, "
+                "data TEXT NOT NULL, created REAL NOT NULL, finished REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS games_created ON games (created)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS games_finished ON games (finished)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS records ("
+                "game_id TEXT PRIMARY KEY, record TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS records_created ON records (created)")
+
+    @classmethod
+    def from_env(cls, root='games'):
+        """Build storage from GAME_STORAGE_* environment variables"""
+        return cls(
+            root=root,
+            max_bytes=int(os.getenv('GAME_STORAGE_MB', '512')) * 1024 * 1024,
+            max_age=float(os.getenv('GAME_STORAGE_MAX_AGE', str(7 * 24 * 3600))),
+            finished_ttl=float(os.getenv('GAME_STORAGE_FINISHED_TTL', '3600')),
+            gc_interval=float(os.getenv('GAME_STORAGE_GC_INTERVAL', '60')),
+            record_ttl=float(os.getenv('GAME_STORAGE_RECORD_TTL', '0')),
+            max_records=int(os.getenv('GAME_STORAGE_MAX_RECORDS', '0'))
+        )
+
+    def object_path(self, digest, extension):
+        """objects/ab/cd/<digest>.<extension>, spreading files over 65536 directories"""
+        return os.path.join(self.root, 'objects', digest[:2], digest[2:4], f"{digest}.{extension}")
+
+    def _put_object(self, payload, extension):
+        """Store bytes unless identical bytes are already stored; return the digest"""
+        digest = hashlib.blake2b(payload, digest_size=16).hexdigest()
+        updated = self._conn.execute("UPDATE objects SET refs = refs + 1 WHERE digest = ?", (digest,)).rowcount
+        if updated:
+            self.deduped += 1
+            return digest
+
+        path = self.object_path(digest, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(temp_path, path)
+        self._conn.execute(
+            "INSERT INTO objects (digest, extension, size, refs) VALUES (?, ?, ?, 1)",
+            (digest, extension, len(payload))
+        )
+        return digest
+
+    def save(self, encoded_game):
+        """Store an encoded game's images and data, replacing a game with the same id"""
+        game_data = encoded_game['game_data']
+        extension = encoded_game['image_format'].lower()
+        with self._lock:
+            with self._conn:
+                garbage = self._delete_games([game_data['game_id']])
+                objects = {
+                    variant: self._put_object(encoded_game[f'{variant}_bytes'], extension)
+                    for variant in VARIANTS if f'{variant}_bytes' in encoded_game
+                }
+                self._conn.execute(
+                    "INSERT INTO games (game_id, difficulty, image_format, objects, data, created) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (game_data['game_id'], game_data['difficulty'], encoded_game['image_format'],
+                     json.dumps(objects), json.dumps(game_data), time.time())
+                )
+            paths = {variant: self.object_path(digest, extension) for variant, digest in objects.items()}
+            # Objects of the replaced game that the new one stored again are live
+            self._unlink([path for path, _ in garbage if path not in paths.values()])
+        return paths
+
+    def paths(self, game_id):
+        """Image paths of a stored game by variant, or None"""
+        with self._lock:
+            row = self._conn.execute("SELECT image_format, objects FROM games WHERE game_id = ?", (game_id,)).fetchone()
+        if row is None:
+            return None
+        extension = row[0].lower()
+        return {variant: self.object_path(digest, extension) for variant, digest in json.loads(row[1]).items()}
+
+    def load(self, game_id):
+        """Return a stored game in the shape of DifferenceGameGenerator.encode_game, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT image_format, objects, data FROM games WHERE game_id = ?", (game_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        image_format, objects, data = row
+        game = {'image_format': image_format, 'game_data': json.loads(data)}
+        for variant, digest in json.loads(objects).items():
+            with open(self.object_path(digest, image_format.lower()), 'rb') as f:
+                game[f'{variant}_bytes'] = f.read()
+        return game
+
+    def save_records(self, records):
+        """Store game records (see DifferenceGameGenerator.game_record), replacing any with the same id"""
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO records (game_id, record, created) VALUES (?, ?, ?)",
+                    [(record['game_id'], json.dumps(record), now) for record in records]
+                )
+
+    def record(self, game_id):
+        """A stored game record, or None"""
+        with self._lock:
+            row = self._conn.execute("SELECT record FROM records WHERE game_id = ?", (game_id,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def __contains__(self, game_id):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM games WHERE game_id = ?", (game_id,)).fetchone() is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM games").fetchone()[0]
+
+    def finish(self, game_id):
+        """Mark a game as over; cheap enough for the event loop, applied on the next collection"""
+        with self._finished_lock:
+            self._finished[game_id] = time.time()
+
+    def stored_bytes(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'games': len(self),
+                'objects': self._conn.execute("SELECT COUNT(*) FROM objects").fetchone()[0],
+                'bytes': self.stored_bytes(),
+                'deduped': self.deduped,
+                'collected': self.collected,
+                'records': self._conn.execute("SELECT COUNT(*) FROM records").fetchone()[0],
+                'records_collected': self.records_collected
+            }
+
+    def _delete_games(self, game_ids):
+        """Drop games from the index; return (path, size) of the objects nobody refers to anymore"""
+        released = {}
+        for game_id in game_ids:
+            row = self._conn.execute("SELECT objects FROM games WHERE game_id = ?", (game_id,)).fetchone()
+            if row is None:
+                continue
+            self._conn.execute("DELETE FROM games WHERE game_id = ?", (game_id,))
+            for digest in json.loads(row[0]).values():
+                released[digest] = released.get(digest, 0) + 1
+
+        garbage = []
+        for digest, count in released.items():
+            self._conn.execute("UPDATE objects SET refs = refs - ? WHERE digest = ?", (count, digest))
+            row = self._conn.execute(
+                "SELECT extension, size FROM objects WHERE digest = ? AND refs <= 0", (digest,)
+            ).fetchone()
+            if row is not None:
+                self._conn.execute("DELETE FROM objects WHERE digest = ?", (digest,))
+                garbage.append((self.object_path(digest, row[0]), row[1]))
+        return garbage
+
+    def collect(self, now=None):
+        """Delete finished, expired and over-budget games and old records; return how many games went"""
+        now = time.time() if now is None else now
+        with self._finished_lock:
+            finished, self._finished = self._finished, {}
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "UPDATE games SET finished = ? WHERE game_id = ? AND finished IS NULL",
+                    [(at, game_id) for game_id, at in finished.items()]
+                )
+                doomed = [row[0] for row in self._conn.execute(
+                    "SELECT game_id FROM games WHERE finished <= ? OR created <= ?",
+                    (now - self.finished_ttl, now - self.max_age)
+                )]
+                garbage = self._delete_games(doomed)
+
+                # Oldest first until the objects fit; deduped objects only count once
+                excess = self.stored_bytes() - self.max_bytes
+                if excess > 0:
+                    for (game_id,) in self._conn.execute("SELECT game_id FROM games ORDER BY created").fetchall():
+                        doomed.append(game_id)
+                        freed = self._delete_games([game_id])
+                        excess -= sum(size for _, size in freed)
+                        garbage.extend(freed)
+                        if excess <= 0:
+                            break
+
+                # Records expire only when asked to; zero keeps them forever
+                records = 0
+                if self.record_ttl > 0:
+                    records = self._conn.execute(
+                        "DELETE FROM records WHERE created <= ?", (now - self.record_ttl,)
+                    ).rowcount
+                over = 0
+                if self.max_records > 0:
+                    over = self._conn.execute("SELECT COUNT(*) FROM records").fetchone()[0] - self.max_records
+                if over > 0:
+                    records += self._conn.execute(
+                        "DELETE FROM records WHERE game_id IN (SELECT game_id FROM records ORDER BY created LIMIT ?)",
+                        (over,)
+                    ).rowcount
+            self._unlink([path for path, _ in garbage])
+
+        self.collected += len(doomed)
+        self.records_collected += records
+        if doomed:
+            logger.info(f"Collected {len(doomed)} stored games, freed {len(garbage)} objects")
+        if records:
+            logger.info(f"Collected {records} game records")
+        return len(doomed)
+
+    def _unlink(self, paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def start(self):
+        """Start the garbage collection thread"""
+        self._thread = threading.Thread(target=self._gc_loop, name='game-storage-gc', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stop the collector after a final pass and close the index"""
+        if self._thread is not None:
+            self._stopping = True
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+        self._conn.close()
+
+    def _gc_loop(self):
+        while not self._stopping:
+            self._wakeup.wait(self.gc_interval)
+            self._wakeup.clear()
+            try:
+                self.collect()
+            except (OSError, sqlite3.Error) as e:
+                logger.error(f"Game storage collection failed, will retry: {e}")
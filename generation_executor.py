@@ -0,0 +1,240 @@
+import os
+import asyncio
+import functools
+import logging
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from difference_game_generator import DifferenceGameGenerator
+from shared_frames import FrameRing, write_frames
+
+logger = logging.getLogger(__name__)
+
+
+class GeneratorBusyError(Exception):
+    """Raised when the generation queue is full"""
+
+
+class GenerationTimeoutError(Exception):
+    """Raised when a generation job does not finish in time"""
+
+
+# One generator per worker process, created by the pool initializer
+_worker_generator = None
+# Zoom pyramids of the games this worker cut tiles from last, by game id
+_worker_pyramids = OrderedDict()
+
+
+def _new_generator():
+    return DifferenceGameGenerator(scene_density=float(os.getenv('SCENE_DENSITY', '1.0')))
+
+
+def _init_worker():
+    """Create the generator once per worker process"""
+    global _worker_generator
+    _worker_generator = _new_generator()
+
+
+def _get_worker_generator():
+    global _worker_generator
+    if _worker_generator is None:
+        _worker_generator = _new_generator()
+    return _worker_generator
+
+
+def _generate_in_worker(difficulty_level, num_differences, record_timings=False, encoding=None, render_scale=1.0,
+                        frame=None):
+    """Generate and encode a game inside a worker
+
+    With record_timings the game comes back with a 'timings' list of
+    (stage, seconds), since the worker can't record into the parent's metrics.
+    With frame=(ring_name, slot, slot_bytes) the images are left in that
+    shared-memory slot instead of being pickled back.
+    """
+    generator = _get_worker_generator()
+    timings = [] if record_timings else None
+    game = generator.generate_encoded_game(
+        difficulty_level=difficulty_level,
+        num_differences=num_differences,
+        timings=timings,
+        render_scale=render_scale,
+        **(encoding or {})
+    )
+    if record_timings:
+        game['timings'] = timings
+    if frame is not None:
+        game = write_frames(game, *frame)
+    return game
+
+
+def _render_in_worker(record, encoding=None, frame=None):
+    """Re-render and encode a game from its record inside a worker"""
+    game = _get_worker_generator().render_encoded_game(record, **(encoding or {}))
+    if frame is not None:
+        game = write_frames(game, *frame)
+    return game
+
+
+def _tile_in_worker(record, zoom, row, col, encoding=None, frame=None):
+    """Cut and encode one zoom tile of a game inside a worker
+
+    The game is re-rendered from its record at full resolution; the pyramid is
+    kept for the next few tile requests that reach this worker.
+    """
+    generator = _get_worker_generator()
+    encoding = dict(encoding or {})
+    pyramid = _worker_pyramids.get(record['game_id'])
+    if pyramid is None:
+        pyramid = generator.build_pyramid(generator.render_game(record), encoding.get('scale', 1.0))
+        _worker_pyramids[record['game_id']] = pyramid
+        while len(_worker_pyramids) > int(os.getenv('PYRAMID_CACHE_GAMES', '2')):
+            _worker_pyramids.popitem(last=False)
+    else:
+        _worker_pyramids.move_to_end(record['game_id'])
+    game = generator.encode_tile(
+        pyramid, dict(record), zoom, row, col,
+        image_format=encoding.get('image_format', 'PNG'),
+        quality=encoding.get('quality'),
+        layout=encoding.get('layout', 'stacked')
+    )
+    if frame is not None:
+        game = write_frames(game, *frame)
+    return game
+
+
+class GenerationExecutor:
+    """Runs game generation in a pool of workers off the event loop"""
+
+    def __init__(self, max_workers=None, max_pending=None, job_timeout=30.0, mode='process', frames=None):
+        if mode not in ('process', 'thread'):
+            raise ValueError(f"Unknown generation executor mode: {mode}")
+
+        self.mode = mode
+        self.max_workers = max_workers or os.cpu_count() or 1
+        # Jobs running plus jobs waiting for a worker
+        self.max_pending = max_pending or self.max_workers * 4
+        self.job_timeout = job_timeout
+        # Ask workers for per-stage generation timings
+        self.record_timings = False
+        # Per-difficulty encode_game settings (image_format, quality, scale, layout)
+        self.encoding = {}
+        # Multiple of 800x600 games are rendered at; the encoding scale brings them back down
+        self.render_scale = 1.0
+        # Shared-memory ring for handing encoded images back from worker processes
+        self.frames = frames if mode == 'process' else None
+        self._pool = None
+        self._inflight = set()
+
+    @classmethod
+    def from_env(cls):
+        """Build an executor from GENERATION_* environment variables"""
+        max_workers = int(os.getenv('GENERATION_WORKERS', '0')) or None
+        max_pending = int(os.getenv('GENERATION_QUEUE_SIZE', '0')) or None
+        job_timeout = float(os.getenv('GENERATION_TIMEOUT', '30'))
+        mode = os.getenv('GENERATION_EXECUTOR', 'process')
+        frames = FrameRing.from_env() if os.getenv('FRAME_RING_SLOTS', '64') != '0' else None
+        return cls(max_workers=max_workers, max_pending=max_pending, job_timeout=job_timeout, mode=mode, frames=frames)
+
+    def start(self):
+        """Create the worker pool"""
+        if self._pool is not None:
+            return
+        if self.mode == 'process':
+            if self.frames is not None:
+                self.frames.open()
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker)
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='generator')
+        logger.info(f"Generation executor started: {self.mode} x{self.max_workers}, queue {self.max_pending}")
+
+    def shutdown(self, wait=True):
+        """Stop the worker pool, dropping queued jobs"""
+        if self._pool is None:
+            return
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+        self._pool = None
+        if self.frames is not None:
+            self.frames.close()
+
+    @property
+    def pending(self):
+        """Number of jobs running or waiting for a worker"""
+        return len(self._inflight)
+
+    @property
+    def is_busy(self):
+        return self.pending >= self.max_pending
+
+    async def submit(self, fn, *args, timeout=None, on_abandon=None):
+        """Run fn(*args) in the pool and await its result
+
+        on_abandon is called once the job has really finished if the caller
+        stopped waiting for it (timeout or cancellation).
+        """
+        if self.is_busy:
+            raise GeneratorBusyError(f"{self.pending} generation jobs pending")
+        if self._pool is None:
+            self.start()
+
+        job = self._pool.submit(fn, *args)
+        # A job keeps its queue slot until the worker is really done with it,
+        # even if the caller timed out or was cancelled
+        self._inflight.add(job)
+        job.add_done_callback(self._inflight.discard)
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(job), timeout or self.job_timeout)
+        except asyncio.TimeoutError:
+            self._abandon(job, on_abandon)
+            raise GenerationTimeoutError(f"Generation job exceeded {timeout or self.job_timeout}s")
+        except asyncio.CancelledError:
+            self._abandon(job, on_abandon)
+            raise
+
+    @staticmethod
+    def _abandon(job, on_abandon):
+        job.cancel()
+        if on_abandon is not None:
+            loop = asyncio.get_running_loop()
+            job.add_done_callback(lambda _: loop.call_soon_threadsafe(on_abandon))
+
+    async def _submit_encoded(self, fn, *args, timeout=None):
+        """Submit a job returning an encoded game, through a frame ring slot when one is free"""
+        slot = self.frames.acquire() if self.frames is not None and self._pool is not None else None
+        if slot is None:
+            return await self.submit(fn, *args, None, timeout=timeout)
+
+        frame = (self.frames.name, slot, self.frames.slot_bytes)
+        # The worker may still be writing into the slot after we stop waiting
+        release = functools.partial(self.frames.release, slot)
+        try:
+            game = await self.submit(fn, *args, frame, timeout=timeout, on_abandon=release)
+        except (GenerationTimeoutError, asyncio.CancelledError):
+            raise
+        except BaseException:
+            release()
+            raise
+        return self.frames.adopt(game, slot)
+
+    def release_frames(self, game):
+        """Free the ring slot behind a game once its images have been sent"""
+        if self.frames is not None:
+            self.frames.release_game(game)
+
+    async def generate_game(self, difficulty_level=50, num_differences=5, timeout=None):
+        """Generate a game in the pool, returning encoded image buffers"""
+        return await self._submit_encoded(
+            _generate_in_worker, difficulty_level, num_differences, self.record_timings,
+            self.encoding.get(difficulty_level), self.render_scale, timeout=timeout
+        )
+
+    async def render_game(self, record, timeout=None):
+        """Re-render a stored game in the pool, returning encoded image buffers"""
+        return await self._submit_encoded(
+            _render_in_worker, record, self.encoding.get(record['difficulty']), timeout=timeout
+        )
+
+    async def render_tile(self, record, zoom, row, col, timeout=None):
+        """Encode one zoom tile of a stored game in the pool"""
+        return await self._submit_encoded(
+            _tile_in_worker, record, zoom, row, col, self.encoding.get(record['difficulty']), timeout=timeout
+        )
@@ -0,0 +1,101 @@
+import sys
+import base64
+import numpy as np
+
+
+def pack_mask(mask):
+    """Bit-pack a 2D boolean mask into a base64 string"""
+    return base64.b64encode(np.packbits(mask, axis=None).tobytes()).decode('ascii')
+
+
+def unpack_mask(packed, width, height):
+    """Inverse of pack_mask"""
+    bits = np.frombuffer(base64.b64decode(packed), dtype=np.uint8)
+    return np.unpackbits(bits, count=width * height).reshape(height, width).astype(bool)
+
+
+def dilate_mask(mask, radius):
+    """Grow a boolean mask by radius pixels in every direction (square kernel)"""
+    if radius <= 0:
+        return mask
+    height, width = mask.shape
+    grown = np.zeros((height + 2 * radius, width + 2 * radius), dtype=bool)
+    grown[radius:radius + height, radius:radius + width] = mask
+    # Separable max filter: rows, then columns
+    rows = grown.copy()
+    for shift in range(1, radius + 1):
+        rows[:, shift:] |= grown[:, :-shift]
+        rows[:, :-shift] |= grown[:, shift:]
+    cols = rows.copy()
+    for shift in range(1, radius + 1):
+        cols[shift:, :] |= rows[:-shift, :]
+        cols[:-shift, :] |= rows[shift:, :]
+    return cols
+
+
+class DifferenceHitIndex:
+    """Uniform grid over difference footprints for constant-time tap lookups"""
+
+    __slots__ = ('width', 'height', 'cell_size', 'cols', 'rows', 'cells', 'footprints')
+
+    def __init__(self, width, height, differences, cell_size=32, tolerance=0):
+        self.width = width
+        self.height = height
+        self.cell_size = cell_size
+        self.cols = (width + cell_size - 1) // cell_size
+        self.rows = (height + cell_size - 1) // cell_size
+        self.cells = [() for _ in range(self.cols * self.rows)]
+        self.footprints = {}
+
+        for diff in differences:
+            left, top, right, bottom = diff['bbox']
+            mask = unpack_mask(diff['mask'], right - left, bottom - top)
+            if tolerance:
+                # Let near misses count by growing the footprint once, up front
+                mask = dilate_mask(mask, tolerance)
+                left, top = left - tolerance, top - tolerance
+                right, bottom = right + tolerance, bottom + tolerance
+            packed = np.packbits(mask, axis=None).tobytes()
+            self.footprints[diff['id']] = (left, top, right, bottom, packed)
+            self._insert(diff['id'], max(0, left), max(0, top), min(width, right), min(height, bottom))
+
+    @classmethod
+    def from_game_data(cls, game_data, cell_size=32, tolerance=0):
+        return cls(
+            game_data['width'],
+            game_data['height'],
+            game_data['differences'],
+            cell_size=cell_size,
+            tolerance=tolerance
+        )
+
+    def _insert(self, diff_id, left, top, right, bottom):
+        if right <= left or bottom <= top:
+            return
+        for row in range(top // self.cell_size, (bottom - 1) // self.cell_size + 1):
+            for col in range(left // self.cell_size, (right - 1) // self.cell_size + 1):
+                index = row * self.cols + col
+                self.cells[index] = self.cells[index] + (diff_id,)
+
+    def nbytes(self):
+        """Approximate memory held by the index"""
+        size = sys.getsizeof(self.cells) + sys.getsizeof(self.footprints)
+        size += sum(sys.getsizeof(cell) for cell in self.cells if cell)
+        size += sum(sys.getsizeof(footprint[4]) + sys.getsizeof(footprint) for footprint in self.footprints.values())
+        return size
+
+    def lookup(self, x, y):
+        """Return the id of the difference covering (x, y), or None"""
+        # The last row and column of cells run past the picture, as do footprints grown by tolerance
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return None
+        col, row = x // self.cell_size, y // self.cell_size
+
+        for diff_id in self.cells[row * self.cols + col]:
+            left, top, right, bottom, packed = self.footprints[diff_id]
+            if not (left <= x < right and top <= y < bottom):
+                continue
+            bit = (y - top) * (right - left) + (x - left)
+            if packed[bit >> 3] >> (7 - (bit & 7)) & 1:
+                return diff_id
+        return None
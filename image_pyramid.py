@@ -0,0 +1,50 @@
+import math
+from PIL import Image
+
+
+def zoom_levels(full_width, view_width):
+    """Deepest zoom that still shows real pixels when a game is delivered view_width wide"""
+    return max(0, int(math.log2(full_width / view_width) + 1e-9))
+
+
+def tile_box(view_size, zoom, row, col):
+    """Area a tile covers, in delivered-picture pixels (left, top, right, bottom)"""
+    width, height = view_size
+    tiles = 2 ** zoom
+    return (
+        col * width // tiles, row * height // tiles,
+        (col + 1) * width // tiles, (row + 1) * height // tiles
+    )
+
+
+class ImagePyramid:
+    """Both pictures of a game at every zoom level, cut into view-sized tiles
+
+    Zoom 0 is the whole picture at the delivered size; each level doubles the
+    resolution, so zoom z holds 2^z x 2^z tiles that are each as big as the
+    delivered picture. The finest level is the full render, coarser ones are
+    box-filtered down from the level above.
+    """
+
+    def __init__(self, original_img, modified_img, view_size):
+        self.view_size = view_size
+        self.max_zoom = zoom_levels(original_img.width, view_size[0])
+        self.levels = [None] * (self.max_zoom + 1)
+        pair = (original_img, modified_img)
+        for zoom in range(self.max_zoom, -1, -1):
+            size = (view_size[0] * 2 ** zoom, view_size[1] * 2 ** zoom)
+            if pair[0].size != size:
+                pair = tuple(img.resize(size, Image.BOX) for img in pair)
+            self.levels[zoom] = pair
+
+    @property
+    def nbytes(self):
+        return sum(img.width * img.height * len(img.getbands()) for pair in self.levels for img in pair)
+
+    def tile(self, zoom, row, col):
+        """The (original, modified) crops of one tile"""
+        if not 0 <= zoom <= self.max_zoom or not (0 <= row < 2 ** zoom and 0 <= col < 2 ** zoom):
+            raise ValueError(f"No tile {zoom}/{row}/{col} in a pyramid of depth {self.max_zoom}")
+        width, height = self.view_size
+        box = (col * width, row * height, (col + 1) * width, (row + 1) * height)
+        return tuple(img.crop(box) for img in self.levels[zoom])
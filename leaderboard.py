@@ -0,0 +1,174 @@
+import random
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, levels):
+        self.key = key
+        self.next = [None] * levels
+        # width[i] = how many level-0 steps next[i] skips
+        self.width = [1] * levels
+
+
+class IndexableSkipList:
+    """Sorted keys with O(log n) insert, remove, rank and positional lookup"""
+
+    max_levels = 32
+
+    def __init__(self):
+        self._head = _Node(None, self.max_levels)
+        self._levels = 1
+        self._size = 0
+        self._rng = random.Random(0x5EED)
+
+    def __len__(self):
+        return self._size
+
+    def _random_levels(self):
+        levels = 1
+        while levels < self.max_levels and self._rng.random() < 0.5:
+            levels += 1
+        return levels
+
+    def insert(self, key):
+        update = [self._head] * self.max_levels
+        position = [0] * self.max_levels
+        node, index = self._head, 0
+        for level in range(self._levels - 1, -1, -1):
+            while node.next[level] is not None and node.next[level].key < key:
+                index += node.width[level]
+                node = node.next[level]
+            update[level] = node
+            position[level] = index
+
+        levels = self._random_levels()
+        if levels > self._levels:
+            for level in range(self._levels, levels):
+                update[level] = self._head
+                position[level] = 0
+                self._head.width[level] = self._size + 1
+            self._levels = levels
+
+        new = _Node(key, levels)
+        index += 1  # level-0 index the new node will have, 1-based from the head
+        for level in range(self._levels):
+            prev = update[level]
+            if level < levels:
+                new.next[level] = prev.next[level]
+                prev.next[level] = new
+                skipped = index - position[level]
+                new.width[level] = prev.width[level] - skipped + 1
+                prev.width[level] = skipped
+            else:
+                prev.width[level] += 1
+        self._size += 1
+
+    def remove(self, key):
+        update = [None] * self._levels
+        node = self._head
+        for level in range(self._levels - 1, -1, -1):
+            while node.next[level] is not None and node.next[level].key < key:
+                node = node.next[level]
+            update[level] = node
+
+        target = node.next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+
+        for level in range(self._levels):
+            prev = update[level]
+            if prev.next[level] is target:
+                prev.width[level] += target.width[level] - 1
+                prev.next[level] = target.next[level]
+            else:
+                prev.width[level] -= 1
+        self._size -= 1
+
+    def rank(self, key):
+        """0-based position of key"""
+        node, index = self._head, 0
+        for level in range(self._levels - 1, -1, -1):
+            while node.next[level] is not None and node.next[level].key < key:
+                index += node.width[level]
+                node = node.next[level]
+        target = node.next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+        return index
+
+    def _node_at(self, index):
+        """Node at 0-based position index"""
+        node, remaining = self._head, index + 1
+        for level in range(self._levels - 1, -1, -1):
+            while node.next[level] is not None and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        return node
+
+    def slice(self, start, stop):
+        """Keys at positions [start, stop): O(log n) to find start, then O(stop - start)"""
+        if start >= self._size or stop <= start:
+            return []
+        node = self._node_at(start)
+        keys = []
+        while node is not None and len(keys) < stop - start:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+def _win_rate(user_data, min_games):
+    if user_data['games_played'] < min_games:
+        return None
+    return round(user_data['games_won'] / user_data['games_played'] * 100, 1)
+
+
+class LeaderboardIndex:
+    """Leaderboards kept sorted as users change, instead of re-sorted per view"""
+
+    def __init__(self, difficulties, min_games_for_win_rate=5):
+        self.boards = {
+            'coins': lambda data: data['coins'],
+            'win_rate': lambda data: _win_rate(data, min_games_for_win_rate),
+            'games_won': lambda data: data['games_won']
+        }
+        for level in difficulties:
+            self.boards[f'wins_{level}'] = lambda data, level=level: data.get('wins_by_level', {}).get(str(level), 0)
+
+        self._lists = {board: IndexableSkipList() for board in self.boards}
+        # (board, user_id) -> the key currently in that board's list
+        self._keys = {}
+
+    def update(self, user_id, user_data):
+        """Re-score one user on every board; O(boards * log U)"""
+        for board, score_of in self.boards.items():
+            score = score_of(user_data)
+            old_key = self._keys.get((board, user_id))
+            # Highest score first, ties broken by user id
+            new_key = None if score is None else (-score, user_id)
+            if old_key == new_key:
+                continue
+            if old_key is not None:
+                self._lists[board].remove(old_key)
+                del self._keys[(board, user_id)]
+            if new_key is not None:
+                self._lists[board].insert(new_key)
+                self._keys[(board, user_id)] = new_key
+
+    def top(self, board, count, offset=0):
+        """[(user_id, score)] for positions offset..offset+count"""
+        return [(user_id, -negated) for negated, user_id in self._lists[board].slice(offset, offset + count)]
+
+    def page(self, board, page, page_size=10):
+        return self.top(board, page_size, page * page_size)
+
+    def rank(self, board, user_id):
+        """1-based rank of a user, or None if they are not on this board"""
+        key = self._keys.get((board, user_id))
+        if key is None:
+            return None
+        return self._lists[board].rank(key) + 1
+
+    def size(self, board):
+        return len(self._lists[board])
@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientFundsError(Exception):
+    """Raised when a debit would take a balance below zero"""
+
+    def __init__(self, balance, amount):
+        super().__init__(f"Balance {balance} is less than {amount}")
+        self.balance = balance
+        self.amount = amount
+
+
+class KeyedLocks:
+    """One asyncio.Lock per key, created on demand and dropped when idle"""
+
+    def __init__(self):
+        self._locks = {}
+
+    @asynccontextmanager
+    async def hold(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def __len__(self):
+        return len(self._locks)
+
+
+class CoinLedger:
+    """Coin balances derived from an append-only, group-committed journal
+
+    Every mutation runs under its user's lock, is appended to the journal and
+    only returns once a background thread has fsynced it. Entries arriving
+    while an fsync is in flight are written together by the next one, so one
+    fsync covers many mutations. On startup balances are rebuilt from the
+    last snapshot plus the journal entries written after it.
+    """
+
+    def __init__(self, journal_path='ledger.journal', snapshot_path='ledger.snapshot', snapshot_every=10000):
+        self.journal_path = journal_path
+        self.snapshot_path = snapshot_path
+        self.snapshot_every = snapshot_every
+        self.balances = {}
+        self.fsyncs = 0
+        self.entries_written = 0
+
+        self._locks = KeyedLocks()
+        self._seq = 0
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._loop = None
+        # Set when a failed write could not be cut back out of the journal
+        self._broken = None
+
+        # Writer-side state: balances as of the last fsynced entry
+        self._committed = {}
+        self._committed_seq = 0
+        self._since_snapshot = 0
+
+    def load(self):
+        """Rebuild balances from the snapshot and journal"""
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+            self._seq = snapshot['seq']
+            self.balances = {int(user_id): balance for user_id, balance in snapshot['balances'].items()}
+
+        replayed = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'rb+') as f:
+                # End of the last whole entry; anything after it is a torn write
+                good_end = 0
+                for line in f:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError("entry has no line end")
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn final line from a crash mid-write was never acknowledged
+                        logger.warning("Ignoring partial ledger journal entry")
+                        break
+                    good_end += len(line)
+                    # Entries up to the snapshot may remain if we crashed before truncating
+                    if entry['seq'] <= self._seq:
+                        continue
+                    self.balances[entry['user_id']] = entry['balance']
+                    self._seq = entry['seq']
+                    replayed += 1
+                # Cut the torn tail off, or the next append would land on the same line
+                # and hide every entry after it from the following load
+                if good_end < os.fstat(f.fileno()).st_size:
+                    f.truncate(good_end)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+        self._committed = dict(self.balances)
+        self._committed_seq = self._seq
+        self._since_snapshot = replayed
+        logger.info(f"Ledger loaded: {len(self.balances)} balances, {replayed} journal entries replayed")
+
+    def start(self):
+        """Start the journal writer; call from the event loop"""
+        self._loop = asyncio.get_running_loop()
+        # Unbuffered, so a failed write leaves nothing behind to be flushed later
+        self._journal = open(self.journal_path, 'ab', buffering=0)
+        self._thread = threading.Thread(target=self._writer_loop, name='ledger-writer', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Write out pending entries and stop the writer"""
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+        self._journal.close()
+
+    def balance(self, user_id):
+        return self.balances.get(user_id, 0)
+
+    def lock(self, user_id):
+        """Serialize a user's ledger mutations"""
+        return self._locks.hold(user_id)
+
+    async def apply(self, user_id, amount, reason, ref=None):
+        """Add amount (negative to debit) to a user's balance, durably
+
+        Returns the new balance. Raises InsufficientFundsError for debits that
+        would go below zero.
+        """
+        async with self.lock(user_id):
+            balance = self.balances.get(user_id, 0)
+            if balance + amount < 0:
+                raise InsufficientFundsError(balance, -amount)
+
+            self._seq += 1
+            entry = {
+                'seq': self._seq,
+                'ts': time.time(),
+                'user_id': user_id,
+                'amount': amount,
+                'reason': reason,
+                'ref': ref,
+                'balance': balance + amount
+            }
+            self.balances[user_id] = balance + amount
+
+            committed = self._loop.create_future()
+            with self._pending_lock:
+                self._pending.append((entry, committed))
+            self._wakeup.set()
+
+            try:
+                await committed
+            except Exception:
+                # Never acknowledged, so never happened
+                self.balances[user_id] = balance
+                raise
+            return balance + amount
+
+    async def debit(self, user_id, amount, reason, ref=None):
+        return await self.apply(user_id, -amount, reason, ref)
+
+    async def credit(self, user_id, amount, reason, ref=None):
+        return await self.apply(user_id, amount, reason, ref)
+
+    def _resolve(self, batch, error=None):
+        for _, committed in batch:
+            if committed.done():
+                continue
+            if error is None:
+                committed.set_result(None)
+            else:
+                committed.set_exception(error)
+
+    def _writer_loop(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            with self._pending_lock:
+                batch, self._pending = self._pending, []
+
+            if batch:
+                self._commit(batch)
+
+            if self._stopping:
+                with self._pending_lock:
+                    if not self._pending:
+                        break
+
+    def _commit(self, batch):
+        """Append and fsync one batch, or fail it and leave the journal as it was"""
+        if self._broken is not None:
+            self._loop.call_soon_threadsafe(self._resolve, batch, self._broken)
+            return
+
+        fd = self._journal.fileno()
+        offset = os.fstat(fd).st_size
+        try:
+            data = memoryview(''.join(json.dumps(entry) + "\n" for entry, _ in batch).encode())
+            while data:
+                data = data[self._journal.write(data):]
+            os.fsync(fd)
+        except OSError as e:
+            logger.error(f"Ledger journal write failed: {e}")
+            # The callers roll these mutations back, so load() must not replay them
+            try:
+                os.ftruncate(fd, offset)
+            except OSError as truncate_error:
+                logger.error(f"Ledger journal could not be rolled back, refusing further writes: {truncate_error}")
+                self._broken = e
+            self._loop.call_soon_threadsafe(self._resolve, batch, e)
+            return
+
+        self.fsyncs += 1
+        self.entries_written += len(batch)
+        for entry, _ in batch:
+            self._committed[entry['user_id']] = entry['balance']
+            self._committed_seq = entry['seq']
+        self._since_snapshot += len(batch)
+        self._loop.call_soon_threadsafe(self._resolve, batch)
+
+        if self._since_snapshot >= self.snapshot_every:
+            try:
+                self._write_snapshot()
+            except OSError as e:
+                # The journal still holds everything; try again after the next batch
+                logger.error(f"Ledger snapshot failed: {e}")
+
+    def _write_snapshot(self):
+        """Persist committed balances, then start a fresh journal"""
+        temp_path = self.snapshot_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'seq': self._committed_seq, 'balances': self._committed}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.snapshot_path)
+
+        # The journal is opened for appending, so later writes land at the new end
+        os.ftruncate(self._journal.fileno(), 0)
+        self._since_snapshot = 0
+        logger.info(f"Ledger snapshot written at seq {self._committed_seq}")
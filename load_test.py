@@ -0,0 +1,360 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import platform
+import argparse
+import resource
+import tempfile
+import itertools
+from collections import Counter, defaultdict
+
+import numpy as np
+from telegram import Update
+from telegram.request import BaseRequest
+
+from fake_telegram import FakeBotApi, message_update, callback_update
+
+TOKEN = '123456:LOADTEST'
+DIFFICULTIES = [50, 60, 70, 80, 90]
+# Headline numbers compared against a baseline, and whether higher is better
+HEADLINE = {'updates_per_sec': True, 'latency_p99_ms': False, 'loop_lag_p99_ms': False, 'rss_growth_mib': False}
+
+
+class InProcessRequest(BaseRequest):
+    """Answers the bot's Bot API calls from a FakeBotApi, without HTTP
+
+    `latency` seconds are slept per call to stand in for the round trip to
+    Telegram, so sends hold the event loop's attention the way real ones do.
+    """
+
+    def __init__(self, api, latency=0.0):
+        self.api = api
+        self.latency = latency
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        fields = request_data.parameters if request_data is not None else {}
+        result = self.api.answer(url.rsplit('/', 1)[-1], fields)
+        return 200, json.dumps({'ok': True, 'result': result}).encode('utf-8')
+
+
+def rss_bytes():
+    """Resident memory of this process; the generator workers are separate processes"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # Peak rather than current off Linux; ru_maxrss is KiB there too, except on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(sorted_samples, q):
+    if not sorted_samples:
+        return 0.0
+    return sorted_samples[min(len(sorted_samples) - 1, int(len(sorted_samples) * q))]
+
+
+def tap_on(game, diff_id, rng):
+    """Delivered-picture coordinates of a random pixel of one difference, as a sharp-eyed player would send"""
+    left, top, right, bottom, packed = game.hit_index.footprints[diff_id]
+    bits = np.unpackbits(np.frombuffer(packed, dtype=np.uint8), count=(right - left) * (bottom - top))
+    spots = np.flatnonzero(bits)
+    row, col = divmod(int(spots[rng.randrange(len(spots))]), right - left)
+    scale = game.view[0]
+    return max(0, round((left + col) * scale)), max(0, round((top + row) * scale))
+
+
+class LoadTest:
+    """Simulated players driving a GameBot through its Application, against a fake Bot API
+
+    Every player is one coroutine walking the menus the way a person does:
+    /start, test coins, profile, difficulty, a game with marks and taps, the
+    leaderboard. Updates go through the application's PerUserUpdateProcessor,
+    as they would from polling or the webhook, and through the real handlers,
+    callback_router included; only Telegram is replaced. Latency is timed per
+    update from hand-off to the last handler returning, so it includes
+    queueing for a concurrency slot and pacing of the sends.
+    """
+
+    def __init__(self, bot, application, api, users=1000, games=1, ramp=10.0, think=1.0, hit_rate=0.8, seed=0):
+        self.bot = bot
+        self.application = application
+        self.api = api
+        self.users = users
+        self.games = games
+        self.ramp = ramp
+        self.think = think
+        self.hit_rate = hit_rate
+        self.seed = seed
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.games_started = 0
+        self.loop_lag = []
+        self.rss_samples = []
+        self._update_ids = itertools.count(1)
+        application.add_error_handler(self._on_error)
+
+    async def _on_error(self, update, context):
+        self.errors[type(context.error).__name__] += 1
+
+    async def send(self, action, data):
+        """Process one update the way the application's update fetcher would, and time it"""
+        update = Update.de_json(dict(data, update_id=next(self._update_ids)), self.application.bot)
+        started = time.perf_counter()
+        await self.application.update_processor.process_update(update, self.application.process_update(update))
+        self.latencies[action].append(time.perf_counter() - started)
+
+    async def message(self, user_id, text, action):
+        await self.send(action, message_update(user_id, text))
+
+    async def callback(self, user_id, data, action):
+        await self.send(action, callback_update(user_id, data))
+
+    async def pause(self, rng):
+        if self.think:
+            await asyncio.sleep(rng.expovariate(1 / self.think))
+
+    async def player(self, user_id):
+        rng = random.Random(self.seed * 1000003 + user_id)
+        await asyncio.sleep(rng.uniform(0, self.ramp))
+        await self.message(user_id, '/start', 'start')
+        await self.pause(rng)
+        await self.message(user_id, '/testcoins', 'testcoins')
+        for _ in range(self.games):
+            await self.pause(rng)
+            await self.callback(user_id, 'profile', 'profile')
+            await self.pause(rng)
+            await self.callback(user_id, 'change_difficulty', 'change_difficulty')
+            await self.pause(rng)
+            await self.callback(user_id, f"set_diff_{rng.choice(DIFFICULTIES)}", 'set_diff')
+            await self.pause(rng)
+            await self.callback(user_id, 'play_game', 'play_game')
+            game = self.bot.active_games.get(user_id)
+            if game is not None:
+                self.games_started += 1
+                await self.play(user_id, game, rng)
+            await self.pause(rng)
+            await self.callback(user_id, 'leaderboard', 'leaderboard')
+            await self.pause(rng)
+            await self.callback(user_id, f"lb_wins_{rng.choice(DIFFICULTIES)}_0", 'leaderboard')
+
+    async def play(self, user_id, game, rng):
+        """Mark differences, missing some, then give up if any are left"""
+        for diff_id in range(1, game.total_differences + 1):
+            await self.pause(rng)
+            await self.callback(user_id, f"mark_diff_{game.game_id}", 'mark_diff')
+            await self.pause(rng)
+            if rng.random() < self.hit_rate:
+                x, y = tap_on(game, diff_id, rng)
+            else:
+                scale = game.view[0]
+                x, y = rng.randrange(round(game.width * scale)), rng.randrange(round(game.height * scale))
+            await self.message(user_id, f"{x} {y}", 'tap')
+        if self.bot.active_games.get(user_id) is game:
+            await self.pause(rng)
+            await self.callback(user_id, f"give_up_{game.game_id}", 'give_up')
+
+    async def _watch_loop(self, interval=0.01):
+        """Record how late the event loop wakes a sleeping task, and the process's memory"""
+        next_rss = 0.0
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            now = time.perf_counter()
+            self.loop_lag.append(max(0.0, now - started - interval))
+            if now >= next_rss:
+                self.rss_samples.append(rss_bytes())
+                next_rss = now + 1.0
+
+    async def run(self):
+        rss_before = rss_bytes()
+        watcher = asyncio.create_task(self._watch_loop())
+        started = time.perf_counter()
+        await asyncio.gather(*(self.player(1000 + i) for i in range(self.users)))
+        elapsed = time.perf_counter() - started
+        watcher.cancel()
+        try:
+            await watcher
+        except asyncio.CancelledError:
+            pass
+        return self.report(elapsed, rss_before, rss_bytes())
+
+    def report(self, elapsed, rss_before, rss_after):
+        actions = {}
+        everything = []
+        for action, samples in sorted(self.latencies.items()):
+            samples.sort()
+            everything.extend(samples)
+            actions[action] = {
+                'count': len(samples),
+                'p50_ms': round(percentile(samples, 0.5) * 1000, 2),
+                'p90_ms': round(percentile(samples, 0.9) * 1000, 2),
+                'p99_ms': round(percentile(samples, 0.99) * 1000, 2),
+                'max_ms': round(samples[-1] * 1000, 2)
+            }
+        everything.sort()
+        lag = sorted(self.loop_lag)
+        api_calls = self.api.call_counts()
+        return {
+            'summary': {
+                'users': self.users,
+                'elapsed_s': round(elapsed, 2),
+                'updates': len(everything),
+                'updates_per_sec': round(len(everything) / elapsed, 1),
+                'api_calls_per_sec': round(sum(api_calls.values()) / elapsed, 1),
+                # Taps on Play that got a game; the rest met a busy generator or ran out of coins
+                'games_started': self.games_started,
+                'games_per_sec': round(self.games_started / elapsed, 2),
+                'latency_p50_ms': round(percentile(everything, 0.5) * 1000, 2),
+                'latency_p99_ms': round(percentile(everything, 0.99) * 1000, 2),
+                'loop_lag_p50_ms': round(percentile(lag, 0.5) * 1000, 2),
+                'loop_lag_p99_ms': round(percentile(lag, 0.99) * 1000, 2),
+                'loop_lag_max_ms': round(lag[-1] * 1000, 2) if lag else 0.0,
+                'rss_before_mib': round(rss_before / 2 ** 20, 1),
+                'rss_peak_mib': round(max(self.rss_samples + [rss_after]) / 2 ** 20, 1),
+                'rss_growth_mib': round((rss_after - rss_before) / 2 ** 20, 1),
+                'handler_errors': sum(self.errors.values())
+            },
+            'actions': actions,
+            'errors': dict(self.errors),
+            'api_calls': api_calls,
+            'active_games': self.bot.active_games.stats(),
+            'bot_metrics': self.bot.metrics.render().splitlines()
+        }
+
+
+def compare(summary, baseline, threshold):
+    """Headline numbers that got worse than the baseline by more than threshold"""
+    regressions = []
+    for metric, higher_is_better in HEADLINE.items():
+        reference = baseline.get('summary', {}).get(metric)
+        if reference is None:
+            continue
+        value = summary[metric]
+        worse = value < reference * (1 - threshold) if higher_is_better else value > reference * (1 + threshold)
+        # Lag and growth near zero swing by large ratios; ignore sub-millisecond and sub-MiB moves
+        if worse and abs(value - reference) > 1:
+            regressions.append(f"{metric}: {reference} -> {value}")
+    return regressions
+
+
+async def run_load_test(args, api):
+    # Imported here so the environment set up in main() is in place before the bot reads it
+    from main import GameBot, build_application
+
+    logging.getLogger().setLevel(logging.WARNING)
+    bot = GameBot(TOKEN)
+    application = build_application(bot, TOKEN, request=InProcessRequest(api, args.api_latency))
+    load_test = LoadTest(
+        bot, application, api, users=args.users, games=args.games, ramp=args.ramp, think=args.think,
+        hit_rate=args.hit_rate, seed=args.seed
+    )
+    # What run_polling and run_webhook do around their update loop
+    await application.initialize()
+    await bot.post_init(application)
+    try:
+        if args.warmup:
+            await asyncio.sleep(args.warmup)
+        return await load_test.run()
+    finally:
+        await application.shutdown()
+        await bot.post_shutdown(application)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive the bot with simulated players against a fake Bot API")
+    parser.add_argument('--users', type=int, default=1000, help="simulated players")
+    parser.add_argument('--games', type=int, default=1, help="games each player plays")
+    parser.add_argument('--ramp', type=float, default=10.0, help="seconds over which players arrive")
+    parser.add_argument('--think', type=float, default=1.0, help="mean seconds a player waits between taps")
+    parser.add_argument('--hit-rate', type=float, default=0.8, help="share of taps that land on a difference")
+    parser.add_argument('--api-latency', type=float, default=0.0, help="simulated seconds per Bot API call")
+    parser.add_argument('--warmup', type=float, default=0.0, help="seconds to let the inventory fill before load")
+    parser.add_argument('--telegram-limits', action='store_true',
+                        help="keep the send scheduler at Telegram's flood limits, which cap sends at 30/s")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', help="where the bot keeps its databases; a fresh temporary directory by default")
+    parser.add_argument('--output', default='load_test_results.json')
+    parser.add_argument('--baseline', help="earlier results to compare the headline numbers against")
+    parser.add_argument('--threshold', type=float, default=0.25, help="allowed regression, 0.25 = 25%%")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+
+    # Measure the bot, not Telegram's flood limits, unless asked to
+    if not args.telegram_limits:
+        for name in ('SEND_GLOBAL_RATE', 'SEND_CHAT_RATE', 'SEND_CHAT_BURST'):
+            os.environ.setdefault(name, '1000000')
+    os.environ.setdefault('METRICS_ENABLED', '1')
+    os.environ.setdefault('METRICS_DUMP_INTERVAL', '0')
+
+    with tempfile.TemporaryDirectory(prefix='load-test-') as temp_dir:
+        # The bot's stores use relative paths; keep every run's users, ledger and games apart
+        os.chdir(args.workdir or temp_dir)
+        api = FakeBotApi(keep_calls=False)
+        report = asyncio.run(run_load_test(args, api))
+
+    report['environment'] = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+    report['settings'] = vars(args)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'action':<20}{'count':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for action, stats in report['actions'].items():
+        print(
+            f"{action:<20}{stats['count']:>8}{stats['p50_ms']:>10.2f}{stats['p90_ms']:>10.2f}"
+            f"{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}"
+        )
+    summary = report['summary']
+    print(
+        f"{summary['updates']} updates from {summary['users']} players in {summary['elapsed_s']}s: "
+        f"{summary['updates_per_sec']} updates/s, {summary['api_calls_per_sec']} API calls/s, "
+        f"{summary['games_per_sec']} games/s"
+    )
+    print(
+        f"Latency p50 {summary['latency_p50_ms']}ms, p99 {summary['latency_p99_ms']}ms; "
+        f"event loop lag p50 {summary['loop_lag_p50_ms']}ms, p99 {summary['loop_lag_p99_ms']}ms, "
+        f"max {summary['loop_lag_max_ms']}ms"
+    )
+    print(
+        f"RSS {summary['rss_before_mib']} -> peak {summary['rss_peak_mib']} MiB, "
+        f"growth {summary['rss_growth_mib']} MiB; {summary['handler_errors']} handler errors"
+    )
+    print(f"Results written to {output}")
+
+    if baseline is None:
+        return 0
+    with open(baseline) as f:
+        regressions = compare(summary, json.load(f), args.threshold)
+    if regressions:
+        print(f"Regressions past {args.threshold:.0%}:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print(f"No regressions past {args.threshold:.0%} against {baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
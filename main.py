@@ -2,10 +2,26 @@ import os
 import json
 import asyncio
 from datetime import datetime, timedelta
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto, InputFile
+from telegram.error import BadRequest
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
 import logging
-from difference_game_generator import DifferenceGameGenerator
+from difference_game_generator import DifferenceGameGenerator, parse_encoding_profiles, panel_offset
+from image_pyramid import zoom_levels, tile_box
+from generation_executor import GenerationExecutor, GeneratorBusyError
+from game_inventory import GameInventory
+from hit_index import DifferenceHitIndex
+from active_games import ActiveGameRegistry
+from metrics import Metrics
+from file_id_cache import FileIdCache
+from update_processor import PerUserUpdateProcessor
+from send_scheduler import SendScheduler
+from render_cache import GameRenderCache
+from game_storage import GameStorage, VARIANTS
+from shared_frames import FrameReader
+from user_store import UserStore
+from leaderboard import LeaderboardIndex
+from ledger import CoinLedger, InsufficientFundsError
 
 # Configure logging
 logging.basicConfig(
@@ -18,14 +34,178 @@ class GameBot:
     def __init__(self, token):
         self.token = token
         self.game_generator = DifferenceGameGenerator()
-        self.users = {}  # In-memory user storage for local testing
-        self.active_games = {}  # Store active games
-        self.admin_id = None  # Set this to your Telegram user ID
+        self.generation_executor = GenerationExecutor.from_env()
+        self.game_inventory = GameInventory.from_env(
+            self.generation_executor,
+            self.game_generator.difficulty_configs.keys()
+        )
+        # Records are a few bytes per game, images are re-rendered from them on demand.
+        # Both live in the storage index, collected to an age and size budget, and
+        # records are looked up when needed rather than held in memory
+        self.archive_games = os.getenv('ARCHIVE_GAMES', '1') == '1'
+        # Delivered images too, content-addressed
+        self.archive_images = os.getenv('ARCHIVE_IMAGES', '0') == '1'
+        self._archive_tasks = set()
+        self.game_storage = GameStorage.from_env() if self.archive_games else None
+        self.render_cache = GameRenderCache(int(os.getenv('RENDER_CACHE_MB', '64')) * 1024 * 1024)
+        # Encoded zoom tiles, cut only when a player asks for one
+        self.tile_cache = GameRenderCache(int(os.getenv('TILE_CACHE_MB', '32')) * 1024 * 1024)
+        self.hit_tolerance = int(os.getenv('HIT_TOLERANCE', '6'))  # Pixels of slack around a difference
+        self.user_store = UserStore(
+            os.getenv('USER_DB_PATH', 'users.db'),
+            flush_interval=int(os.getenv('USER_DB_FLUSH_MS', '50')) / 1000,
+            max_batch=int(os.getenv('USER_DB_MAX_BATCH', '256'))
+        )
+        self.leaderboards = LeaderboardIndex(self.game_generator.difficulty_configs.keys())
+        # Games in progress; idle ones expire so memory stays flat
+        self.active_games = ActiveGameRegistry.from_env(
+            on_expire=self.game_expired,
+            on_evict=self.game_evicted,
+            on_replace=self.game_replaced
+        )
+        self._notify_tasks = set()
+        self.application = None
+        self.ledger = CoinLedger(
+            os.getenv('LEDGER_JOURNAL_PATH', 'ledger.journal'),
+            os.getenv('LEDGER_SNAPSHOT_PATH', 'ledger.snapshot')
+        )
+        self.admin_id = int(os.getenv('ADMIN_USER_ID', '0')) or None  # Your Telegram user ID
+        
+        # One composited upload per game by default; stacked keeps each picture at full
+        # width, where side by side would exceed Telegram's 1280px photo size and be scaled
+        self.delivery_layout = os.getenv('DELIVERY_LAYOUT', 'stacked')
+        # Games render at RENDER_SCALE x 800x600 and are delivered scaled back down;
+        # the extra pixels are only uploaded as zoom tiles on request
+        render_scale = float(os.getenv('RENDER_SCALE', '1'))
+        self.generation_executor.render_scale = render_scale
+        self.generation_executor.encoding = {
+            level: dict(profile, layout=self.delivery_layout, scale=profile['scale'] / render_scale)
+            for level, profile in parse_encoding_profiles(os.getenv('DELIVERY_ENCODING', '')).items()
+        }
+        
+        # Telegram file_ids of images already uploaded, so repeat sends don't re-upload
+        self.file_ids = FileIdCache(os.getenv('FILE_ID_CACHE_PATH', 'file_ids.jsonl'))
         
+        # Every outgoing Bot API call is paced through this; see main()
+        self.send_scheduler = SendScheduler.from_env()
+        
+        self.metrics = Metrics.from_env()
+        self.generation_executor.record_timings = self.metrics.enabled
+        # Shadow handlers with timed wrappers; with metrics off these are the plain methods
+        for name in self.HANDLERS:
+            setattr(self, name, self.metrics.instrument(f"handler.{name}", getattr(self, name)))
+    
+    HANDLERS = (
+        'start_command', 'profile_command', 'play_game_callback', 'mark_difference_callback',
+        'coordinates_message', 'give_up_callback', 'difficulty_callback', 'set_difficulty_callback',
+        'deposit_callback', 'testcoins_command', 'stats_command', 'credit_command', 'replay_command',
+        'withdraw_callback', 'callback_router', 'leaderboard_callback', 'zoom_callback'
+    )
+        
+    async def post_init(self, application):
+        """Start background services once the application is up"""
+        await asyncio.to_thread(self.user_store.start)
+        await asyncio.to_thread(self.ledger.load)
+        self.ledger.start()
+        await self.reconcile_balances()
+        for user_data in self.user_store.values():
+            self.leaderboards.update(user_data['user_id'], user_data)
+        await asyncio.to_thread(self.file_ids.load)
+        if self.game_storage is not None:
+            await asyncio.to_thread(self.import_records_log)
+            self.game_storage.start()
+        self.generation_executor.start()
+        self.game_inventory.start()
+        self.application = application
+        self.active_games.start()
+        await self.metrics.start()
+
+    async def post_shutdown(self, application):
+        """Stop background services"""
+        await self.metrics.stop()
+        await self.active_games.stop()
+        await self.game_inventory.stop()
+        if self._archive_tasks:
+            await asyncio.gather(*self._archive_tasks, return_exceptions=True)
+        self.generation_executor.shutdown()
+        await asyncio.to_thread(self.ledger.close)
+        self.file_ids.close()
+        if self.game_storage is not None:
+            await asyncio.to_thread(self.game_storage.close)
+        await asyncio.to_thread(self.user_store.close)
+
+    def import_records_log(self, path=os.path.join('games', 'records.jsonl')):
+        """Move records from the old append-only log into the storage index, once"""
+        if not os.path.exists(path):
+            return
+        records = self.game_generator.load_game_records(os.path.dirname(path))
+        self.game_storage.save_records(records.values())
+        os.replace(path, path + '.imported')
+        logger.info(f"Imported {len(records)} game records from {path}")
+    
+    async def game_record(self, game_id):
+        """A past game's record from the storage index, or None"""
+        if self.game_storage is None:
+            return None
+        return await asyncio.to_thread(self.game_storage.record, game_id)
+    
+    def archive_game(self, game):
+        """Record a game's seed tuple, and with ARCHIVE_IMAGES its images, on disk in the background"""
+        tasks = [asyncio.create_task(self._save_record(game['game_data']))]
+        if self.archive_images:
+            # Copy now: the buffers may sit in a shared-memory slot that is released after the upload
+            encoded_game = {'image_format': game['image_format'], 'game_data': game['game_data']}
+            for key in (f'{variant}_bytes' for variant in VARIANTS):
+                if key in game:
+                    encoded_game[key] = bytes(game[key])
+            tasks.append(asyncio.create_task(self._save_images(encoded_game)))
+        for task in tasks:
+            self._archive_tasks.add(task)
+            task.add_done_callback(self._archive_done)
+    
+    async def _save_record(self, game_data):
+        with self.metrics.timer('archive.disk_write'):
+            await asyncio.to_thread(self.game_storage.save_records, [self.game_generator.game_record(game_data)])
+    
+    async def _save_images(self, encoded_game):
+        with self.metrics.timer('archive.image_write'):
+            await asyncio.to_thread(self.game_storage.save, encoded_game)
+    
+    def game_finished(self, game):
+        """Let the storage collector reclaim a game's images once it is over"""
+        if self.archive_images:
+            self.game_storage.finish(game.game_id)
+    
+    def _archive_done(self, task):
+        self._archive_tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.warning(f"Failed to archive game: {task.exception()}")
+    
+    async def reconcile_balances(self):
+        """Make stored coin balances match the ledger, which is the source of truth"""
+        for user_data in list(self.user_store.values()):
+            user_id = user_data['user_id']
+            if user_id in self.ledger.balances:
+                if user_data['coins'] != self.ledger.balance(user_id):
+                    user_data['coins'] = self.ledger.balance(user_id)
+                    self.user_store.put(user_id, user_data)
+            elif user_data['coins']:
+                # Balance from before the ledger existed
+                await self.ledger.credit(user_id, user_data['coins'], 'opening_balance')
+    
+    async def post_coins(self, user_id, amount, reason, ref=None):
+        """Apply a coin change through the ledger and mirror the balance into user data"""
+        balance = await self.ledger.apply(user_id, amount, reason, ref)
+        user_data = self.load_user_data(user_id)
+        user_data['coins'] = balance
+        self.save_user_data(user_id, user_data)
+        return balance
+    
     def load_user_data(self, user_id):
         """Load or create user data"""
-        if user_id not in self.users:
-            self.users[user_id] = {
+        user_data = self.user_store.get(user_id)
+        if user_data is None:
+            user_data = {
                 'user_id': user_id,
                 'role': 'player',  # player, gamer, admin
                 'coins': 0,
@@ -36,12 +216,13 @@ class GameBot:
                 'total_deposited': 0,
                 'total_withdrawn': 0
             }
-        return self.users[user_id]
+            self.save_user_data(user_id, user_data)
+        return user_data
     
     def save_user_data(self, user_id, data):
-        """Save user data"""
-        self.users[user_id] = data
-        # In production, this would save to database
+        """Save user data; the store commits it in the background"""
+        self.user_store.put(user_id, data)
+        self.leaderboards.update(user_id, data)
         
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Start command - Welcome new users"""
@@ -129,52 +310,70 @@ Ready to challenge your eyes? 👀
         query = update.callback_query
         await query.answer()
         
-        user_data = self.load_user_data(query.from_user.id)
+        user_id = query.from_user.id
+        user_data = self.load_user_data(user_id)
+        level = user_data['current_level']
+        join_fee = self.calculate_join_fee(level)
         
-        # Check if user has enough coins
-        join_fee = self.calculate_join_fee(user_data['current_level'])
+        # Don't take the fee when there's no stock and every generator worker is already spoken for
+        if not self.game_inventory.available(level) and self.generation_executor.is_busy:
+            await query.edit_message_text(self.busy_message())
+            return
         
-        if user_data['coins'] < join_fee:
+        # Deduct join fee; the ledger serializes this against the user's other taps
+        try:
+            await self.post_coins(user_id, -join_fee, 'join_fee')
+        except InsufficientFundsError as e:
             await query.edit_message_text(
                 f"❌ **Insufficient Coins!**\n\n"
-                f"You need {join_fee} coins to play at {user_data['current_level']}% difficulty.\n"
-                f"Your balance: {user_data['coins']} coins\n\n"
+                f"You need {join_fee} coins to play at {level}% difficulty.\n"
+                f"Your balance: {e.balance} coins\n\n"
                 f"💰 Deposit more coins to continue playing!",
                 parse_mode='Markdown'
             )
             return
         
-        # Deduct join fee
-        user_data['coins'] -= join_fee
-        self.save_user_data(query.from_user.id, user_data)
-        
-        # Generate game
-        await query.edit_message_text("🎮 **Generating your game...**\n\nPlease wait while we create a unique challenge for you! 🎯")
+        # Serve a pre-generated game when the inventory has one for this level
+        game = self.game_inventory.pop(level)
+        self.metrics.incr('inventory.hits' if game is not None else 'inventory.misses')
         
         try:
-            game = self.game_generator.generate_game(
-                difficulty_level=user_data['current_level'],
-                num_differences=5
+            if game is None:
+                await query.edit_message_text("🎮 **Generating your game...**\n\nPlease wait while we create a unique challenge for you! 🎯")
+                
+                # Generate and encode the game in a worker so the event loop stays free
+                with self.metrics.timer('generate.total'):
+                    game = await self.generation_executor.generate_game(
+                        difficulty_level=user_data['current_level'],
+                        num_differences=5
+                    )
+            for stage, seconds in game.pop('timings', ()):
+                self.metrics.observe(f"generate.{stage}", seconds)
+            game_id = game['game_data']['game_id']
+            self.metrics.incr(f"games.difficulty_{level}")
+            
+            # Store active game
+            self.active_games.add(
+                user_id,
+                query.message.chat_id,
+                game['game_data'],
+                join_fee,
+                DifferenceHitIndex.from_game_data(
+                    game['game_data'],
+                    tolerance=round(self.hit_tolerance * game['game_data'].get('render_scale', 1.0))
+                ),
+                view=self.game_view(game)
             )
             
-            # Save game
-            game_files = self.game_generator.save_game(game)
-            game_id = game_files['game_id']
+            # Keep the encoded images warm for replays
+            self.render_cache.put(game)
             
-            # Store active game
-            self.active_games[query.from_user.id] = {
-                'game_id': game_id,
-                'game_data': game['game_data'],
-                'join_fee': join_fee,
-                'start_time': datetime.now(),
-                'attempts': 0,
-                'found_differences': []
-            }
+            # Archiving to disk is optional and never delays the upload
+            if self.archive_games:
+                self.archive_game(game)
             
-            # Send game images
-            with open(game_files['original_path'], 'rb') as f1, open(game_files['modified_path'], 'rb') as f2:
-                
-                game_text = f"""
+            # Send game images straight from the encoded buffers
+            game_text = f"""
 🎯 **Find the Difference Challenge!**
 
 💰 **Stakes:** {join_fee} coins
@@ -182,6 +381,7 @@ Ready to challenge your eyes? 👀
 🔍 **Find:** 5 differences
 ⏰ **Time:** Unlimited
 💎 **Reward:** {self.calculate_reward(user_data['current_level'], join_fee)} coins
+🆔 **Game:** `{game_id}`
 
 **Instructions:**
 1. Compare both images carefully
@@ -189,39 +389,380 @@ Ready to challenge your eyes? 👀
 3. Find all 5 to win!
 
 Good luck! 🍀
-                """
-                
-                keyboard = [
-                    [InlineKeyboardButton("📍 Mark Difference", callback_data=f"mark_diff_{game_id}")],
-                    [InlineKeyboardButton("🚫 Give Up", callback_data=f"give_up_{game_id}")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await context.bot.send_photo(
-                    chat_id=query.message.chat_id,
-                    photo=f1,
-                    caption="🖼️ **Original Image**"
-                )
-                
-                await context.bot.send_photo(
-                    chat_id=query.message.chat_id,
-                    photo=f2,
-                    caption=game_text,
-                    reply_markup=reply_markup,
-                    parse_mode='Markdown'
-                )
-                
+            """
+            
+            keyboard = [
+                [InlineKeyboardButton("📍 Mark Difference", callback_data=f"mark_diff_{game_id}")],
+                [InlineKeyboardButton("🚫 Give Up", callback_data=f"give_up_{game_id}")]
+            ]
+            # Zoom tiles are re-rendered from the archived record
+            if self.archive_games and self.max_zoom(self.active_games.get(user_id)):
+                keyboard.insert(1, [InlineKeyboardButton("🔍 Zoom In", callback_data=f"zoom_{game_id}_0_0_0")])
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            
+            await self.send_game_images(
+                context.bot,
+                query.message.chat_id,
+                game,
+                game_text,
+                "🖼️ **Original Image**",
+                reply_markup=reply_markup,
+                parse_mode='Markdown'
+            )
+            
+            user_data = self.load_user_data(user_id)
+            user_data['games_played'] += 1
+            self.save_user_data(user_id, user_data)
+            
+        except GeneratorBusyError:
+            # Queue filled up between the check and the submit
+            self.metrics.incr('generation.busy')
+            self.metrics.incr('refunds')
+            await self.post_coins(user_id, join_fee, 'refund')
+            await query.edit_message_text(self.busy_message())
+            
         except Exception as e:
             logger.error(f"Error generating game: {e}")
+            self.metrics.incr('generation.failures')
+            self.metrics.incr('refunds')
             # Refund join fee
-            user_data['coins'] += join_fee
-            self.save_user_data(query.from_user.id, user_data)
+            await self.post_coins(user_id, join_fee, 'refund')
             
             await query.edit_message_text(
                 "❌ **Game Generation Failed**\n\n"
                 "Sorry, there was an error creating your game. Your coins have been refunded.\n\n"
                 "Please try again in a moment!"
             )
+        
+        finally:
+            # Uploaded (or failed): the images no longer need to sit in the worker's shared-memory slot
+            if game is not None:
+                self.generation_executor.release_frames(game)
+    
+    def game_view(self, game):
+        """(scale, dx, dy) of the pictures as delivered, for mapping taps back to the scene"""
+        scale = game.get('scale', 1.0)
+        width = round(game['game_data']['width'] * scale)
+        height = round(game['game_data']['height'] * scale)
+        return (scale, *panel_offset(width, height, game.get('layout', 'separate')))
+    
+    @staticmethod
+    def upload_file(game, variant, attach=False):
+        """An upload that reads a game's image in place, shared-memory slot included
+        
+        InputFile would read a file object into bytes up front, so the reader is set after construction.
+        """
+        upload = InputFile(b'', attach=attach)
+        upload.input_file_content = FrameReader(game[f'{variant}_bytes'])
+        return upload
+    
+    async def send_cached_photo(self, bot, chat_id, game, variant, cache_variant=None, **kwargs):
+        """send_photo that references Telegram's file_id when these bytes were uploaded before
+        
+        cache_variant names the picture in the file_id cache when it differs from variant, as for zoom tiles.
+        """
+        game_id = game['game_data']['game_id']
+        payload = game[f'{variant}_bytes']
+        cache_variant = cache_variant or variant
+        digest = self.file_ids.digest(payload)
+        file_id = self.file_ids.get(game_id, cache_variant, digest)
+        if file_id is not None:
+            try:
+                message = await bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+                self.metrics.incr('file_id.hits')
+                return message
+            except BadRequest as e:
+                logger.warning(f"Cached file id for {game_id}/{cache_variant} rejected, re-uploading: {e}")
+                self.file_ids.invalidate(game_id, cache_variant)
+        
+        message = await bot.send_photo(chat_id=chat_id, photo=self.upload_file(game, variant), **kwargs)
+        if message.photo:
+            self.file_ids.put(game_id, cache_variant, digest, message.photo[-1].file_id)
+        return message
+    
+    async def send_cached_album(self, bot, chat_id, game, caption):
+        """send_media_group of both pictures, reusing file_ids where possible"""
+        game_id = game['game_data']['game_id']
+        variants = ('original', 'modified')
+        digests = [self.file_ids.digest(game[f'{variant}_bytes']) for variant in variants]
+        file_ids = [self.file_ids.get(game_id, variant, digest) for variant, digest in zip(variants, digests)]
+        
+        def album(use_cache):
+            return [
+                InputMediaPhoto(
+                    (file_id if use_cache else None) or self.upload_file(game, variant, attach=True),
+                    caption=caption if variant == 'original' else None
+                )
+                for variant, file_id in zip(variants, file_ids)
+            ]
+        
+        try:
+            messages = await bot.send_media_group(chat_id=chat_id, media=album(True))
+        except BadRequest as e:
+            if not any(file_ids):
+                raise
+            logger.warning(f"Cached file ids for {game_id} rejected, re-uploading: {e}")
+            for variant in variants:
+                self.file_ids.invalidate(game_id, variant)
+            file_ids = [None, None]
+            messages = await bot.send_media_group(chat_id=chat_id, media=album(False))
+        
+        for variant, digest, file_id, message in zip(variants, digests, file_ids, messages):
+            if file_id is None and message.photo:
+                self.file_ids.put(game_id, variant, digest, message.photo[-1].file_id)
+        return messages
+    
+    async def send_game_images(self, bot, chat_id, game, caption, original_caption, reply_markup=None, parse_mode=None):
+        """Deliver a game's pictures in the layout they were encoded for"""
+        layout = game.get('layout', 'separate')
+        if layout in ('side_by_side', 'stacked'):
+            with self.metrics.timer('send.composite'):
+                await self.send_cached_photo(
+                    bot, chat_id, game, 'composite',
+                    caption=caption,
+                    reply_markup=reply_markup,
+                    parse_mode=parse_mode
+                )
+            return
+        
+        if layout == 'album':
+            with self.metrics.timer('send.album'):
+                await self.send_cached_album(bot, chat_id, game, original_caption)
+            # Albums can't carry buttons, so the caption follows as a message
+            with self.metrics.timer('send.message'):
+                await bot.send_message(chat_id=chat_id, text=caption, reply_markup=reply_markup, parse_mode=parse_mode)
+            return
+        
+        with self.metrics.timer('send_photo.original'):
+            await self.send_cached_photo(bot, chat_id, game, 'original', caption=original_caption)
+        with self.metrics.timer('send_photo.modified'):
+            await self.send_cached_photo(
+                bot, chat_id, game, 'modified',
+                caption=caption,
+                reply_markup=reply_markup,
+                parse_mode=parse_mode
+            )
+    
+    def max_zoom(self, game):
+        """How many times a player can zoom into a game before running out of rendered pixels"""
+        if game is None:
+            return 0
+        return zoom_levels(game.width, round(game.width * game.view[0]))
+    
+    async def get_tile(self, record, zoom, row, col):
+        """An encoded zoom tile, from the cache or cut in a worker"""
+        tile = self.tile_cache.get(record, (zoom, row, col))
+        if tile is None:
+            self.metrics.incr('tiles.misses')
+            with self.metrics.timer('tiles.render'):
+                tile = await self.generation_executor.render_tile(record, zoom, row, col)
+            self.tile_cache.put(tile)
+        return tile
+    
+    async def zoom_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Send one zoomed tile of the active game, with buttons to zoom further into it"""
+        query = update.callback_query
+        await query.answer()
+        
+        # Callback data is "zoom_<game_id>_<zoom>_<row>_<col>"; zoom 0 is the whole picture
+        game_id, zoom, row, col = query.data[len("zoom_"):].rsplit('_', 3)
+        zoom, row, col = int(zoom), int(row), int(col)
+        game = self.get_active_game(query.from_user.id, game_id)
+        record = await self.game_record(game_id) if game is not None else None
+        if record is None:
+            await context.bot.send_message(chat_id=query.message.chat_id, text="❌ This game is no longer active.")
+            return
+        
+        max_zoom = self.max_zoom(game)
+        if zoom > max_zoom:
+            return
+        self.active_games.touch(game)
+        
+        keyboard = []
+        if zoom < max_zoom:
+            keyboard = [
+                [InlineKeyboardButton(label, callback_data=f"zoom_{game_id}_{zoom + 1}_{2 * row + r}_{2 * col + c}")
+                 for c, label in enumerate(labels)]
+                for r, labels in enumerate((("↖️", "↗️"), ("↙️", "↘️")))
+            ]
+        reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
+        
+        if zoom == 0:
+            await context.bot.send_message(
+                chat_id=query.message.chat_id,
+                text="🔍 Which part of the pictures do you want to see up close?",
+                reply_markup=reply_markup
+            )
+            return
+        
+        try:
+            tile = await self.get_tile(record, zoom, row, col)
+        except GeneratorBusyError:
+            await context.bot.send_message(chat_id=query.message.chat_id, text=self.busy_message())
+            return
+        except Exception as e:
+            logger.error(f"Error cutting zoom tile {zoom}/{row}/{col} of game {game_id}: {e}")
+            await context.bot.send_message(chat_id=query.message.chat_id, text="❌ Could not zoom into this game.")
+            return
+        
+        scale = game.view[0]
+        left, top, right, bottom = tile_box((round(game.width * scale), round(game.height * scale)), zoom, row, col)
+        try:
+            with self.metrics.timer('send.tile'):
+                await self.send_cached_photo(
+                    context.bot, query.message.chat_id, tile, 'composite',
+                    cache_variant=f"zoom_{zoom}_{row}_{col}",
+                    caption=f"🔍 x{2 ** zoom} zoom of x {left}-{right}, y {top}-{bottom}.\n"
+                            f"Mark differences with coordinates on the full picture.",
+                    reply_markup=reply_markup
+                )
+        finally:
+            self.generation_executor.release_frames(tile)
+    
+    def get_active_game(self, user_id, game_id):
+        """Return the user's active game if it matches game_id"""
+        game = self.active_games.get(user_id)
+        if game is None or game.game_id != game_id:
+            return None
+        return game
+    
+    def game_expired(self, game):
+        """Let a player know their idle game was closed"""
+        self.metrics.incr('games.expired')
+        self._notify_closed(
+            game,
+            f"⏰ Your game timed out after {int(self.active_games.ttl // 60)} minutes without a move. "
+        )
+    
+    def game_evicted(self, game):
+        """Let a player know their game was closed to make room at the active game cap"""
+        self.metrics.incr('games.evicted')
+        self._notify_closed(game, "⏳ Your game was closed to make room for other players while the bot is busy. ")
+    
+    def game_replaced(self, game):
+        """Close a game the player left unfinished by starting another; its fee is forfeited as on giving up"""
+        self.metrics.incr('games.replaced')
+        self._notify_closed(game, "🔁 Your previous game was closed when you started a new one. ")
+    
+    def _notify_closed(self, game, reason):
+        self.game_finished(game)
+        if self.application is None:
+            return
+        task = asyncio.create_task(self.application.bot.send_message(
+            chat_id=game.chat_id,
+            text=f"{reason}You found {game.found_count}/{game.total_differences} differences."
+        ))
+        self._notify_tasks.add(task)
+        task.add_done_callback(self._notify_done)
+    
+    def _notify_done(self, task):
+        self._notify_tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.warning(f"Failed to send notification: {task.exception()}")
+    
+    async def mark_difference_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Ask the player for the coordinates of a difference"""
+        query = update.callback_query
+        await query.answer()
+        
+        game_id = query.data[len("mark_diff_"):]
+        game = self.get_active_game(query.from_user.id, game_id)
+        if game is None:
+            await context.bot.send_message(chat_id=query.message.chat_id, text="❌ This game is no longer active.")
+            return
+        
+        game.awaiting_mark = True
+        self.active_games.touch(game)
+        scale, dx, dy = game.view
+        where = "either picture" if dx or dy else "the modified image"
+        await context.bot.send_message(
+            chat_id=query.message.chat_id,
+            text=f"📍 **Mark a Difference**\n\n"
+                 f"Send the position as `x y` on {where}.\n"
+                 f"Each picture is {round(game.width * scale)}x{round(game.height * scale)} pixels, "
+                 f"with 0 0 in its top-left corner.",
+            parse_mode='Markdown'
+        )
+    
+    async def coordinates_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Check a submitted coordinate against the active game"""
+        user_id = update.effective_user.id
+        game = self.active_games.get(user_id)
+        if game is None or not game.awaiting_mark:
+            return
+        
+        parts = update.message.text.replace(',', ' ').split()
+        if len(parts) != 2 or not all(part.isdigit() for part in parts):
+            await update.message.reply_text("❓ Please send two numbers, like `120 340`.", parse_mode='Markdown')
+            return
+        
+        x, y = int(parts[0]), int(parts[1])
+        game.attempts += 1
+        self.active_games.touch(game)
+        diff_id = game.hit_index.lookup(*game.to_scene(x, y))
+        total = game.total_differences
+        
+        if diff_id is None:
+            await update.message.reply_text(f"❌ Nothing different at ({x}, {y}). Keep looking! 👀")
+            return
+        if game.is_found(diff_id):
+            await update.message.reply_text("🔁 You already found that one!")
+            return
+        
+        game.mark_found(diff_id)
+        found = game.found_count
+        
+        if found < total:
+            await update.message.reply_text(f"✅ Found one! {found}/{total} differences spotted.")
+            return
+        
+        # All differences found - pay out
+        self.metrics.incr('games.won')
+        self.active_games.remove(user_id)
+        self.game_finished(game)
+        reward = self.calculate_reward(game.difficulty, game.join_fee)
+        await self.post_coins(user_id, reward, 'reward', ref=game.game_id)
+        user_data = self.load_user_data(user_id)
+        user_data['games_won'] += 1
+        wins_by_level = user_data.setdefault('wins_by_level', {})
+        level_key = str(game.difficulty)
+        wins_by_level[level_key] = wins_by_level.get(level_key, 0) + 1
+        self.save_user_data(user_id, user_data)
+        
+        keyboard = [[InlineKeyboardButton("🎮 Play Again", callback_data="play_game")]]
+        await update.message.reply_text(
+            f"🏆 **You Win!**\n\n"
+            f"All {total} differences found in {game.attempts} attempts.\n"
+            f"💎 Reward: {reward} coins\n"
+            f"💰 Balance: {user_data['coins']} coins",
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode='Markdown'
+        )
+    
+    async def give_up_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """End the active game without a reward"""
+        query = update.callback_query
+        await query.answer()
+        
+        game_id = query.data[len("give_up_"):]
+        game = self.get_active_game(query.from_user.id, game_id)
+        if game is None:
+            await context.bot.send_message(chat_id=query.message.chat_id, text="❌ This game is no longer active.")
+            return
+        
+        self.active_games.remove(query.from_user.id)
+        self.game_finished(game)
+        self.metrics.incr('games.given_up')
+        found = game.found_count
+        keyboard = [[InlineKeyboardButton("🎮 Play Again", callback_data="play_game")]]
+        await context.bot.send_message(
+            chat_id=query.message.chat_id,
+            text=f"🚫 **Game Over**\n\n"
+                 f"You found {found}/{game.total_differences} differences.\n"
+                 f"Better luck next time! 🍀",
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode='Markdown'
+        )
     
     async def difficulty_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle difficulty selection"""
@@ -299,12 +840,95 @@ Send a message with your transaction details!
 
 # Add this command for testing
     async def testcoins_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-       user_data = self.load_user_data(update.effective_user.id)
-       user_data['coins'] += 1000
-       self.save_user_data(update.effective_user.id, user_data)
+       await self.post_coins(update.effective_user.id, 1000, 'testcoins')
        await update.message.reply_text("💰 Added 1000 test coins!")
 
+    async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Admin: live game count and memory, inventory and cache state"""
+        if self.admin_id is None or update.effective_user.id != self.admin_id:
+            return
+        
+        games = self.active_games.stats()
+        inventory = self.game_inventory.stats()
+        sends = self.send_scheduler.stats()
+        text = (
+            f"🎮 Active games: {games['active_games']} (~{games['approx_bytes'] / 1024:.0f} KiB)\n"
+            f"⏰ Expired: {games['expired']}, evicted: {games['evicted']}, replaced: {games['replaced']}\n"
+            f"📦 Inventory: {inventory['stock']}, hit rate {inventory['hit_rate']:.0%}\n"
+            f"🖼️ Render cache: {len(self.render_cache)} games, {self.render_cache.current_bytes / 1024 / 1024:.1f} MiB\n"
+            f"🔍 Tile cache: {len(self.tile_cache)} tiles, {self.tile_cache.current_bytes / 1024 / 1024:.1f} MiB\n"
+            f"📤 Sends: {sends['sent']} sent, {sends['queued']} queued, "
+            f"{sends['coalesced']} edits coalesced, {sends['retries']} flood retries"
+        )
+        if self.generation_executor.frames is not None:
+            frames = self.generation_executor.frames.stats()
+            text += f"\n🧩 Frame ring: {frames['in_use']}/{frames['slots']} slots in use, {frames['fallbacks']} fallbacks"
+        if self.game_storage is not None:
+            storage = await asyncio.to_thread(self.game_storage.stats)
+            text += (
+                f"\n💾 Stored games: {storage['games']} in {storage['bytes'] / 1024 / 1024:.1f} MiB, "
+                f"{storage['deduped']} deduped images, {storage['collected']} collected; "
+                f"{storage['records']} records, {storage['records_collected']} collected"
+            )
+        await update.message.reply_text(text)
+
+    async def credit_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Admin: credit a confirmed TON deposit as coins - /credit <user_id> <coins>"""
+        if self.admin_id is None or update.effective_user.id != self.admin_id:
+            return
+        
+        if len(context.args) != 2 or not all(arg.isdigit() for arg in context.args):
+            await update.message.reply_text("Usage: /credit <user_id> <coins>")
+            return
+        
+        user_id, coins = int(context.args[0]), int(context.args[1])
+        balance = await self.post_coins(user_id, coins, 'deposit', ref=f"admin:{update.effective_user.id}")
+        user_data = self.load_user_data(user_id)
+        user_data['total_deposited'] += coins / 100  # 1 TON = 100 coins
+        self.save_user_data(user_id, user_data)
+        await update.message.reply_text(f"✅ Credited {coins} coins to {user_id}. New balance: {balance}")
 
+
+    async def get_rendered_game(self, record):
+        """Encoded images for a stored game, from the cache or re-rendered in a worker"""
+        game = self.render_cache.get(record)
+        if game is None:
+            game = await self.generation_executor.render_game(record)
+            self.render_cache.put(game)
+        return game
+    
+    async def replay_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Re-send the images of a past game, e.g. to settle a dispute"""
+        if not context.args:
+            await update.message.reply_text("Usage: /replay <game_id>")
+            return
+        
+        record = await self.game_record(context.args[0])
+        if record is None:
+            await update.message.reply_text("❌ Unknown game id.")
+            return
+        
+        try:
+            game = await self.get_rendered_game(record)
+        except GeneratorBusyError:
+            await update.message.reply_text(self.busy_message())
+            return
+        except Exception as e:
+            logger.error(f"Error re-rendering game {record['game_id']}: {e}")
+            await update.message.reply_text("❌ Could not re-render this game.")
+            return
+        
+        try:
+            await self.send_game_images(
+                context.bot,
+                update.effective_chat.id,
+                game,
+                f"🔍 Game {record['game_id']} - {record['difficulty']}% difficulty, created {record['created_at'][:10]}",
+                f"🖼️ Original - game {record['game_id']}"
+            )
+        finally:
+            self.generation_executor.release_frames(game)
+    
     async def withdraw_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle withdrawal request"""
         query = update.callback_query
@@ -350,6 +974,14 @@ Copy and send to admin! 📋
         
         await query.edit_message_text(withdraw_text, parse_mode='Markdown')
     
+    def busy_message(self):
+        """Reply used when the generation queue is full"""
+        return (
+            "⏳ **Servers Busy**\n\n"
+            "Lots of players are starting games right now. "
+            "No coins were taken - please try again in a few seconds!"
+        )
+    
     def calculate_join_fee(self, difficulty):
         """Calculate join fee based on difficulty"""
         base_fee = 10
@@ -377,32 +1009,113 @@ Copy and send to admin! 📋
             await self.deposit_callback(update, context)
         elif data == "withdraw":
             await self.withdraw_callback(update, context)
-        elif data == "leaderboard":
+        elif data == "leaderboard" or data.startswith("lb_"):
             await self.leaderboard_callback(update, context)
+        elif data.startswith("mark_diff_"):
+            await self.mark_difference_callback(update, context)
+        elif data.startswith("give_up_"):
+            await self.give_up_callback(update, context)
+        elif data.startswith("zoom_"):
+            await self.zoom_callback(update, context)
+    
+    def leaderboard_title(self, board):
+        """Human readable name of a leaderboard"""
+        if board.startswith('wins_'):
+            return f"Wins at {board[5:]}%"
+        return {'coins': 'Coins', 'win_rate': 'Win Rate', 'games_won': 'Games Won'}[board]
     
     async def leaderboard_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Show leaderboard"""
+        """Show a page of one leaderboard"""
         query = update.callback_query
         await query.answer()
         
-        # Sort users by coins
-        sorted_users = sorted(self.users.values(), key=lambda x: x['coins'], reverse=True)[:10]
+        # Callback data is "leaderboard" or "lb_<board>_<page>"
+        board, page = 'coins', 0
+        if query.data.startswith("lb_"):
+            try:
+                board, page = query.data[3:].rsplit('_', 1)
+                page = int(page)
+            except ValueError:
+                board, page = 'coins', 0
+        # Callback data comes from the client, so a crafted negative page must not index from the end
+        page = max(0, page)
+        if board not in self.leaderboards.boards:
+            board = 'coins'
+        
+        page_size = 10
+        entries = self.leaderboards.page(board, page, page_size)
         
-        leaderboard_text = "🏆 **Top Players**\n\n"
+        leaderboard_text = f"🏆 **Top Players - {self.leaderboard_title(board)}**\n\n"
         
-        for i, user in enumerate(sorted_users):
+        for i, (user_id, score) in enumerate(entries, start=page * page_size):
+            user = self.user_store.get(user_id)
             emoji = ["🥇", "🥈", "🥉"][i] if i < 3 else f"{i+1}."
             win_rate = (user['games_won']/max(1,user['games_played'])*100)
-            leaderboard_text += f"{emoji} {user['coins']} coins | {win_rate:.1f}% win rate\n"
+            if board == 'coins':
+                leaderboard_text += f"{emoji} {user['coins']} coins | {win_rate:.1f}% win rate\n"
+            elif board == 'win_rate':
+                leaderboard_text += f"{emoji} {score:.1f}% win rate | {user['games_played']} games\n"
+            else:
+                leaderboard_text += f"{emoji} {score} wins | {user['coins']} coins\n"
         
-        if not sorted_users:
+        if not entries:
             leaderboard_text += "No players yet! Be the first! 🎮"
         
-        keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="profile")]]
+        rank = self.leaderboards.rank(board, query.from_user.id)
+        if rank is not None:
+            leaderboard_text += f"\n📍 Your rank: #{rank} of {self.leaderboards.size(board)}"
+        
+        keyboard = [
+            [InlineKeyboardButton("💰 Coins", callback_data="lb_coins_0"),
+             InlineKeyboardButton("📈 Win Rate", callback_data="lb_win_rate_0"),
+             InlineKeyboardButton("🏅 Wins", callback_data="lb_games_won_0")],
+            [InlineKeyboardButton(f"{level}%", callback_data=f"lb_wins_{level}_0")
+             for level in self.game_generator.difficulty_configs]
+        ]
+        paging = []
+        if page > 0:
+            paging.append(InlineKeyboardButton("◀️ Prev", callback_data=f"lb_{board}_{page - 1}"))
+        if (page + 1) * page_size < self.leaderboards.size(board):
+            paging.append(InlineKeyboardButton("Next ▶️", callback_data=f"lb_{board}_{page + 1}"))
+        if paging:
+            keyboard.append(paging)
+        keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="profile")])
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         await query.edit_message_text(leaderboard_text, reply_markup=reply_markup, parse_mode='Markdown')
 
+def build_application(bot, token, api_url=None, request=None):
+    """The bot's Application with every handler registered
+    
+    api_url points at another Bot API server, e.g. fake_telegram.py for local
+    testing; request replaces the HTTP client, as load_test.py does to answer
+    calls in-process.
+    """
+    # Different users' updates run concurrently, each user's in order
+    builder = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(PerUserUpdateProcessor(int(os.getenv('UPDATE_CONCURRENCY', '64'))))
+        .rate_limiter(bot.send_scheduler)
+        .post_init(bot.post_init)
+        .post_shutdown(bot.post_shutdown)
+    )
+    if api_url:
+        builder = builder.base_url(f"{api_url.rstrip('/')}/bot").base_file_url(f"{api_url.rstrip('/')}/file/bot")
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    application = builder.build()
+    
+    application.add_handler(CommandHandler("testcoins", bot.testcoins_command))
+    application.add_handler(CommandHandler("start", bot.start_command))
+    application.add_handler(CommandHandler("profile", bot.profile_command))
+    application.add_handler(CommandHandler("replay", bot.replay_command))
+    application.add_handler(CommandHandler("credit", bot.credit_command))
+    application.add_handler(CommandHandler("stats", bot.stats_command))
+    application.add_handler(CallbackQueryHandler(bot.callback_router))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot.coordinates_message))
+    return application
+
 def main():
     """Main function to run the bot"""
     # Get bot token from environment variable
@@ -417,22 +1130,29 @@ def main():
     
     # Create bot instance
     bot = GameBot(TOKEN)
-    
-    # Create application
-    application = Application.builder().token(TOKEN).build()
-    
-    # Add handlers
-    # Add this line in main() with other handlers:
-    application.add_handler(CommandHandler("testcoins", bot.testcoins_command))
-    
-    application.add_handler(CommandHandler("start", bot.start_command))
-    application.add_handler(CommandHandler("profile", bot.profile_command))
-    application.add_handler(CallbackQueryHandler(bot.callback_router))
+    application = build_application(bot, TOKEN, api_url=os.getenv('TELEGRAM_API_URL'))
     
     # Start bot
     print("🤖 Bot starting...")
     print("Send /start to your bot on Telegram to test!")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if os.getenv('BOT_MODE', 'polling') == 'webhook':
+        # Telegram pushes updates to WEBHOOK_URL/WEBHOOK_PATH; any number of instances can sit behind it
+        webhook_url = os.getenv('WEBHOOK_URL')
+        if not webhook_url:
+            print("❌ Please set WEBHOOK_URL to the public https address of this service")
+            return
+        url_path = os.getenv('WEBHOOK_PATH', 'telegram')
+        application.run_webhook(
+            listen=os.getenv('WEBHOOK_LISTEN', '0.0.0.0'),
+            port=int(os.getenv('PORT', '8000')),
+            url_path=url_path,
+            webhook_url=f"{webhook_url.rstrip('/')}/{url_path}",
+            secret_token=os.getenv('WEBHOOK_SECRET'),
+            max_connections=int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40')),
+            allowed_updates=Update.ALL_TYPES
+        )
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == '__main__':
     main()
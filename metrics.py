@@ -0,0 +1,191 @@
+import os
+import time
+import asyncio
+import logging
+import functools
+from bisect import bisect_left
+from contextlib import nullcontext
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Log-spaced bucket upper bounds in seconds: 0.1ms to ~74s in steps of sqrt(2)
+BUCKET_BOUNDS = tuple(0.0001 * 2 ** (i / 2) for i in range(40))
+
+_NULL_TIMER = nullcontext()
+
+
+class Histogram:
+    """Fixed-bucket latency histogram; recording is one bisect and two adds"""
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        # One extra bucket for anything past the last bound
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th observation, capped at the max seen"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(BUCKET_BOUNDS[index], self.max) if index < len(BUCKET_BOUNDS) else self.max
+        return self.max
+
+
+class _Timer:
+    __slots__ = ('histogram', 'started')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+
+class Metrics:
+    """In-process latency histograms and counters
+
+    Disabled metrics cost nothing on the hot path: instrument() hands back the
+    original function, timer() a shared no-op context, and observe()/incr()
+    return immediately. When enabled, a snapshot is logged every
+    `dump_interval` seconds and, if `port` is set, served as plain text on
+    127.0.0.1:port.
+    """
+
+    def __init__(self, enabled=False, dump_interval=60.0, port=0):
+        self.enabled = enabled
+        self.dump_interval = dump_interval
+        self.port = port
+        self.histograms = {}
+        self.counters = Counter()
+        self.started_at = time.time()
+        self._task = None
+        self._server = None
+
+    @classmethod
+    def from_env(cls):
+        """Build metrics from METRICS_* environment variables"""
+        return cls(
+            enabled=os.getenv('METRICS_ENABLED', '0') == '1',
+            dump_interval=float(os.getenv('METRICS_DUMP_INTERVAL', '60')),
+            port=int(os.getenv('METRICS_PORT', '0'))
+        )
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        return histogram
+
+    def observe(self, name, seconds):
+        if self.enabled:
+            self.histogram(name).observe(seconds)
+
+    def incr(self, name, amount=1):
+        if self.enabled:
+            self.counters[name] += amount
+
+    def timer(self, name):
+        """Context manager timing its block into histogram `name`"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self.histogram(name))
+
+    def instrument(self, name, handler):
+        """Wrap an async handler so its latency and failures are recorded"""
+        if not self.enabled:
+            return handler
+        histogram = self.histogram(name)
+
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await handler(*args, **kwargs)
+            except Exception:
+                self.counters[f"{name}.errors"] += 1
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - started)
+
+        return wrapper
+
+    def render(self):
+        """Snapshot as text, one metric per line"""
+        lines = [f"uptime_seconds {time.time() - self.started_at:.0f}"]
+        for name in sorted(self.counters):
+            lines.append(f"{name} {self.counters[name]}")
+        for name in sorted(self.histograms):
+            h = self.histograms[name]
+            if not h.count:
+                continue
+            lines.append(
+                f"{name} count={h.count} mean={h.total / h.count * 1000:.2f}ms "
+                f"p50={h.quantile(0.5) * 1000:.2f}ms p90={h.quantile(0.9) * 1000:.2f}ms "
+                f"p99={h.quantile(0.99) * 1000:.2f}ms max={h.max * 1000:.2f}ms"
+            )
+        return "\n".join(lines) + "\n"
+
+    async def start(self):
+        """Start the periodic log dump and the text endpoint, if enabled"""
+        if not self.enabled:
+            return
+        if self.dump_interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._dump_loop())
+        if self.port and self._server is None:
+            self._server = await asyncio.start_server(self._serve, '127.0.0.1', self.port)
+            logger.info(f"Metrics endpoint on http://127.0.0.1:{self.port}/")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _dump_loop(self):
+        while True:
+            await asyncio.sleep(self.dump_interval)
+            logger.info("Metrics:\n" + self.render())
+
+    async def _serve(self, reader, writer):
+        """Answer any HTTP request with the current snapshot"""
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            body = self.render().encode('utf-8')
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; charset=utf-8\r\n"
+                + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('ascii')
+                + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,97 @@
+import math
+import numpy as np
+
+
+class PlacementError(ValueError):
+    """Raised when no free spot is left for a difference"""
+
+
+def window_sums(table, rows, cols):
+    """Sum of every rows x cols window of a summed-area table, indexed by top-left cell"""
+    return table[rows:, cols:] - table[:-rows, cols:] - table[rows:, :-cols] + table[:-rows, :-cols]
+
+
+def summed_area(grid):
+    table = np.zeros((grid.shape[0] + 1, grid.shape[1] + 1), dtype=np.int32)
+    table[1:, 1:] = grid.cumsum(axis=0, dtype=np.int32).cumsum(axis=1)
+    return table
+
+
+class PlacementGrid:
+    """Occupancy grid for placing differences without overlap, on scene content
+
+    The canvas is cut into `cell`-pixel cells in base (800x600) coordinates,
+    so the grid has the same size at every render scale. A content map marks
+    the cells covered by scene objects. For each footprint size the grid keeps
+    a map of the top-left cells where that footprint is free and inside the
+    canvas, built once from summed-area tables; a placement reserves its
+    footprint plus a one-cell gap by clearing one rectangle in each map. The
+    spot is drawn uniformly from the free cells that mostly cover content, so
+    the cost per difference does not depend on how full the grid is and
+    nothing is retried.
+    """
+
+    def __init__(self, width=800, height=600, objects=(), scale=1.0, cell=10, edge=10, min_content=0.25):
+        self.cell = cell
+        self.min_content = min_content
+        self.rows, self.cols = math.ceil(height / cell), math.ceil(width / cell)
+        # Keep whole footprints `edge` pixels inside the canvas
+        self.margin = math.ceil(edge / cell)
+
+        content = np.zeros((self.rows, self.cols), dtype=bool)
+        if objects:
+            boxes = np.array([obj['bbox'] for obj in objects], dtype=np.float64) / (scale * cell)
+            starts = np.maximum(np.floor(boxes[:, :2]), 0).astype(np.intp).tolist()
+            ends = np.ceil(boxes[:, 2:]).astype(np.intp).tolist()
+            for (left, top), (right, bottom) in zip(starts, ends):
+                content[top:bottom, left:right] = True
+        self.content = content
+        self._content_table = summed_area(content)
+        self._reserved = []
+        # footprint size in cells -> (free, on content) top-left cell maps
+        self._maps = {}
+
+    def _size_maps(self, size):
+        maps = self._maps.get(size)
+        if maps is None:
+            free = np.zeros((self.rows - size + 1, self.cols - size + 1), dtype=bool)
+            free[self.margin:self.rows - self.margin - size + 1, self.margin:self.cols - self.margin - size + 1] = True
+            for rect in self._reserved:
+                self._clear(free, size, rect)
+            needed = max(1, int(size * size * self.min_content))
+            maps = self._maps[size] = (free, window_sums(self._content_table, size, size) >= needed)
+        return maps
+
+    @staticmethod
+    def _clear(free, size, rect):
+        """Mark every footprint of this size that would touch rect as taken"""
+        top, left, bottom, right = rect
+        free[max(0, top - size + 1):bottom, max(0, left - size + 1):right] = False
+
+    def candidates(self, extent, anchored=True):
+        """Flat indices of the top-left cells where a square of `extent` base pixels fits"""
+        # One spare cell leaves room to jitter the position inside the first cell
+        size = math.ceil(extent / self.cell) + 1
+        if size > min(self.rows, self.cols) - 2 * self.margin:
+            return size, np.empty(0, dtype=np.intp)
+        free, on_content = self._size_maps(size)
+        return size, np.flatnonzero(free & on_content if anchored else free)
+
+    def place(self, rng, extent, anchored=True):
+        """Reserve room for a difference up to `extent` base pixels square; return its (x, y)
+
+        Falls back to a spot off scene content when every object is taken.
+        """
+        size, cells = self.candidates(extent, anchored)
+        if anchored and not len(cells):
+            size, cells = self.candidates(extent, anchored=False)
+        if not len(cells):
+            raise PlacementError(f"No room left for a {extent}px difference")
+
+        row, col = divmod(int(cells[rng.randrange(len(cells))]), self.cols - size + 1)
+        # Reserve the footprint and a one-cell gap around it
+        rect = (max(0, row - 1), max(0, col - 1), row + size + 1, col + size + 1)
+        self._reserved.append(rect)
+        for other, (free, _) in self._maps.items():
+            self._clear(free, other, rect)
+        return col * self.cell + rng.randrange(self.cell), row * self.cell + rng.randrange(self.cell)
@@ -0,0 +1,59 @@
+from collections import OrderedDict
+
+
+class GameRenderCache:
+    """Size-bounded LRU cache of encoded games, keyed by their render tuple
+
+    Zoom tiles are cached the same way, with their (zoom, row, col) added to the key.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def key(record, tile=None):
+        """Everything that determines the rendered pixels"""
+        return (
+            record['seed'], record.get('renderer'), record.get('theme'), record.get('density'), record['difficulty'],
+            record['total_differences'], record['generator_version'], record.get('render_scale', 1.0), tile
+        )
+
+    @staticmethod
+    def entry_size(encoded_game):
+        return sum(len(encoded_game[key]) for key in ('original_bytes', 'modified_bytes', 'composite_bytes')
+                   if key in encoded_game)
+
+    def get(self, record, tile=None):
+        """Return the cached encoded game (or tile) for a record, or None"""
+        key = self.key(record, tile)
+        encoded_game = self._entries.get(key)
+        if encoded_game is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return encoded_game
+
+    def put(self, encoded_game):
+        """Cache an encoded game, evicting the least recently used ones over budget"""
+        key = self.key(encoded_game['game_data'], encoded_game.get('tile'))
+        size = self.entry_size(encoded_game)
+        if size > self.max_bytes:
+            return
+
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.current_bytes -= self.entry_size(old)
+
+        self._entries[key] = encoded_game
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= self.entry_size(evicted)
+
+    def __len__(self):
+        return len(self._entries)
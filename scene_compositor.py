@@ -0,0 +1,266 @@
+import random
+from PIL import Image, ImageDraw
+
+
+# Sprite drawing functions. Each one draws a single object onto a transparent
+# canvas in its own coordinate space, multiplied by `s`, and returns the canvas.
+
+def _canvas(width, height, s):
+    sprite = Image.new('RGBA', (round(width * s) + 1, round(height * s) + 1), (0, 0, 0, 0))
+    return sprite, ImageDraw.Draw(sprite)
+
+
+def _box(s, *coords):
+    return [round(c * s) for c in coords]
+
+
+def draw_sun(s, palette):
+    sprite, draw = _canvas(60, 60, s)
+    draw.ellipse(_box(s, 0, 0, 60, 60), fill=palette['sun'])
+    return sprite
+
+
+def draw_moon(s, palette):
+    sprite, draw = _canvas(60, 60, s)
+    draw.ellipse(_box(s, 0, 0, 60, 60), fill=palette['moon'])
+    # Bite out a crescent
+    draw.ellipse(_box(s, 18, -6, 70, 46), fill=(0, 0, 0, 0))
+    return sprite
+
+
+def draw_star(s, palette):
+    sprite, draw = _canvas(6, 6, s)
+    draw.ellipse(_box(s, 0, 0, 6, 6), fill=palette['star'])
+    return sprite
+
+
+def draw_cloud(s, palette):
+    sprite, draw = _canvas(80, 40, s)
+    draw.ellipse(_box(s, 0, 10, 60, 40), fill=palette['cloud'])
+    draw.ellipse(_box(s, 20, 0, 80, 30), fill=palette['cloud'])
+    return sprite
+
+
+def draw_tree(s, palette):
+    sprite, draw = _canvas(50, 90, s)
+    # Trunk
+    draw.rectangle(_box(s, 15, 30, 35, 90), fill=palette['trunk'])
+    # Leaves
+    draw.ellipse(_box(s, 0, 0, 50, 50), fill=palette['leaves'])
+    return sprite
+
+
+def draw_pine(s, palette):
+    sprite, draw = _canvas(50, 100, s)
+    draw.rectangle(_box(s, 20, 75, 30, 100), fill=palette['trunk'])
+    draw.polygon(_box(s, 0, 80, 50, 80, 25, 20), fill=palette['leaves'])
+    draw.polygon(_box(s, 5, 50, 45, 50, 25, 0), fill=palette['leaves'])
+    # Snow caps
+    draw.polygon(_box(s, 17, 12, 33, 12, 25, 0), fill=palette['snow'])
+    return sprite
+
+
+def draw_palm(s, palette):
+    sprite, draw = _canvas(70, 110, s)
+    draw.rectangle(_box(s, 31, 25, 39, 110), fill=palette['trunk'])
+    draw.ellipse(_box(s, 0, 10, 40, 30), fill=palette['leaves'])
+    draw.ellipse(_box(s, 30, 10, 70, 30), fill=palette['leaves'])
+    draw.ellipse(_box(s, 20, 0, 50, 20), fill=palette['leaves'])
+    return sprite
+
+
+def draw_house(s, palette):
+    sprite, draw = _canvas(100, 120, s)
+    # House body
+    draw.rectangle(_box(s, 10, 40, 90, 120), fill=palette['wall'])
+    # Roof
+    draw.polygon(_box(s, 0, 40, 100, 40, 50, 0), fill=palette['roof'])
+    # Door
+    draw.rectangle(_box(s, 40, 80, 60, 120), fill=palette['door'])
+    # Windows
+    draw.rectangle(_box(s, 20, 60, 35, 75), fill=palette['window'])
+    draw.rectangle(_box(s, 65, 60, 80, 75), fill=palette['window'])
+    return sprite
+
+
+def draw_snowman(s, palette):
+    sprite, draw = _canvas(40, 70, s)
+    draw.ellipse(_box(s, 0, 30, 40, 70), fill=palette['snow'])
+    draw.ellipse(_box(s, 8, 8, 32, 34), fill=palette['snow'])
+    draw.rectangle(_box(s, 10, 0, 30, 10), fill=palette['door'])
+    draw.polygon(_box(s, 20, 19, 30, 21, 20, 23), fill=palette['sun'])
+    return sprite
+
+
+def draw_umbrella(s, palette):
+    sprite, draw = _canvas(60, 70, s)
+    draw.rectangle(_box(s, 28, 20, 32, 70), fill=palette['trunk'])
+    draw.pieslice(_box(s, 0, 0, 60, 40), 180, 360, fill=palette['roof'])
+    return sprite
+
+
+SPRITES = {
+    'sun': draw_sun,
+    'moon': draw_moon,
+    'star': draw_star,
+    'cloud': draw_cloud,
+    'tree': draw_tree,
+    'pine': draw_pine,
+    'palm': draw_palm,
+    'house': draw_house,
+    'snowman': draw_snowman,
+    'umbrella': draw_umbrella
+}
+
+_BASE_PALETTE = {
+    'sun': (255, 255, 0),
+    'moon': (245, 245, 210),
+    'star': (255, 255, 230),
+    'cloud': (255, 255, 255),
+    'trunk': (139, 69, 19),
+    'leaves': (0, 128, 0),
+    'snow': (250, 250, 255),
+    'wall': (205, 133, 63),
+    'roof': (139, 0, 0),
+    'door': (101, 67, 33),
+    'window': (173, 216, 230)
+}
+
+# Each layer is (sprite, count range, placement). Placements:
+#   'sky'    - anywhere in the upper band, x/y ranges are relative to the canvas
+#   'ground' - standing on the ground line
+THEMES = {
+    'countryside': {
+        'sky': (135, 206, 235),
+        'ground': (34, 139, 34),
+        'palette': {},
+        'layers': [
+            ('sun', (1, 1), 'sky'),
+            ('cloud', (2, 4), 'sky'),
+            ('tree', (3, 6), 'ground'),
+            ('house', (1, 3), 'ground')
+        ]
+    },
+    'night': {
+        'sky': (20, 24, 64),
+        'ground': (16, 64, 24),
+        'palette': {'leaves': (0, 80, 20), 'window': (255, 220, 90), 'wall': (120, 80, 50)},
+        'layers': [
+            ('star', (10, 20), 'sky'),
+            ('moon', (1, 1), 'sky'),
+            ('tree', (2, 5), 'ground'),
+            ('house', (1, 3), 'ground')
+        ]
+    },
+    'winter': {
+        'sky': (200, 220, 235),
+        'ground': (240, 244, 250),
+        'palette': {'leaves': (20, 90, 50), 'snow': (255, 255, 255), 'sun': (255, 140, 0)},
+        'layers': [
+            ('cloud', (3, 5), 'sky'),
+            ('pine', (3, 7), 'ground'),
+            ('snowman', (1, 2), 'ground'),
+            ('house', (1, 2), 'ground')
+        ]
+    },
+    'beach': {
+        'sky': (100, 190, 255),
+        'ground': (238, 214, 175),
+        'palette': {'leaves': (40, 160, 60), 'roof': (230, 60, 90)},
+        'layers': [
+            ('sun', (1, 1), 'sky'),
+            ('cloud', (1, 3), 'sky'),
+            ('palm', (2, 5), 'ground'),
+            ('umbrella', (1, 4), 'ground')
+        ]
+    }
+}
+
+
+class SpriteAtlas:
+    """Sprites rasterized once per (kind, theme, scale) and reused for every scene"""
+
+    def __init__(self):
+        self._sprites = {}
+
+    def get(self, kind, theme, scale=1.0):
+        """Return (rgb, mask) for a sprite
+
+        Sprites are drawn without anti-aliasing, so a 1-bit alpha mask is exact
+        and pastes several times faster than an 8-bit one.
+        """
+        key = (kind, theme, scale)
+        sprite = self._sprites.get(key)
+        if sprite is None:
+            palette = dict(_BASE_PALETTE, **THEMES[theme]['palette'])
+            rgba = SPRITES[kind](scale, palette)
+            sprite = (rgba.convert('RGB'), rgba.getchannel('A').convert('1'))
+            self._sprites[key] = sprite
+        return sprite
+
+    def warm(self, theme, scale=1.0):
+        """Rasterize every sprite a theme uses ahead of time"""
+        for kind, _, _ in THEMES[theme]['layers']:
+            self.get(kind, theme, scale)
+
+    def __len__(self):
+        return len(self._sprites)
+
+
+class SceneCompositor:
+    """Builds scenes by pasting pre-rendered sprites onto a themed background"""
+
+    ground_height = 100
+
+    def __init__(self, atlas=None):
+        self.atlas = atlas or SpriteAtlas()
+
+    def ground_line(self, height, scale=1.0):
+        """First canvas row of the ground band"""
+        return round((height - self.ground_height) * scale)
+
+    def layout(self, width=800, height=600, rng=None, theme='countryside', density=1.0, scale=1.0):
+        """Draw object placements for a scene as (kind, left, top) in canvas pixels
+
+        Positions are drawn in base coordinates, using the base sprite sizes,
+        and multiplied by `scale`, so the same RNG state gives the same layout
+        at every resolution.
+        """
+        rng = rng or random
+        ground_y = height - self.ground_height
+
+        placements = []
+        for kind, (low, high), placement in THEMES[theme]['layers']:
+            count = max(1, round(rng.randint(low, high) * density))
+            sprite_width, sprite_height = self.atlas.get(kind, theme)[0].size
+
+            for _ in range(count):
+                if placement == 'sky':
+                    x = rng.randint(20, max(20, width - sprite_width - 20))
+                    y = rng.randint(20, max(20, ground_y - sprite_height - 120))
+                else:
+                    x = rng.randint(20, max(20, width - sprite_width - 20))
+                    y = ground_y - sprite_height
+                placements.append((kind, round(x * scale), round(y * scale)))
+
+        return placements
+
+    def compose(self, width=800, height=600, rng=None, theme='countryside', density=1.0, scale=1.0):
+        """Compose a scene and return it with the bounding box of every object"""
+        spec = THEMES[theme]
+        canvas_width, canvas_height = round(width * scale), round(height * scale)
+
+        img = Image.new('RGB', (canvas_width, canvas_height), color=spec['sky'])
+        draw = ImageDraw.Draw(img)
+        draw.rectangle([0, self.ground_line(height, scale), canvas_width, canvas_height], fill=spec['ground'])
+
+        objects = []
+        for kind, left, top in self.layout(width, height, rng, theme, density, scale):
+            sprite, mask = self.atlas.get(kind, theme, scale)
+            img.paste(sprite, (left, top), mask)
+            objects.append({
+                'kind': kind,
+                'bbox': (left, top, left + sprite.width, top + sprite.height)
+            })
+
+        return img, objects
@@ -0,0 +1,276 @@
+import os
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Priority classes; pass rate_limit_args={'priority': ...} to override the per-method default
+GAMEPLAY = 0
+NORMAL = 1
+LOW = 2
+
+DEFAULT_PRIORITIES = {
+    'sendPhoto': GAMEPLAY,
+    'sendMediaGroup': GAMEPLAY,
+    'editMessageText': LOW,
+    'editMessageCaption': LOW,
+    'editMessageReplyMarkup': LOW
+}
+# Edits that replace the whole previous edit, so only the newest pending one needs sending
+COALESCED_METHODS = ('editMessageText', 'editMessageCaption', 'editMessageReplyMarkup')
+
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `capacity`"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token is available; 0 if one is available now"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def hold_until(self, until):
+        """Hand out nothing before `until`, as when Telegram asks us to back off"""
+        self.tokens = min(self.tokens, 0)
+        self.updated = max(self.updated, until)
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Request:
+    __slots__ = ('callback', 'args', 'kwargs', 'chat_id', 'coalesce_key', 'order', 'seq', 'not_before',
+                 'attempts', 'future')
+
+    def __lt__(self, other):
+        return (self.order, self.seq) < (other.order, other.seq)
+
+
+class SendScheduler(BaseRateLimiter):
+    """Queues outgoing Bot API calls and sends them within Telegram's flood limits
+
+    Calls go out when both the global token bucket and the target chat's bucket
+    have a token. Among ready calls the one with the earliest deadline goes
+    first, a call's deadline being its arrival time plus `priority_delay`
+    seconds per priority class, so gameplay images overtake leaderboard edits
+    without starving them. A pending edit to a message is replaced by a newer
+    edit to the same message, and everyone waiting gets the newer result. A
+    429 holds the chat back for the time Telegram asks, plus a growing margin,
+    and the call is retried.
+    """
+
+    def __init__(self, global_rate=30.0, global_burst=30, chat_rate=1.0, chat_burst=4,
+                 group_rate=20 / 60, group_burst=3, priority_delay=1.0, max_retries=8):
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.priority_delay = priority_delay
+        self.max_retries = max_retries
+        self.sent = 0
+        self.coalesced = 0
+        self.retries = 0
+
+        self._global = TokenBucket(global_rate, global_burst, time.monotonic())
+        self._chats = {}
+        self._queue = []
+        self._pending_edits = {}
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._task = None
+        self._inflight = set()
+
+    @classmethod
+    def from_env(cls):
+        """Build a scheduler from SEND_* environment variables"""
+        return cls(
+            global_rate=float(os.getenv('SEND_GLOBAL_RATE', '30')),
+            chat_rate=float(os.getenv('SEND_CHAT_RATE', '1')),
+            chat_burst=int(os.getenv('SEND_CHAT_BURST', '4')),
+            priority_delay=float(os.getenv('SEND_PRIORITY_DELAY', '1.0'))
+        )
+
+    @property
+    def queued(self):
+        return len(self._queue)
+
+    def stats(self):
+        return {'queued': self.queued, 'sent': self.sent, 'coalesced': self.coalesced, 'retries': self.retries}
+
+    async def initialize(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._dispatch_loop())
+
+    async def shutdown(self):
+        if self._task is None:
+            return
+        # Give queued calls a moment to go out before giving up on them
+        deadline = time.monotonic() + 5
+        while (self._queue or self._inflight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        for request in self._queue:
+            request.future.cancel()
+        self._queue.clear()
+        self._pending_edits.clear()
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                # Idle chats have full buckets and can be recreated as new
+                self._chats = {c: b for c, b in self._chats.items() if not b.is_full(now)}
+            group = isinstance(chat_id, int) and chat_id < 0
+            bucket = TokenBucket(
+                self.group_rate if group else self.chat_rate,
+                self.group_burst if group else self.chat_burst,
+                now
+            )
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        if chat_id is None or self._task is None:
+            # Not a message to a chat (answerCallbackQuery, getMe, ...): nothing to pace
+            return await callback(*args, **kwargs)
+
+        coalesce_key = None
+        if endpoint in COALESCED_METHODS and data.get('message_id') is not None:
+            coalesce_key = (endpoint, chat_id, data['message_id'])
+            pending = self._pending_edits.get(coalesce_key)
+            if pending is not None:
+                # Newer content wins; the earlier caller shares the newer result
+                pending.args, pending.kwargs = args, kwargs
+                self.coalesced += 1
+                return await asyncio.shield(pending.future)
+
+        priority = DEFAULT_PRIORITIES.get(endpoint, NORMAL)
+        if rate_limit_args and 'priority' in rate_limit_args:
+            priority = rate_limit_args['priority']
+
+        now = time.monotonic()
+        request = _Request()
+        request.callback = callback
+        request.args = args
+        request.kwargs = kwargs
+        request.chat_id = chat_id
+        request.coalesce_key = coalesce_key
+        request.order = now + priority * self.priority_delay
+        request.seq = next(self._seq)
+        request.not_before = 0.0
+        request.attempts = 0
+        request.future = asyncio.get_running_loop().create_future()
+        if coalesce_key is not None:
+            self._pending_edits[coalesce_key] = request
+
+        heapq.heappush(self._queue, request)
+        self._wakeup.set()
+        return await asyncio.shield(request.future)
+
+    def _pick(self, now):
+        """Take the first ready request in deadline order, or return how long to wait"""
+        wait = self._global.wait_time(now)
+        if wait > 0:
+            return None, wait
+
+        skipped = []
+        blocked_chats = set()
+        picked = None
+        wait = None
+        while self._queue:
+            request = heapq.heappop(self._queue)
+            if request.chat_id in blocked_chats:
+                skipped.append(request)
+                continue
+            bucket = self._chat_bucket(request.chat_id, now)
+            ready_in = max(request.not_before - now, bucket.wait_time(now))
+            if ready_in > 0:
+                # Keep the chat's calls in order behind the one that is waiting
+                blocked_chats.add(request.chat_id)
+                skipped.append(request)
+                wait = ready_in if wait is None else min(wait, ready_in)
+                continue
+            bucket.take(now)
+            self._global.take(now)
+            picked = request
+            break
+
+        for request in skipped:
+            heapq.heappush(self._queue, request)
+        return picked, wait
+
+    async def _dispatch_loop(self):
+        while True:
+            picked, wait = self._pick(time.monotonic())
+            if picked is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            if picked.coalesce_key is not None and self._pending_edits.get(picked.coalesce_key) is picked:
+                # Edits arriving from now on can't change what is being sent
+                del self._pending_edits[picked.coalesce_key]
+            task = asyncio.create_task(self._send(picked))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _send(self, request):
+        try:
+            result = await request.callback(*request.args, **request.kwargs)
+        except RetryAfter as e:
+            request.attempts += 1
+            if request.attempts > self.max_retries:
+                logger.error(f"Giving up on a call to chat {request.chat_id} after {request.attempts} flood waits")
+                if not request.future.done():
+                    request.future.set_exception(e)
+                return
+            self.retries += 1
+            # Back off a little further each time Telegram pushes back on the same call
+            request.not_before = time.monotonic() + e.retry_after * (1 + 0.25 * (request.attempts - 1))
+            self._chat_bucket(request.chat_id, time.monotonic()).hold_until(request.not_before)
+            logger.warning(f"Flood limit for chat {request.chat_id}, retrying in {request.not_before - time.monotonic():.1f}s")
+            heapq.heappush(self._queue, request)
+            self._wakeup.set()
+            return
+        except Exception as e:
+            if not request.future.done():
+                request.future.set_exception(e)
+            return
+
+        self.sent += 1
+        if not request.future.done():
+            request.future.set_result(result)
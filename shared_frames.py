@@ -0,0 +1,181 @@
+import os
+import logging
+from collections import deque
+from multiprocessing.shared_memory import SharedMemory
+
+logger = logging.getLogger(__name__)
+
+# Encoded image fields of a game that travel through the ring
+FRAME_KEYS = ('composite_bytes', 'original_bytes', 'modified_bytes')
+
+# Rings attached inside a worker process, by name
+_attached = {}
+
+
+class SharedFrame:
+    """Where a worker left one encoded image: (slot, offset, length) in the ring"""
+
+    __slots__ = ('slot', 'offset', 'length')
+
+    def __init__(self, slot, offset, length):
+        self.slot = slot
+        self.offset = offset
+        self.length = length
+
+    def __reduce__(self):
+        return SharedFrame, (self.slot, self.offset, self.length)
+
+
+def _attach(name):
+    shm = _attached.get(name)
+    if shm is None:
+        shm = _attached[name] = SharedMemory(name=name)
+    return shm
+
+
+def write_frames(game, ring_name, slot, slot_bytes):
+    """Move a game's encoded images into its ring slot, in the worker
+
+    The image fields are replaced with SharedFrame handles, so only the
+    handles and metadata are pickled back. A game too big for a slot is
+    returned unchanged and its bytes travel the usual way.
+    """
+    keys = [key for key in FRAME_KEYS if key in game]
+    if sum(len(game[key]) for key in keys) > slot_bytes:
+        return game
+
+    buf = _attach(ring_name).buf
+    offset = 0
+    base = slot * slot_bytes
+    for key in keys:
+        data = game[key]
+        buf[base + offset:base + offset + len(data)] = data
+        game[key] = SharedFrame(slot, offset, len(data))
+        offset += len(data)
+    game['frame_slot'] = slot
+    return game
+
+
+class FrameReader:
+    """Read-only file over an encoded image, so an upload streams straight from its buffer
+
+    read() returns memoryview slices rather than copies, so an image in a ring
+    slot goes from shared memory to the socket without a bytes copy of its own.
+    Seekable, so the HTTP client can size the body and rewind it for a retry.
+    """
+
+    def __init__(self, data):
+        self._view = memoryview(data)
+        self._pos = 0
+
+    def read(self, size=-1):
+        end = len(self._view) if size is None or size < 0 else min(self._pos + size, len(self._view))
+        chunk = self._view[self._pos:end]
+        self._pos = end
+        return chunk
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self._pos, os.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+def claim_bytes(game, key):
+    """A game's image as bytes, copying it out of shared memory if it is still a view there"""
+    data = game[key]
+    if isinstance(data, memoryview):
+        view = data
+        data = game[key] = view.tobytes()
+        view.release()
+    return data
+
+
+class FrameRing:
+    """Fixed ring of shared-memory slots that carries encoded games from workers
+
+    The bot process creates the ring and hands a free slot to each generation
+    job; the worker writes the encoded images into it and returns only their
+    offsets. The bot reads them as memoryviews straight out of the slot and
+    releases it once the game has been uploaded. With every slot in use, jobs
+    fall back to returning plain bytes.
+    """
+
+    def __init__(self, slots=64, slot_bytes=1024 * 1024):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.fallbacks = 0
+        self._shm = None
+        self._free = deque()
+
+    @classmethod
+    def from_env(cls):
+        """Build a ring from FRAME_RING_* environment variables"""
+        return cls(
+            slots=int(os.getenv('FRAME_RING_SLOTS', '64')),
+            slot_bytes=int(os.getenv('FRAME_RING_SLOT_KB', '1024')) * 1024
+        )
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def in_use(self):
+        return self.slots - len(self._free)
+
+    def stats(self):
+        return {'slots': self.slots, 'in_use': self.in_use, 'fallbacks': self.fallbacks}
+
+    def open(self):
+        if self._shm is None:
+            self._shm = SharedMemory(create=True, size=self.slots * self.slot_bytes)
+            self._free = deque(range(self.slots))
+            logger.info(f"Frame ring {self._shm.name}: {self.slots} x {self.slot_bytes // 1024} KiB")
+
+    def close(self):
+        if self._shm is None:
+            return
+        self._shm.unlink()
+        try:
+            self._shm.close()
+        except BufferError:
+            # Games still holding views keep the mapping alive until they are dropped
+            logger.warning(f"Frame ring closed with {self.in_use} slots still in use")
+        self._shm = None
+
+    def acquire(self):
+        """A free slot for the next job, or None if the ring is full"""
+        if self._shm is None or not self._free:
+            self.fallbacks += 1
+            return None
+        return self._free.popleft()
+
+    def release(self, slot):
+        self._free.append(slot)
+
+    def adopt(self, game, slot):
+        """Turn a worker's SharedFrame handles back into memoryviews over the slot"""
+        if game.get('frame_slot') != slot:
+            # The worker sent plain bytes instead
+            self.release(slot)
+            return game
+        base = slot * self.slot_bytes
+        buf = self._shm.buf
+        for key in FRAME_KEYS:
+            frame = game.get(key)
+            if isinstance(frame, SharedFrame):
+                game[key] = buf[base + frame.offset:base + frame.offset + frame.length]
+        return game
+
+    def release_game(self, game):
+        """Copy out whatever the game still reads from its slot and free the slot"""
+        slot = game.pop('frame_slot', None)
+        if slot is None:
+            return
+        for key in FRAME_KEYS:
+            if key in game:
+                claim_bytes(game, key)
+        self.release(slot)
@@ -0,0 +1,23 @@
+from active_games import ActiveGameRegistry
+
+
+class FakeHitIndex:
+    def nbytes(self):
+        return 0
+
+
+def game_data(game_id):
+    return {'game_id': game_id, 'difficulty': 50, 'total_differences': 5, 'width': 800, 'height': 600}
+
+
+def test_replaced_game_is_handed_to_on_replace():
+    replaced = []
+    registry = ActiveGameRegistry(on_replace=replaced.append)
+    first = registry.add(1, 10, game_data('a'), 5, FakeHitIndex())
+    registry.add(2, 20, game_data('b'), 5, FakeHitIndex())
+    assert replaced == []
+
+    second = registry.add(1, 10, game_data('c'), 7, FakeHitIndex())
+    assert replaced == [first] and first.join_fee == 5
+    assert registry.get(1) is second and len(registry) == 2
+    assert registry.stats()['replaced'] == 1
@@ -0,0 +1,54 @@
+import random
+import hashlib
+
+import pytest
+
+from game_storage import GameStorage
+from difference_game_generator import DifferenceGameGenerator, GENERATOR_VERSION
+
+# Pixels of level 50 seed 7 as each generator version drew them, hashed from that version's tree
+VERSION_HASHES = {
+    1: 'e334ecf826fe6faa173a472118981c903dfcd754',
+    2: '4f3f3dc612f9f464177a7afa4c4d2c5a89604e46',
+    3: '8526d6310569ffee58a22d28fb82c78fe952b415',
+    4: '4c9cf2a6cbb31fb85400fa39cdb2887996a5a9c0',
+    5: '4c9cf2a6cbb31fb85400fa39cdb2887996a5a9c0',
+}
+
+
+def stored_record(generator, version, seed=7):
+    record = {'game_id': f'v{version}', 'seed': seed, 'difficulty': 50, 'total_differences': 5,
+              'generator_version': version, 'created_at': '2024-01-01T00:00:00'}
+    if version > 1:
+        # Version 1 records had no theme, density, renderer or scale
+        theme = random.Random(seed).choice(generator.themes)
+        record.update(theme=theme, density=1.0, renderer='single', render_scale=1.0)
+    return record
+
+
+@pytest.mark.parametrize('version', sorted(VERSION_HASHES))
+def test_every_generator_version_re_renders_its_games(version):
+    generator = DifferenceGameGenerator()
+    game = generator.render_game(stored_record(generator, version))
+    pixels = game['original_image'].tobytes() + game['modified_image'].tobytes()
+    assert hashlib.sha1(pixels).hexdigest() == VERSION_HASHES[version]
+    assert game['game_data']['generator_version'] == version
+    assert game['game_data']['created_at'] == '2024-01-01T00:00:00'
+
+
+def test_unknown_generator_version_is_rejected():
+    generator = DifferenceGameGenerator()
+    with pytest.raises(ValueError):
+        generator.render_game(stored_record(generator, GENERATOR_VERSION + 1))
+
+
+def test_records_are_kept_unless_expiry_is_enabled(tmp_path):
+    storage = GameStorage(str(tmp_path / 'forever'))
+    storage.save_records([{'game_id': 'old'}])
+    storage.collect(now=10 ** 12)
+    assert storage.record('old') == {'game_id': 'old'}
+
+    storage = GameStorage(str(tmp_path / 'expiring'), record_ttl=60, max_records=1)
+    storage.save_records([{'game_id': 'old'}])
+    storage.collect(now=10 ** 12)
+    assert storage.record('old') is None
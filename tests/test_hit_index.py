@@ -0,0 +1,61 @@
+import numpy as np
+
+from hit_index import DifferenceHitIndex, dilate_mask, pack_mask, unpack_mask
+
+
+def random_differences(rng, width, height, count):
+    differences = []
+    for diff_id in range(1, count + 1):
+        w, h = rng.integers(3, 60, size=2)
+        left = int(rng.integers(-10, width - 5))
+        top = int(rng.integers(-10, height - 5))
+        mask = rng.random((h, w)) < 0.6
+        differences.append({'id': diff_id, 'bbox': (left, top, left + int(w), top + int(h)), 'mask': pack_mask(mask)})
+    return differences
+
+
+def covering(differences, x, y, tolerance):
+    """Ids whose (dilated) mask covers (x, y), straight from the packed masks"""
+    ids = set()
+    for diff in differences:
+        left, top, right, bottom = diff['bbox']
+        mask = dilate_mask(unpack_mask(diff['mask'], right - left, bottom - top), tolerance)
+        row, col = y - top + tolerance, x - left + tolerance
+        if 0 <= row < mask.shape[0] and 0 <= col < mask.shape[1] and mask[row, col]:
+            ids.add(diff['id'])
+    return ids
+
+
+def test_pack_mask_round_trips():
+    rng = np.random.default_rng(1)
+    for width, height in ((1, 1), (7, 3), (33, 17)):
+        mask = rng.random((height, width)) < 0.5
+        assert np.array_equal(unpack_mask(pack_mask(mask), width, height), mask)
+
+
+def test_lookup_matches_packed_masks():
+    rng = np.random.default_rng(2)
+    width, height = 200, 150
+    for tolerance in (0, 3):
+        differences = random_differences(rng, width, height, 8)
+        index = DifferenceHitIndex(width, height, differences, cell_size=16, tolerance=tolerance)
+        for y in range(-2, height + 2):
+            for x in range(-2, width + 2):
+                expected = covering(differences, x, y, tolerance) if 0 <= x < width and 0 <= y < height else set()
+                found = index.lookup(x, y)
+                if expected:
+                    assert found in expected, (x, y, tolerance)
+                else:
+                    assert found is None, (x, y, tolerance)
+
+
+def test_dilate_mask_matches_brute_force():
+    rng = np.random.default_rng(3)
+    mask = rng.random((12, 9)) < 0.1
+    radius = 2
+    grown = dilate_mask(mask, radius)
+    padded = np.pad(mask, radius)
+    for row in range(grown.shape[0]):
+        for col in range(grown.shape[1]):
+            window = padded[max(0, row - radius):row + radius + 1, max(0, col - radius):col + radius + 1]
+            assert grown[row, col] == window.any()
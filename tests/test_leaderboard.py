@@ -0,0 +1,64 @@
+import random
+
+import pytest
+
+from leaderboard import IndexableSkipList, LeaderboardIndex
+
+
+def test_rank_and_slice_match_sorted_reference():
+    rng = random.Random(7)
+    skip_list = IndexableSkipList()
+    reference = []
+    for step in range(3000):
+        if reference and rng.random() < 0.4:
+            key = reference.pop(rng.randrange(len(reference)))
+            skip_list.remove(key)
+        else:
+            key = (rng.randrange(-500, 0), rng.randrange(10 ** 6))
+            if key in reference:
+                continue
+            skip_list.insert(key)
+            reference.append(key)
+            reference.sort()
+
+        if step % 50 == 0:
+            assert len(skip_list) == len(reference)
+            for index, key in enumerate(reference):
+                assert skip_list.rank(key) == index
+            for start in (0, 1, len(reference) // 2, len(reference) - 1, len(reference) + 3):
+                assert skip_list.slice(start, start + 10) == reference[start:start + 10]
+
+    assert skip_list.slice(0, len(reference)) == reference
+
+
+def test_missing_keys_raise():
+    skip_list = IndexableSkipList()
+    skip_list.insert((1, 1))
+    with pytest.raises(KeyError):
+        skip_list.rank((2, 2))
+    with pytest.raises(KeyError):
+        skip_list.remove((0, 0))
+    assert skip_list.slice(5, 10) == []
+    assert skip_list.slice(0, 0) == []
+
+
+def user(coins, played=0, won=0, wins_by_level=None):
+    return {'coins': coins, 'games_played': played, 'games_won': won, 'wins_by_level': wins_by_level or {}}
+
+
+def test_leaderboard_orders_by_score_then_user_id():
+    index = LeaderboardIndex([50], min_games_for_win_rate=5)
+    index.update(1, user(100, played=10, won=5, wins_by_level={'50': 3}))
+    index.update(2, user(300, played=2, won=2))
+    index.update(3, user(100, played=5, won=5, wins_by_level={'50': 1}))
+
+    assert index.top('coins', 10) == [(2, 300), (1, 100), (3, 100)]
+    assert index.rank('coins', 3) == 3
+    # Too few games for a win rate keeps a user off that board
+    assert index.top('win_rate', 10) == [(3, 100.0), (1, 50.0)]
+    assert index.rank('win_rate', 2) is None
+    assert index.page('wins_50', 0, page_size=1) == [(1, 3)]
+
+    index.update(3, user(500, played=5, won=5))
+    assert index.top('coins', 2) == [(3, 500), (2, 300)]
+    assert index.size('coins') == 3
@@ -0,0 +1,140 @@
+import json
+import asyncio
+
+import pytest
+
+from ledger import CoinLedger, InsufficientFundsError
+
+
+def make_ledger(tmp_path, **kwargs):
+    return CoinLedger(str(tmp_path / 'ledger.journal'), str(tmp_path / 'ledger.snapshot'), **kwargs)
+
+
+def write_lines(path, lines):
+    with open(path, 'w') as f:
+        f.write(''.join(lines))
+
+
+def entry(seq, user_id, balance):
+    return json.dumps({'seq': seq, 'user_id': user_id, 'amount': 0, 'balance': balance}) + "\n"
+
+
+def test_load_replays_journal_after_snapshot(tmp_path):
+    with open(tmp_path / 'ledger.snapshot', 'w') as f:
+        json.dump({'seq': 3, 'balances': {'1': 10, '2': 20}}, f)
+    # Entries up to the snapshot were left behind by a crash before truncation
+    write_lines(tmp_path / 'ledger.journal', [
+        entry(2, 1, 999),
+        entry(3, 2, 999),
+        entry(4, 1, 15),
+        entry(5, 3, 7),
+    ])
+
+    ledger = make_ledger(tmp_path)
+    ledger.load()
+
+    assert ledger.balances == {1: 15, 2: 20, 3: 7}
+    assert ledger._seq == 5
+    assert ledger._since_snapshot == 2
+
+
+def test_load_ignores_torn_journal_tail(tmp_path):
+    with open(tmp_path / 'ledger.snapshot', 'w') as f:
+        json.dump({'seq': 1, 'balances': {'1': 10}}, f)
+    torn = entry(3, 1, 40)[:-12]
+    write_lines(tmp_path / 'ledger.journal', [entry(2, 1, 25), torn])
+
+    ledger = make_ledger(tmp_path)
+    ledger.load()
+
+    assert ledger.balances == {1: 25}
+    assert ledger._seq == 2
+
+
+def test_committed_entries_survive_restart(tmp_path):
+    async def run():
+        ledger = make_ledger(tmp_path, snapshot_every=3)
+        ledger.load()
+        ledger.start()
+        try:
+            for amount in (5, 7, 11, 13):
+                await ledger.credit(1, amount, 'test')
+            await ledger.debit(1, 6, 'test')
+            with pytest.raises(InsufficientFundsError):
+                await ledger.debit(2, 1, 'test')
+        finally:
+            await asyncio.to_thread(ledger.close)
+
+    asyncio.run(run())
+
+    reloaded = make_ledger(tmp_path)
+    reloaded.load()
+    assert reloaded.balances == {1: 30}
+
+
+class FailingJournal:
+    """Writes half of what it is given, then fails like a full disk"""
+
+    def __init__(self, journal):
+        self.journal = journal
+
+    def write(self, data):
+        self.journal.write(data[:len(data) // 2])
+        raise OSError(28, 'No space left on device')
+
+    def __getattr__(self, name):
+        return getattr(self.journal, name)
+
+
+def test_failed_write_is_rolled_back_and_close_returns(tmp_path):
+    async def run():
+        ledger = make_ledger(tmp_path)
+        ledger.load()
+        ledger.start()
+        await ledger.credit(1, 10, 'test')
+
+        journal = ledger._journal
+        ledger._journal = FailingJournal(journal)
+        with pytest.raises(OSError):
+            await ledger.credit(1, 5, 'test')
+        assert ledger.balance(1) == 10
+
+        ledger._journal = journal
+        await ledger.credit(1, 1, 'test')
+        await asyncio.wait_for(asyncio.to_thread(ledger.close), 5)
+
+    asyncio.run(run())
+
+    # The half-written entry was cut off, so nothing torn sits between the good ones
+    with open(tmp_path / 'ledger.journal') as f:
+        balances = [json.loads(line)['balance'] for line in f]
+    assert balances == [10, 11]
+
+    reloaded = make_ledger(tmp_path)
+    reloaded.load()
+    assert reloaded.balances == {1: 11}
+
+
+def test_torn_tail_is_cut_before_new_entries_are_appended(tmp_path):
+    write_lines(tmp_path / 'ledger.journal', [entry(1, 1, 10), entry(2, 1, 40)[:-9]])
+
+    async def restart_and_credit(amounts):
+        ledger = make_ledger(tmp_path)
+        ledger.load()
+        ledger.start()
+        try:
+            for amount in amounts:
+                await ledger.credit(1, amount, 'test')
+        finally:
+            await asyncio.to_thread(ledger.close)
+        return ledger.balance(1)
+
+    assert asyncio.run(restart_and_credit([1, 11, 100])) == 122
+    # A second restart must still see every entry acknowledged after the first
+    assert asyncio.run(restart_and_credit([])) == 122
+
+    reloaded = make_ledger(tmp_path)
+    reloaded.load()
+    assert reloaded.balances == {1: 122}
+    with open(tmp_path / 'ledger.journal') as f:
+        assert [json.loads(line)['balance'] for line in f] == [10, 11, 22, 122]
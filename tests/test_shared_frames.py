@@ -0,0 +1,26 @@
+import os
+
+import httpx
+
+from shared_frames import FrameReader
+
+
+def test_reader_hands_out_views_and_rewinds():
+    data = bytearray(b'abcdefgh')
+    reader = FrameReader(memoryview(data))
+    chunk = reader.read(3)
+    assert isinstance(chunk, memoryview) and chunk == b'abc'
+    data[0:1] = b'z'
+    assert chunk == b'zbc'  # A view, not a copy
+    assert reader.read() == b'defgh' and reader.read(4) == b''
+    assert reader.seek(0, os.SEEK_END) == 8 and reader.tell() == 8
+    reader.seek(2)
+    assert reader.read(2) == b'cd'
+
+
+def test_multipart_upload_streams_the_whole_frame():
+    payload = bytes(range(256)) * 1000
+    request = httpx.Request('POST', 'http://telegram/', files={'photo': ('photo', FrameReader(payload), 'image/webp')})
+    body = request.read()
+    assert int(request.headers['content-length']) == len(body)
+    assert body.count(payload) == 1
@@ -0,0 +1,46 @@
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from ledger import KeyedLocks
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Process updates concurrently, but each user's updates one at a time and in order
+
+    The application starts updates in arrival order, and each takes its
+    user's FIFO lock before a concurrency slot. That keeps every user's taps
+    in the order Telegram delivered them while different users run in
+    parallel. A user's queued taps wait on their own lock without holding
+    slots, so they can't hold back other users' updates.
+    """
+
+    def __init__(self, max_concurrent_updates=64):
+        super().__init__(max_concurrent_updates)
+        self._locks = KeyedLocks()
+
+    @staticmethod
+    def ordering_key(update):
+        """Updates sharing a key are serialized; None means no ordering needed"""
+        if isinstance(update, Update):
+            if update.effective_user is not None:
+                return update.effective_user.id
+            if update.effective_chat is not None:
+                return update.effective_chat.id
+        return None
+
+    async def process_update(self, update, coroutine):
+        # The base class takes a slot and then calls do_process_update; queue on the user first
+        key = self.ordering_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+        async with self._locks.hold(key):
+            await super().process_update(update, coroutine)
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
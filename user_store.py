@@ -0,0 +1,129 @@
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class UserStore:
+    """SQLite-backed user storage with a read cache and write-behind group commits
+
+    Reads are served from memory. Writes update the cache immediately and queue
+    a snapshot for a background thread, which commits every dirty user in one
+    transaction every `flush_interval` seconds or as soon as `max_batch` users
+    are waiting. A crash loses at most the writes of one commit window.
+    """
+
+    def __init__(self, path='users.db', flush_interval=0.05, max_batch=256):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.commits = 0
+        self.rows_written = 0
+
+        self._cache = {}
+        self._dirty = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+        self._reader = self._connect()
+        self._reader.execute(
+            "CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL)"
+        )
+        self._reader.commit()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode NORMAL only syncs at checkpoints; commits survive a process crash
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def start(self):
+        """Load every user into the cache and start the writer thread"""
+        for user_id, data in self._reader.execute("SELECT user_id, data FROM users"):
+            self._cache[user_id] = json.loads(data)
+        logger.info(f"Loaded {len(self._cache)} users from {self.path}")
+
+        self._thread = threading.Thread(target=self._writer_loop, name='user-store-writer', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Flush pending writes and stop the writer thread"""
+        if self._thread is not None:
+            self._stopping = True
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+        self._reader.close()
+
+    def get(self, user_id):
+        """Return a user's data, or None if they have never been saved"""
+        data = self._cache.get(user_id)
+        if data is None:
+            row = self._reader.execute("SELECT data FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            if row is not None:
+                data = json.loads(row[0])
+                self._cache[user_id] = data
+        return data
+
+    def put(self, user_id, data):
+        """Update the cache now and queue the user for the next group commit"""
+        self._cache[user_id] = data
+        # Snapshot now, so later in-place edits can't race the writer thread
+        snapshot = json.dumps(data)
+        with self._lock:
+            self._dirty[user_id] = snapshot
+            pending = len(self._dirty)
+        if pending >= self.max_batch:
+            self._wakeup.set()
+
+    def values(self):
+        """Every cached user"""
+        return self._cache.values()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def _take_dirty(self):
+        with self._lock:
+            batch, self._dirty = self._dirty, {}
+        return batch
+
+    def _writer_loop(self):
+        conn = self._connect()
+        try:
+            while True:
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+                batch = self._take_dirty()
+                if batch:
+                    self._commit(conn, batch)
+                if self._stopping and not self._dirty:
+                    break
+        finally:
+            conn.close()
+
+    def _commit(self, conn, batch):
+        started = time.perf_counter()
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO users (user_id, data) VALUES (?, ?)",
+                    batch.items()
+                )
+        except sqlite3.Error as e:
+            logger.error(f"User store commit failed, will retry: {e}")
+            # Put the batch back unless a newer snapshot arrived meanwhile
+            with self._lock:
+                for user_id, snapshot in batch.items():
+                    self._dirty.setdefault(user_id, snapshot)
+            time.sleep(self.flush_interval)
+            return
+        self.commits += 1
+        self.rows_written += len(batch)
+        logger.debug(f"Committed {len(batch)} users in {(time.perf_counter() - started) * 1000:.1f}ms")